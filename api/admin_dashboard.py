@@ -1,36 +1,378 @@
-from fastapi import APIRouter, HTTPException, Depends
+import asyncio
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+from typing import List, Literal, Optional
+from datetime import datetime
 from db.session import db_dependency
-from db.models import Product, Order, User
 from core.rbac import has_role
+from crud.admin import resolve_fields, list_page, stream_rows, search_users
+from crud.export import stream_order_export
+from crud.provisioning import (
+    PROVISION_BATCH_SIZE,
+    UserProvisioner,
+    iter_ndjson_records,
+)
+from crud.campaign import campaign_runner, create_campaign, get_campaign_progress
+from schema.campaign import CampaignCreate, CampaignStart
+from core.outbox import outbox_dispatcher
+from db.models import OrderStatus
+from core.analytics import analytics_store, DEFAULT_PRICE_BANDS
+from crud.rollups import (
+    get_revenue_series,
+    get_orders_by_status_series,
+    get_top_products,
+)
 
 router = APIRouter()
 
 
-# Endpoint for fetching all products (admin access)
-@router.get("/admin/products/", dependencies=[Depends(has_role(["admin"]))])
-async def list_products(db: db_dependency):
+# LIST RESOURCE
+# Shared implementation of the admin listing endpoints.
+# Parameters:
+# - `resource`: One of "products", "orders" or "users".
+# - `limit`: Page size (1-1000, default 100); ignored when streaming.
+# - `after_id`: Return rows with an id greater than this (the previous page's `next_after_id`).
+# - `fields`: Comma-separated column projection; relationships are never loaded.
+# - `stream`: When true, streams every row after `after_id` instead of returning one page.
+# - `format`: Streaming format, "ndjson" (one object per line) or "json" (a single array).
+# Returns:
+# - A page `{resource: [...], "next_after_id": ...}` or a streaming response.
+def _list_resource(
+    resource: str,
+    db,
+    limit: int,
+    after_id: Optional[int],
+    fields: Optional[str],
+    stream: bool,
+    format: str,
+):
+    try:
+        model, columns = resolve_fields(resource, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if stream:
+        media_type = "application/x-ndjson" if format == "ndjson" else "application/json"
+        return StreamingResponse(
+            stream_rows(model, columns, fmt=format, after_id=after_id),
+            media_type=media_type,
+        )
     try:
-        products = db.query(Product).all()
-        return {"products": products}
+        rows, next_after_id = list_page(db, model, columns, limit, after_id)
+        return {resource: rows, "next_after_id": next_after_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# Endpoint for fetching all orders (admin access)
+# Endpoint for fetching products (admin access)
+@router.get("/admin/products/", dependencies=[Depends(has_role(["admin"]))])
+async def list_products(
+    db: db_dependency,
+    limit: int = Query(100, ge=1, le=1000),
+    after_id: Optional[int] = None,
+    fields: Optional[str] = None,
+    stream: bool = False,
+    format: Literal["ndjson", "json"] = "ndjson",
+):
+    return _list_resource("products", db, limit, after_id, fields, stream, format)
+
+
+# Endpoint for fetching orders (admin access)
 @router.get("/admin/orders/", dependencies=[Depends(has_role(["admin"]))])
-async def list_orders(db: db_dependency):
-    try:
-        orders = db.query(Order).all()
-        return {"orders": orders}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def list_orders(
+    db: db_dependency,
+    limit: int = Query(100, ge=1, le=1000),
+    after_id: Optional[int] = None,
+    fields: Optional[str] = None,
+    stream: bool = False,
+    format: Literal["ndjson", "json"] = "ndjson",
+):
+    return _list_resource("orders", db, limit, after_id, fields, stream, format)
 
 
-# Endpoint for fetching all users (admin access)
+# Endpoint for fetching users (admin access)
 @router.get("/admin/users/", dependencies=[Depends(has_role(["admin"]))])
-async def list_users(db: db_dependency):
+async def list_users(
+    db: db_dependency,
+    limit: int = Query(100, ge=1, le=1000),
+    after_id: Optional[int] = None,
+    fields: Optional[str] = None,
+    stream: bool = False,
+    format: Literal["ndjson", "json"] = "ndjson",
+):
+    return _list_resource("users", db, limit, after_id, fields, stream, format)
+
+
+# Endpoint for searching users by email, username, full name or phone (admin access)
+# Parameters:
+# - `q`: The search term (case-insensitive, 1-100 characters).
+# - `mode`: "substring" (default) matches anywhere; "prefix" matches the start of a column.
+# - `limit`: Page size (1-200, default 50).
+# - `after_id`: Return users with an id greater than this (the previous page's `next_after_id`).
+# Details:
+# - Backed by pg_trgm GIN indexes on PostgreSQL and an FTS5 trigram table on SQLite.
+@router.get("/admin/users/search", dependencies=[Depends(has_role(["admin"]))])
+async def search_users_endpoint(
+    db: db_dependency,
+    q: str = Query(..., min_length=1, max_length=100),
+    mode: Literal["prefix", "substring"] = "substring",
+    limit: int = Query(50, ge=1, le=200),
+    after_id: Optional[int] = None,
+):
+    users, next_after_id = search_users(db, q.strip(), mode, limit, after_id)
+    return {"users": users, "next_after_id": next_after_id}
+
+
+# Endpoint for creating users in bulk (admin access)
+# Body:
+# - NDJSON, one `UserCreate` object per line (username, email, password, phone_number, role, ...).
+# Parameters:
+# - `send_verification`: Queue a verification email for every new user (default true).
+# Returns:
+# - `{"created", "skipped", "invalid", "rejected"}`; `rejected` lists the first skipped or
+#   invalid records with their line number and reason.
+# Details:
+# - The body is read as a stream and provisioned in batches: one uniqueness query, parallel
+#   bcrypt hashing across processes and one multi-row insert per batch.
+@router.post("/admin/users/provision", dependencies=[Depends(has_role(["admin"]))])
+async def provision_users(
+    request: Request, db: db_dependency, send_verification: bool = True
+):
+    provisioner = UserProvisioner(db, send_verification=send_verification)
+    batch = []
+    async for record in iter_ndjson_records(request.stream()):
+        batch.append(record)
+        if len(batch) >= PROVISION_BATCH_SIZE:
+            await asyncio.to_thread(provisioner.provision_batch, batch)
+            batch = []
+    if batch:
+        await asyncio.to_thread(provisioner.provision_batch, batch)
+    outbox_dispatcher.wake()
+    return provisioner.summary()
+
+
+# Endpoint for creating an email campaign (admin access)
+# Body:
+# - `CampaignCreate`: name, segment ("all_active" or "abandoned_cart"), subject and body
+#   templates with `$placeholders`, subtype ("plain" or "html") and an optional send rate.
+# Returns:
+# - The draft campaign and its progress; start it with `/admin/campaigns/{id}/start`.
+@router.post("/admin/campaigns", dependencies=[Depends(has_role(["admin"]))])
+async def create_campaign_endpoint(campaign: CampaignCreate, db: db_dependency):
+    created = create_campaign(db, **campaign.model_dump())
+    return get_campaign_progress(db, created.id)
+
+
+# Endpoint for reading a campaign's progress (admin access)
+# Returns:
+# - Status, checkpoint, sent/failed counters and deliveries by status.
+@router.get(
+    "/admin/campaigns/{campaign_id}", dependencies=[Depends(has_role(["admin"]))]
+)
+async def campaign_progress(campaign_id: int, db: db_dependency):
+    return get_campaign_progress(db, campaign_id)
+
+
+# Endpoint for starting or resuming a campaign (admin access)
+# Body:
+# - Optional `rate_per_second` replacing the campaign's send rate.
+# Details:
+# - The campaign is sent in the background of this worker and resumes after its last
+#   checkpoint; recipients already claimed are never sent it again. 409 if it is
+#   completed or running elsewhere.
+@router.post(
+    "/admin/campaigns/{campaign_id}/start",
+    dependencies=[Depends(has_role(["admin"]))],
+)
+async def start_campaign(
+    campaign_id: int, db: db_dependency, options: Optional[CampaignStart] = None
+):
+    await campaign_runner.start(
+        campaign_id, options.rate_per_second if options else None
+    )
+    return get_campaign_progress(db, campaign_id)
+
+
+# Endpoint for pausing a running campaign (admin access)
+# Details:
+# - The runner stops before its next message, whichever worker it runs on; resume it
+#   with `/admin/campaigns/{id}/start`.
+@router.post(
+    "/admin/campaigns/{campaign_id}/pause",
+    dependencies=[Depends(has_role(["admin"]))],
+)
+async def pause_campaign(campaign_id: int, db: db_dependency):
+    get_campaign_progress(db, campaign_id)
+    if not campaign_runner.pause(db, campaign_id):
+        raise HTTPException(status_code=409, detail="Campaign is not running")
+    return get_campaign_progress(db, campaign_id)
+
+
+# Endpoint for exporting orders with their customer, line items and payments (admin access)
+# Parameters:
+# - `start` / `end`: Optional range on the order creation time, `[start, end)`.
+# - `status`: Optional statuses to include, e.g. `?status=delivered&status=canceled`.
+# - `after_order_id`: Resume an interrupted export after the last order received completely.
+# Details:
+# - Streams gzip-compressed CSV with one row per line item and payment, ordered by
+#   order creation time; live and archived orders are both included.
+@router.get(
+    "/admin/exports/orders.csv.gz", dependencies=[Depends(has_role(["admin"]))]
+)
+async def export_orders(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    status: Optional[List[OrderStatus]] = Query(None),
+    after_order_id: Optional[int] = None,
+):
     try:
-        users = db.query(User).all()
-        return {"users": users}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        chunks = stream_order_export(start, end, status, after_order_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        chunks,
+        media_type="application/gzip",
+        headers={"Content-Disposition": 'attachment; filename="orders.csv.gz"'},
+    )
+
+
+# Endpoint for revenue per hour or day (admin access)
+# Parameters:
+# - `grain`: "hour" or "day" (default).
+# - `start` / `end`: Optional time range; buckets starting in `[start, end)` are returned.
+# Details:
+# - Reads only the `revenue_rollups` table, which the payment flow keeps current.
+@router.get("/admin/reports/revenue", dependencies=[Depends(has_role(["admin"]))])
+async def revenue_report(
+    db: db_dependency,
+    grain: Literal["hour", "day"] = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    return {"grain": grain, "buckets": get_revenue_series(db, grain, start, end)}
+
+
+# Endpoint for order counts by status per hour or day (admin access)
+# Parameters:
+# - `grain`: "hour" or "day" (default).
+# - `start` / `end`: Optional time range; buckets starting in `[start, end)` are returned.
+# Details:
+# - Orders are bucketed by creation time and counted under their current status.
+@router.get(
+    "/admin/reports/orders-by-status", dependencies=[Depends(has_role(["admin"]))]
+)
+async def orders_by_status_report(
+    db: db_dependency,
+    grain: Literal["hour", "day"] = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    return {"grain": grain, "buckets": get_orders_by_status_series(db, grain, start, end)}
+
+
+# Endpoint for the best-selling products by units (admin access)
+# Parameters:
+# - `grain`: Rollup to read; "hour" allows hour-aligned ranges, "day" (default) is cheaper.
+# - `start` / `end`: Optional time range.
+# - `limit`: Number of products (1-100, default 10).
+@router.get("/admin/reports/top-products", dependencies=[Depends(has_role(["admin"]))])
+async def top_products_report(
+    db: db_dependency,
+    grain: Literal["hour", "day"] = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(10, ge=1, le=100),
+):
+    return {"products": get_top_products(db, grain, start, end, limit)}
+
+
+# CURRENT SNAPSHOT
+# Returns the in-memory analytics snapshot, or a 503 until the first load completes.
+def _snapshot():
+    snapshot = analytics_store.snapshot
+    if snapshot is None:
+        raise HTTPException(
+            status_code=503, detail="Analytics snapshot is still loading"
+        )
+    return snapshot
+
+
+# Endpoint for the distribution of line items per order (admin access)
+# Details:
+# - This and the other `/admin/analytics/` endpoints answer from a NumPy column
+#   store refreshed every few minutes; they never query the database.
+@router.get(
+    "/admin/analytics/basket-sizes", dependencies=[Depends(has_role(["admin"]))]
+)
+async def basket_sizes(start: Optional[datetime] = None, end: Optional[datetime] = None):
+    snapshot = _snapshot()
+    return {
+        "snapshot_at": snapshot.loaded_at,
+        **snapshot.basket_size_distribution(start, end),
+    }
+
+
+# Endpoint for units and revenue by product price band (admin access)
+# Parameters:
+# - `edges`: Upper edges of the bands, e.g. `?edges=10&edges=50`; a final open band is added.
+@router.get(
+    "/admin/analytics/price-bands", dependencies=[Depends(has_role(["admin"]))]
+)
+async def price_bands(
+    edges: Optional[List[float]] = Query(None),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    snapshot = _snapshot()
+    bands = snapshot.revenue_by_price_band(
+        edges or DEFAULT_PRICE_BANDS, start=start, end=end
+    )
+    return {"snapshot_at": snapshot.loaded_at, "bands": bands}
+
+
+# Endpoint for order value percentiles, optionally per status (admin access)
+@router.get(
+    "/admin/analytics/order-values", dependencies=[Depends(has_role(["admin"]))]
+)
+async def order_values(
+    by_status: bool = False,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    snapshot = _snapshot()
+    return {
+        "snapshot_at": snapshot.loaded_at,
+        "order_values": snapshot.order_value_percentiles(
+            by_status=by_status, start=start, end=end
+        ),
+    }
+
+
+# Endpoint for the top products by units or revenue (admin access)
+@router.get(
+    "/admin/analytics/top-products", dependencies=[Depends(has_role(["admin"]))]
+)
+async def analytics_top_products(
+    k: int = Query(10, ge=1, le=100),
+    by: Literal["units", "revenue"] = "units",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    snapshot = _snapshot()
+    return {
+        "snapshot_at": snapshot.loaded_at,
+        "products": snapshot.top_products(k, by, start, end),
+    }
+
+
+# Endpoint for monthly signup-cohort retention (admin access)
+# Parameters:
+# - `months`: Number of months after signup to report (1-36, default 12).
+@router.get(
+    "/admin/analytics/cohort-retention", dependencies=[Depends(has_role(["admin"]))]
+)
+async def cohort_retention(months: int = Query(12, ge=1, le=36)):
+    snapshot = _snapshot()
+    return {
+        "snapshot_at": snapshot.loaded_at,
+        "cohorts": snapshot.cohort_retention(months),
+    }
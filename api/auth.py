@@ -1,4 +1,4 @@
-from fastapi import Depends, APIRouter, HTTPException, status
+from fastapi import Depends, APIRouter, HTTPException, Request, status
 from schema.token import Token
 from fastapi.security import OAuth2PasswordRequestForm
 from db.session import db_dependency
@@ -8,9 +8,11 @@ from core.security import (
     ACCESS_TOKEN_EXPIRE_MINUTES,
     authenticate_user,
     create_access_token,
-    verify_refresh_token,
+    create_refresh_token,
 )
+from core.revocation import rotate_refresh_token
 from core.rbac import has_role
+from core.throttle import login_throttle
 from datetime import timedelta
 
 router = APIRouter()
@@ -24,9 +26,13 @@ router = APIRouter()
 # - `totp_code`: A time-based one-time password for 2FA validation.
 # - `db`: Database session dependency.
 # Returns a token if the credentials and TOTP code are valid.
+# Attempts are throttled per client IP and per account before the password is checked.
 @router.post("/login", response_model=Token)
-def login(user_login: UserLogin, totp_code: str, db: db_dependency):
-    return login_user(db=db, user_login=user_login, totp_code=totp_code)
+async def login(
+    request: Request, user_login: UserLogin, totp_code: str, db: db_dependency
+):
+    await login_throttle.check(request, user_login.email or user_login.username)
+    return await login_user(db=db, user_login=user_login, totp_code=totp_code)
 
 
 # GENERATE JWT TOKEN
@@ -34,6 +40,7 @@ def login(user_login: UserLogin, totp_code: str, db: db_dependency):
 # Uses OAuth2PasswordRequestForm to parse the user's username and password.
 # Validates the credentials using the `authenticate_user` function.
 # If authentication succeeds, generates a JWT access token with an expiration time.
+# Attempts are throttled per client IP and per username before the password is checked.
 # Parameters:
 # - `db`: Database session dependency.
 # - `form_data`: Dependency that handles OAuth2 form data.
@@ -41,10 +48,12 @@ def login(user_login: UserLogin, totp_code: str, db: db_dependency):
 # - A JSON object containing the `access_token` and its type if authentication is successful.
 @router.post("/token", response_model=Token)
 async def login_for_access_token(
+    request: Request,
     db: db_dependency,
     form_data: OAuth2PasswordRequestForm = Depends(),
 ):
-    user = authenticate_user(db, form_data.username, form_data.password)
+    await login_throttle.check(request, form_data.username)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -55,34 +64,26 @@ async def login_for_access_token(
     access_token = create_access_token(
         user_id=user.id, email=user.email, expires_delta=access_token_expires
     )
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {
+        "access_token": access_token,
+        "refresh_token": create_refresh_token(user.id, user.email),
+        "token_type": "bearer",
+    }
 
 
 # REFRESH TOKEN
 # Endpoint to refresh an expired JWT access token and issuing a new JWT token using a valid refresh token, with RBAC to limit access based on roles.
-# Verifies the provided refresh token using the `verify_refresh_token` function.
-# Generates a new JWT access token with the same user details if the refresh token is valid.
+# Rotates the refresh token with the `rotate_refresh_token` function: the presented token is revoked and a new one is returned.
+# Reusing an already rotated refresh token revokes every token rotated from the same login.
 # Includes role-based access control (RBAC) to restrict access to users with specified roles.
 # Parameters:
 # - `refresh_token`: A valid refresh token provided by the user.
 # Returns:
-# - A JSON object containing the new `access_token` and its type if the refresh token is valid.
+# - A JSON object containing the new `access_token`, the new `refresh_token` and the token type.
 @router.post(
     "/refresh",
     response_model=Token,
     dependencies=[Depends(has_role(["admin", "user", "vendor"]))],
 )
-async def refresh_access_token(refresh_token: str):
-    try:
-        payload = verify_refresh_token(refresh_token)
-        user_id = payload.get("user_id")
-        email = payload.get("email")
-        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        new_access_token = create_access_token(
-            user_id=user_id, email=email, expires_delta=access_token_expires
-        )
-        return {"access_token": new_access_token, "token_type": "bearer"}
-    except HTTPException as e:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token"
-        ) from e
+def refresh_access_token(refresh_token: str, db: db_dependency):
+    return rotate_refresh_token(db, refresh_token)
@@ -7,6 +7,8 @@ from fastapi.templating import Jinja2Templates
 from fastapi import status
 from core.security import verify_access_token
 from core.rbac import has_role
+from core.principal import invalidate_principal
+from core.throttle import otp_throttle
 
 
 templates = Jinja2Templates(directory="templates")
@@ -28,11 +30,13 @@ router = APIRouter()
 # - A success message if the TOTP code is sent successfully.
 # Raises:
 # - `HTTPException` with status 400 if the user is not found or 2FA is not enabled.
+# - `HTTPException` with status 429 if too many codes were requested for the IP or email.
 @router.post(
     "/users/send-2fa-code/",
     dependencies=[Depends(has_role(["admin", "user", "vendor"]))],
 )
-async def send_2fa_code(email: str, db: db_dependency):
+async def send_2fa_code(request: Request, email: str, db: db_dependency):
+    await otp_throttle.check(request, email)
     # Retrieve the user from the database
     user = db.query(User).filter(User.email == email).first()
     if not user or not user.otp_secret:
@@ -70,6 +74,7 @@ async def send_email_verification(
     if user and not user.is_active:
         user.is_active = True
         db.commit()
+        invalidate_principal(user.id)
 
         response.set_cookie(
             key="verification_token",
@@ -0,0 +1,16 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from core.metrics import metrics
+
+router = APIRouter()
+
+
+# METRICS
+# Endpoint exposing this worker's metrics in the Prometheus text format.
+# The endpoint is unauthenticated so scrapers can reach it; keep it on the
+# internal network or behind the reverse proxy's access rules.
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
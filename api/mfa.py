@@ -1,9 +1,10 @@
-from core.mfa import verify_totp_code
+from core.mfa import totp_verifier
 from fastapi import HTTPException, APIRouter, Depends, status
+from typing import Literal
 from db.session import db_dependency
 from db.models import User
 from core.security import get_current_user
-from core.mfa import enable_2fa, disable_2fa, generate_totp_qr_base64
+from core.mfa import enable_2fa, disable_2fa, get_totp_qr
 from core.rbac import has_role
 
 router = APIRouter()
@@ -59,7 +60,8 @@ async def disable_2fa_route(
 # - `current_user`: The currently authenticated user, obtained using `get_current_user`.
 # Functionality:
 # - Checks if the user has 2FA enabled by verifying the presence of an `otp_secret`.
-# - Calls `verify_totp_code` to validate the submitted code against the user's `otp_secret`.
+# - Calls `totp_verifier.verify` to validate the submitted code against the user's `otp_secret`;
+#   a code that was already used is rejected.
 # - Returns a success message if the code is valid or raises an exception if it is invalid.
 @router.post(
     "/users/verify-2fa", dependencies=[Depends(has_role(["admin", "user", "vendor"]))]
@@ -73,7 +75,7 @@ async def verify_2fa_route(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="2FA is not enabled for this user.",
         )
-    if not verify_totp_code(current_user.otp_secret, code):
+    if not totp_verifier.verify(current_user.id, current_user.otp_secret, code):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid TOTP code.",
@@ -84,19 +86,20 @@ async def verify_2fa_route(
 # GET QR CODE
 # Endpoint to retrieve the QR code for the user's TOTP setup as a Base64 string for the user's 2FA setup.
 # Parameters:
-# - `db`: Database session dependency.
+# - `format`: "png" (default) for a Base64-encoded PNG, or "svg" for SVG markup.
 # - `current_user`: The currently authenticated user, obtained using `get_current_user`.
 # Functionality:
 # - Validates if 2FA is enabled for the user by checking for an `otp_secret`.
-# - Calls `generate_totp_qr_base64` to generate the QR code in Base64 format.
-# - Returns the Base64 string representation of the QR code.
+# - Calls `get_totp_qr`, which serves the QR code from a cache or renders it off the event loop.
+# - Returns the Base64 string (PNG) or the SVG markup of the QR code.
 @router.post(
     "/users/get-qr-code", dependencies=[Depends(has_role(["admin", "user", "vendor"]))]
 )
-async def get_qr_code(current_user: User = Depends(get_current_user)):
+async def get_qr_code(
+    format: Literal["png", "svg"] = "png",
+    current_user: User = Depends(get_current_user),
+):
     if not current_user.otp_secret:
         raise HTTPException(status_code=400, detail="2FA is not enabled for this user.")
-    qr_code_base64 = generate_totp_qr_base64(
-        current_user.email, current_user.otp_secret
-    )
-    return {"qr_code": qr_code_base64}
+    qr_code = await get_totp_qr(current_user.email, current_user.otp_secret, format)
+    return {"qr_code": qr_code, "format": format}
@@ -1,5 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from schema.order import OrderResponse, OrderUpdate, OrderTotalResponse, OrderCreate
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from schema.order import (
+    OrderResponse,
+    OrderUpdate,
+    OrderTotalResponse,
+    OrderCreate,
+    OrderHistoryPage,
+    BulkOrderStatusUpdate,
+    BulkOrderStatusResult,
+)
 from schema.product import AddProductToOrderRequest
 from db.models import User, OrderStatus
 from core.rbac import has_role
@@ -9,15 +18,31 @@ from crud.order import (
     update_order,
     delete_order,
     add_product_to_order,
-    get_total_order_price,
+    get_user_order_stats,
+    get_user_orders_page,
+    bulk_update_order_status,
+    get_order_by_reference,
 )
 from db.session import db_dependency
 from core.security import get_current_user
-from typing import List
+from core.idempotency import run_idempotent, hash_request
+from core.ids import parse_id
+from crud.rollups import record_order_change
+from core.events import (
+    order_status_stream,
+    publish_order_event,
+    TERMINAL_ORDER_STATUSES,
+)
+from typing import List, Optional
+import asyncio
+import json
 from db.models import Order
 
 router = APIRouter()
 
+# Seconds between keep-alive comments on idle status streams
+STATUS_STREAM_KEEPALIVE_SECONDS = 15
+
 
 # CREATE ORDER
 # Endpoint to create a new order for a user.
@@ -26,24 +51,65 @@ router = APIRouter()
 # - `product_ids`: List of product IDs to include in the order.
 # - `db`: Database session dependency.
 # - `current_user`: The currently authenticated user.
+# - `idempotency_key`: Optional `Idempotency-Key` header; retries with the same key replay the first response.
 # Functionality:
 # - Verifies the user matches the authenticated user.
-# - Calls `create_order` to create an order for the user.
+# - Calls `create_order` to create an order for the user, at most once per idempotency key.
 # - Returns the created order or raises an exception if validation fails.
 @router.post(
     "/orders/", response_model=OrderResponse, dependencies=[Depends(has_role(["user"]))]
 )
-def create_order_endpoint(
+async def create_order_endpoint(
     user_id: int,
     product_ids: List[int],
     db: db_dependency,
     current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
 ):
     if current_user.id != user_id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized"
         )
-    return create_order(db, user_id, product_ids)
+
+    def work():
+        order = create_order(db, user_id, product_ids)
+        return OrderResponse.model_validate(order, from_attributes=True)
+
+    return await run_idempotent(
+        db,
+        idempotency_key,
+        scope=f"order:create:{user_id}",
+        request_hash=hash_request(user_id, product_ids),
+        work=work,
+    )
+
+
+# GET MY ORDERS
+# Endpoint to list the authenticated user's orders, newest first.
+# Parameters:
+# - `limit`: Maximum number of orders to return (1-100, default 20).
+# - `cursor`: The `next_cursor` value from the previous page, if any.
+# - `status`: Optional order status filter.
+# - `db`: Database session dependency.
+# - `current_user`: The currently authenticated user.
+# Functionality:
+# - Calls `get_user_orders_page` to fetch one keyset-paginated page of orders with their products.
+# - Returns the orders and a `next_cursor`, which is null on the last page.
+@router.get("/orders/me", response_model=OrderHistoryPage)
+def read_my_orders(
+    db: db_dependency,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    status: Optional[OrderStatus] = None,
+    current_user: User = Depends(get_current_user),
+):
+    try:
+        orders, next_cursor = get_user_orders_page(
+            db, current_user.id, limit=limit, cursor=cursor, status=status
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"orders": orders, "next_cursor": next_cursor}
 
 
 # GET ORDER
@@ -131,16 +197,21 @@ def delete_order_view(order_id: int, db: db_dependency):
 # - `user_id`: ID of the user whose total orders are to be calculated.
 # - `db`: Database session dependency.
 # Functionality:
-# - Calls `get_total_order_price` to calculate the total order value for the user.
-# - Returns the total price or raises an exception if no orders are found.
+# - Reads the user's maintained order aggregates with a primary key lookup.
+# - Returns the total price, order count and last order time, or raises an exception if no orders are found.
 @router.get("/orders/user-orders-total/{user_id}", response_model=OrderTotalResponse)
 def get_user_orders_total(user_id: int, db: db_dependency):
-    total_price = get_total_order_price(user_id, db)
-    if total_price == 0:
+    stats = get_user_order_stats(db, user_id)
+    if not stats or stats.order_count == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="No orders found"
         )
-    return {"user_id": user_id, "total_price": total_price}
+    return {
+        "user_id": user_id,
+        "total_price": stats.lifetime_total,
+        "order_count": stats.order_count,
+        "last_order_at": stats.last_order_at,
+    }
 
 
 @router.get(
@@ -148,7 +219,7 @@ def get_user_orders_total(user_id: int, db: db_dependency):
     dependencies=[Depends(has_role(["admin", "user"]))],
 )
 async def order_status(order_reference: str, db: db_dependency):
-    order = db.query(Order).filter(Order.reference == order_reference).first()
+    order = get_order_by_reference(db, order_reference)
 
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
@@ -160,11 +231,90 @@ async def order_status(order_reference: str, db: db_dependency):
 async def update_order_status(
     order_reference: str, status: OrderStatus, db: db_dependency
 ):
-    order = db.query(Order).filter(Order.reference == order_reference).first()
+    order = get_order_by_reference(db, order_reference, include_archive=False)
 
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
+    record_order_change(
+        db, order.created_at, order.status, order.total_price, status, order.total_price
+    )
     order.status = status
     db.commit()
+    publish_order_event(order.reference, status)
     return {"status": "success", "message": "Order status updated successfully"}
+
+
+# ORDER STATUS STREAM
+# Endpoint to follow an order's status as a Server-Sent Events stream instead of polling `/order-status/`.
+# Parameters:
+# - `order_reference`: Reference of the order to follow.
+# - `request`: The HTTP request, used to detect client disconnects.
+# - `db`: Database session dependency.
+# Functionality:
+# - Sends the current status immediately, then one `data:` event per change published by the order and payment flows.
+# - Sends a keep-alive comment when idle and closes the stream once the order is delivered or canceled.
+@router.get(
+    "/order-status/{order_reference}/stream",
+    dependencies=[Depends(has_role(["admin", "user"]))],
+)
+async def order_status_events(order_reference: str, request: Request, db: db_dependency):
+    # Events are published under the canonical reference, so subscribe with it
+    reference = parse_id(order_reference)
+    if reference is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    # Subscribe before reading the current status so no change is missed
+    queue = order_status_stream.subscribe(reference)
+    order = get_order_by_reference(db, reference)
+    if not order:
+        order_status_stream.unsubscribe(reference, queue)
+        raise HTTPException(status_code=404, detail="Order not found")
+    current = {
+        "order_reference": order.reference,
+        "status": order.status.value,
+        "event": "snapshot",
+    }
+
+    async def events():
+        try:
+            event = current
+            while True:
+                yield f"data: {json.dumps(event)}\n\n"
+                if event["status"] in TERMINAL_ORDER_STATUSES:
+                    break
+                while True:
+                    if await request.is_disconnected():
+                        return
+                    try:
+                        event = await asyncio.wait_for(
+                            queue.get(), STATUS_STREAM_KEEPALIVE_SECONDS
+                        )
+                        break
+                    except asyncio.TimeoutError:
+                        yield ": keep-alive\n\n"
+        finally:
+            order_status_stream.unsubscribe(reference, queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# BULK UPDATE ORDER STATUS
+# Endpoint to move many orders to a new status in one request (e.g. for fulfilment).
+# Parameters:
+# - `payload`: Request body with the order `references` (up to 1000) and the target `status`.
+# - `db`: Database session dependency.
+# Functionality:
+# - Calls `bulk_update_order_status`, which validates allowed transitions set-wise and applies them with one UPDATE.
+# - Returns the references that were updated and those rejected (unknown or not in an allowed source status).
+@router.put(
+    "/bulk-update-order-status/",
+    response_model=BulkOrderStatusResult,
+    dependencies=[Depends(has_role(["admin"]))],
+)
+def bulk_update_order_status_view(payload: BulkOrderStatusUpdate, db: db_dependency):
+    updated, rejected = bulk_update_order_status(db, payload.references, payload.status)
+    return {"status": payload.status, "updated": updated, "rejected": rejected}
@@ -1,6 +1,6 @@
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Depends
-from typing import List
-from schema.product import ProductCreate, ProductResponse
+from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Depends, Query
+from typing import List, Literal, Optional
+from schema.product import ProductCreate, ProductResponse, RelatedProductResponse
 from crud.product import (
     create_product,
     upload_image,
@@ -15,6 +15,8 @@ from crud.product import (
 from db.session import db_dependency
 from db.models import ProductImage
 from core.rbac import has_role
+from core.recommendations import related_products
+from core.popularity import popularity_counters
 
 router = APIRouter()
 
@@ -58,11 +60,18 @@ def create_new_product(
 # Query Parameters:
 #   - skip (int): The number of products to skip (default: 0).
 #   - limit (int): The maximum number of products to return (default: 10).
+#   - sort (str): Optional ranking, "popular" (units sold, then views) or "trending"
+#     (recent views and sales, decaying with a 7-day half-life).
 # Response:
 #   - A list of products.
 @router.get("/products/", response_model=List[ProductResponse])
-def get_products(db: db_dependency, skip: int = 0, limit: int = 10):
-    products = get_all_products(db=db, skip=skip, limit=limit)
+def get_products(
+    db: db_dependency,
+    skip: int = 0,
+    limit: int = 10,
+    sort: Optional[Literal["popular", "trending"]] = None,
+):
+    products = get_all_products(db=db, skip=skip, limit=limit, sort=sort)
     return products
 
 
@@ -79,9 +88,33 @@ def get_product(product_id: int, db: db_dependency):
     product = get_product_by_id(db=db, product_id=product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
+    popularity_counters.record_view(product_id)
     return product
 
 
+# GET RELATED PRODUCTS
+# Endpoint: Retrieve products frequently bought together with a product
+# Description:
+#   Returns the products that most often share an order with this one, ranked by
+#   cosine similarity of their order sets. Served from an in-memory table that is
+#   updated as orders are placed; the database is not queried.
+# Path Parameters:
+#   - product_id (int): The ID of the product.
+# Query Parameters:
+#   - limit (int): The maximum number of related products (1-20, default: 10).
+# Response:
+#   - A list of related product IDs with their score and number of shared orders;
+#     empty if the product has never been ordered with another product.
+@router.get(
+    "/products/{product_id}/related", response_model=List[RelatedProductResponse]
+)
+def get_related_products(product_id: int, limit: int = Query(10, ge=1, le=20)):
+    return [
+        {"product_id": related_id, "score": score, "orders_together": count}
+        for related_id, score, count in related_products.related(product_id, limit)
+    ]
+
+
 # UPDATE PRODUCT
 # Endpoint: Update a product by ID
 # Description:
@@ -8,11 +8,10 @@ from crud.user import (
 )
 from schema.user import UserCreate, UserUpdate, UserResponse
 from db.session import db_dependency
-from core.security import (
-    get_current_user,
-    verify_password,
-)
-from core.email import send_password_reset_email, send_verification_email
+from core.security import get_current_user
+from core.hashing import password_hasher
+from core.email import send_password_reset_email
+from core.outbox import outbox_dispatcher
 from core.rbac import has_role
 
 router = APIRouter()
@@ -24,7 +23,7 @@ router = APIRouter()
 # USER CREATION
 # Endpoint: Create a new user
 # Description:
-#   Registers a new user in the system, and sends a verification email after registration.
+#   Registers a new user in the system, and queues a verification email that is sent in the background.
 # Request Body:
 #   - user (UserCreate): The user's information such as email, username, password, etc.
 # Response:
@@ -35,7 +34,7 @@ router = APIRouter()
 @router.post("/users/", response_model=dict)
 async def create_new_user(user: UserCreate, db: db_dependency):
     db_user = await create_user(db=db, user=user)
-    await send_verification_email(db_user.email, db_user)
+    outbox_dispatcher.wake()
 
     # Pydantic V2 Compatibility:
     user_response = UserResponse.model_validate(db_user)
@@ -138,7 +137,9 @@ async def reset_password_confirm(
     db: db_dependency,
     current_user: User = Depends(get_current_user),
 ):
-    if not verify_password(current_password, current_user.hashed_password):
+    if not await password_hasher.verify(
+        current_password, current_user.hashed_password
+    ):
         raise HTTPException(status_code=400, detail="Incorrect current password")
-    change_user_password(db, current_user.id, new_password)
+    await change_user_password(db, current_user.id, new_password)
     return {"message": "Password updated successfully"}
@@ -0,0 +1,72 @@
+"""bcrypt cost benchmark: picks BCRYPT_ROUNDS for this host.
+
+Times one bcrypt hash at each cost factor, then recommends the highest cost
+whose median hash time stays within the target, and estimates the sustained
+login throughput of the password hashing pool at that cost.
+
+Usage:
+    python -m benchmarks.bench_bcrypt --target-ms 250
+    python -m benchmarks.bench_bcrypt --min-rounds 10 --max-rounds 14 --workers 8
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from passlib.context import CryptContext
+from core.hashing import PasswordHasher
+
+
+def _median_hash_ms(rounds: int, samples: int) -> float:
+    context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        context.hash("benchmark-password")
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+async def _pool_throughput(workers: int, calls: int, hashed: str) -> float:
+    hasher = PasswordHasher(workers=workers, max_pending=calls)
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(hasher.verify("benchmark-password", hashed) for _ in range(calls))
+        )
+        return calls / (time.perf_counter() - started)
+    finally:
+        hasher.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target-ms", type=float, default=250.0)
+    parser.add_argument("--min-rounds", type=int, default=10)
+    parser.add_argument("--max-rounds", type=int, default=15)
+    parser.add_argument("--samples", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    args = parser.parse_args()
+
+    chosen = args.min_rounds
+    for rounds in range(args.min_rounds, args.max_rounds + 1):
+        median = _median_hash_ms(rounds, args.samples)
+        print(f"rounds {rounds:>2}  {median:>9,.1f} ms/hash")
+        if median > args.target_ms:
+            break
+        chosen = rounds
+
+    hashed = CryptContext(schemes=["bcrypt"], bcrypt__rounds=chosen).hash(
+        "benchmark-password"
+    )
+    calls = args.workers * 4
+    throughput = asyncio.run(_pool_throughput(args.workers, calls, hashed))
+    print(
+        f"\nrecommended BCRYPT_ROUNDS={chosen}"
+        f"  ({args.workers} workers: {throughput:,.1f} verifications/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
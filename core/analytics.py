@@ -0,0 +1,365 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from sqlalchemy import select, union_all
+from db.models import (
+    Order,
+    ArchivedOrder,
+    Product,
+    User,
+    order_product_association,
+    order_product_archive,
+)
+from db.session import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Seconds between snapshot reloads
+ANALYTICS_REFRESH_SECONDS = 300
+# Rows fetched per round trip while loading a snapshot
+ANALYTICS_LOAD_CHUNK_SIZE = 10_000
+# Default upper edges of the price bands used by `revenue_by_price_band`
+DEFAULT_PRICE_BANDS = (10.0, 50.0, 100.0, 500.0, 1000.0)
+
+
+# ---------------------------
+# Column Store
+# ---------------------------
+
+
+# Streams a query into one NumPy array per selected column
+def _load_columns(db, statement, dtypes: Sequence) -> List[np.ndarray]:
+    chunks: List[List[np.ndarray]] = [[] for _ in dtypes]
+    result = db.execute(
+        statement.execution_options(
+            stream_results=True, yield_per=ANALYTICS_LOAD_CHUNK_SIZE
+        )
+    )
+    for partition in result.partitions():
+        for index, column in enumerate(zip(*partition)):
+            chunks[index].append(np.array(column, dtype=dtypes[index]))
+    return [
+        np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+        for parts, dtype in zip(chunks, dtypes)
+    ]
+
+
+# Dictionary-encodes strings as (labels, int32 codes)
+def _encode(values: np.ndarray):
+    labels, codes = np.unique(values.astype(str), return_inverse=True)
+    return labels, codes.astype(np.int32)
+
+
+# ORDER SNAPSHOT
+# - An immutable, columnar copy of orders, line items, products and users.
+# - Details:
+#   - Every attribute is a flat NumPy array; strings are dictionary-encoded as
+#     int32 codes into a small label array.
+#   - Foreign keys are pre-resolved to row positions (`order_user`,
+#     `item_order`, `item_product`), so queries never join or hash at read time.
+#   - Timestamps are `datetime64[s]`; missing values are NaT.
+class OrderSnapshot:
+    def __init__(self, db):
+        started = time.perf_counter()
+
+        self.user_id, self.user_created = _load_columns(
+            db,
+            select(User.id, User.created_at).order_by(User.id),
+            (np.int64, "datetime64[s]"),
+        )
+
+        product_ids, product_prices, product_names = _load_columns(
+            db,
+            select(Product.id, Product.price, Product.name).order_by(Product.id),
+            (np.int64, np.float64, object),
+        )
+        self.product_id = product_ids
+        self.product_price = product_prices
+        self.product_labels, self.product_name = _encode(product_names)
+
+        orders = union_all(
+            select(
+                Order.id, Order.user_id, Order.created_at, Order.total_price, Order.status
+            ),
+            select(
+                ArchivedOrder.id,
+                ArchivedOrder.user_id,
+                ArchivedOrder.created_at,
+                ArchivedOrder.total_price,
+                ArchivedOrder.status,
+            ),
+        )
+        order_ids, order_users, created, totals, statuses = _load_columns(
+            db,
+            orders,
+            (np.int64, np.int64, "datetime64[s]", np.float64, object),
+        )
+        sort = np.argsort(order_ids, kind="stable")
+        self.order_id = order_ids[sort]
+        self.order_created = created[sort]
+        self.order_total = np.nan_to_num(totals[sort])
+        self.status_labels, self.order_status = _encode(
+            np.array([getattr(s, "value", s) for s in statuses[sort]], dtype=object)
+        )
+        self.order_user = self._positions(self.user_id, order_users[sort])
+
+        line_items = union_all(
+            select(
+                order_product_association.c.order_id,
+                order_product_association.c.product_id,
+            ),
+            select(order_product_archive.c.order_id, order_product_archive.c.product_id),
+        )
+        item_orders, item_products = _load_columns(db, line_items, (np.int64, np.int64))
+        self.item_order = self._positions(self.order_id, item_orders)
+        self.item_product = self._positions(self.product_id, item_products)
+        # Line items carry no price of their own; use the product's current price
+        self.item_price = np.where(
+            self.item_product >= 0, self.product_price[self.item_product], 0.0
+        )
+        self.order_items = np.bincount(
+            self.item_order[self.item_order >= 0], minlength=len(self.order_id)
+        )
+
+        self.loaded_at = datetime.utcnow()
+        self.load_seconds = time.perf_counter() - started
+
+    # Maps ids to row positions in `sorted_ids`, or -1 where absent
+    @staticmethod
+    def _positions(sorted_ids: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        if len(sorted_ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        positions = np.searchsorted(sorted_ids, ids)
+        positions = np.minimum(positions, len(sorted_ids) - 1)
+        return np.where(sorted_ids[positions] == ids, positions, -1)
+
+    def _order_mask(self, start: Optional[datetime], end: Optional[datetime]):
+        mask = np.ones(len(self.order_id), dtype=bool)
+        if start is not None:
+            mask &= self.order_created >= np.datetime64(start, "s")
+        if end is not None:
+            mask &= self.order_created < np.datetime64(end, "s")
+        return mask
+
+    # ---------------------------
+    # Analytical Queries
+    # ---------------------------
+
+    # BASKET SIZE DISTRIBUTION
+    # - Returns how many orders had each number of line items, with percentiles.
+    def basket_size_distribution(
+        self, start: Optional[datetime] = None, end: Optional[datetime] = None
+    ) -> Dict:
+        sizes = self.order_items[self._order_mask(start, end)]
+        if len(sizes) == 0:
+            return {"orders": 0, "distribution": {}, "percentiles": {}}
+        counts = np.bincount(sizes)
+        nonzero = np.flatnonzero(counts)
+        p50, p90, p99 = np.percentile(sizes, (50, 90, 99))
+        return {
+            "orders": int(len(sizes)),
+            "mean": float(sizes.mean()),
+            "distribution": {int(size): int(counts[size]) for size in nonzero},
+            "percentiles": {"p50": float(p50), "p90": float(p90), "p99": float(p99)},
+        }
+
+    # REVENUE BY PRICE BAND
+    # - Sums units and revenue of line items grouped by product price band.
+    # - Parameters:
+    #   - `edges (Sequence[float])`: Ascending upper band edges; a final open band is added.
+    def revenue_by_price_band(
+        self,
+        edges: Sequence[float] = DEFAULT_PRICE_BANDS,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> List[Dict]:
+        edges = np.asarray(sorted(edges), dtype=np.float64)
+        valid = self.item_order >= 0
+        valid[valid] &= self._order_mask(start, end)[self.item_order[valid]]
+        prices = self.item_price[valid]
+        bands = np.digitize(prices, edges, right=True)
+        units = np.bincount(bands, minlength=len(edges) + 1)
+        revenue = np.bincount(bands, weights=prices, minlength=len(edges) + 1)
+        lower = np.concatenate(([0.0], edges))
+        upper = np.concatenate((edges, [np.inf]))
+        return [
+            {
+                "min_price": float(lower[band]),
+                "max_price": None if np.isinf(upper[band]) else float(upper[band]),
+                "units": int(units[band]),
+                "revenue": float(revenue[band]),
+            }
+            for band in range(len(edges) + 1)
+        ]
+
+    # ORDER VALUE PERCENTILES
+    # - Returns order total percentiles, overall or per status.
+    def order_value_percentiles(
+        self,
+        percentiles: Sequence[float] = (50, 90, 99),
+        by_status: bool = False,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> Dict:
+        mask = self._order_mask(start, end)
+
+        def summarize(values: np.ndarray) -> Dict:
+            if len(values) == 0:
+                return {"orders": 0}
+            points = np.percentile(values, percentiles)
+            return {
+                "orders": int(len(values)),
+                "sum": float(values.sum()),
+                **{f"p{p:g}": float(v) for p, v in zip(percentiles, points)},
+            }
+
+        if not by_status:
+            return summarize(self.order_total[mask])
+        return {
+            str(label): summarize(self.order_total[mask & (self.order_status == code)])
+            for code, label in enumerate(self.status_labels)
+        }
+
+    # TOP PRODUCTS
+    # - Returns the k products with the most units or revenue.
+    # - Parameters:
+    #   - `by (str)`: "units" or "revenue".
+    def top_products(
+        self,
+        k: int = 10,
+        by: str = "units",
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> List[Dict]:
+        valid = (self.item_order >= 0) & (self.item_product >= 0)
+        valid[valid] &= self._order_mask(start, end)[self.item_order[valid]]
+        products = self.item_product[valid]
+        units = np.bincount(products, minlength=len(self.product_id))
+        revenue = np.bincount(
+            products, weights=self.item_price[valid], minlength=len(self.product_id)
+        )
+        score = units if by == "units" else revenue
+        k = min(k, int(np.count_nonzero(score)))
+        if k == 0:
+            return []
+        top = np.argpartition(-score, k - 1)[:k]
+        top = top[np.lexsort((self.product_id[top], -score[top]))]
+        return [
+            {
+                "product_id": int(self.product_id[i]),
+                "name": str(self.product_labels[self.product_name[i]]),
+                "units": int(units[i]),
+                "revenue": float(revenue[i]),
+            }
+            for i in top
+        ]
+
+    # COHORT RETENTION
+    # - Share of each signup-month cohort that ordered 0, 1, 2, ... months after signing up.
+    # - Parameters:
+    #   - `max_months (int)`: Number of month offsets to report per cohort.
+    # - Details:
+    #   - Distinct (user, month offset) pairs are found with one `np.unique` over
+    #     a combined integer key, then counted per cohort with `np.bincount`.
+    def cohort_retention(self, max_months: int = 12) -> List[Dict]:
+        signed_up = ~np.isnat(self.user_created)
+        if not signed_up.any():
+            return []
+        user_month = self.user_created.astype("datetime64[M]").astype(np.int64)
+        cohort_months, user_cohort = np.unique(user_month[signed_up], return_inverse=True)
+        cohort_of_user = np.full(len(self.user_id), -1, dtype=np.int64)
+        cohort_of_user[signed_up] = user_cohort
+        cohort_sizes = np.bincount(user_cohort, minlength=len(cohort_months))
+
+        users = self.order_user
+        valid = (users >= 0) & ~np.isnat(self.order_created)
+        valid[valid] &= signed_up[users[valid]]
+        users = users[valid]
+        offsets = (
+            self.order_created[valid].astype("datetime64[M]").astype(np.int64)
+            - user_month[users]
+        )
+        in_window = (offsets >= 0) & (offsets < max_months)
+        users, offsets = users[in_window], offsets[in_window]
+        active = np.unique(users * max_months + offsets)
+        cohorts = cohort_of_user[active // max_months]
+        counts = np.bincount(
+            cohorts * max_months + active % max_months,
+            minlength=len(cohort_months) * max_months,
+        ).reshape(len(cohort_months), max_months)
+        retention = counts / cohort_sizes[:, None]
+        labels = cohort_months.astype("datetime64[M]").astype(str)
+        return [
+            {
+                "cohort": str(labels[i]),
+                "users": int(cohort_sizes[i]),
+                "retention": [round(float(r), 4) for r in retention[i]],
+            }
+            for i in range(len(cohort_months))
+        ]
+
+
+# ---------------------------
+# Snapshot Refresher
+# ---------------------------
+
+
+# ANALYTICS STORE
+# - Holds the current `OrderSnapshot` and reloads it in the background.
+# - Details:
+#   - Snapshots are built in a worker thread and swapped in with a single
+#     reference assignment, so readers never see a partially loaded store and
+#     queries never touch the database.
+#   - `snapshot` is None until the first load finishes.
+class AnalyticsStore:
+    def __init__(self, refresh_seconds: float = ANALYTICS_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.snapshot: Optional[OrderSnapshot] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # REFRESH
+    # - Loads a new snapshot from the database and swaps it in; blocking.
+    def refresh(self) -> OrderSnapshot:
+        db = SessionLocal()
+        try:
+            snapshot = OrderSnapshot(db)
+        finally:
+            db.close()
+        self.snapshot = snapshot
+        logger.info(
+            "Analytics snapshot loaded: %d orders, %d line items in %.2fs",
+            len(snapshot.order_id),
+            len(snapshot.item_order),
+            snapshot.load_seconds,
+        )
+        return snapshot
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Analytics snapshot refresh failed")
+            await asyncio.sleep(self.refresh_seconds)
+
+
+analytics_store = AnalyticsStore()
@@ -1,27 +1,13 @@
-import os
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
 from fastapi import HTTPException
 from db.models import User
 from core.security import create_password_reset_token, create_access_token
-from core.mfa import generate_totp_code
+from core.mfa import totp_verifier
+from core.mailer import MailQueueFull, mailer
+from core.outbox import outbox_handler
+from db.session import SessionLocal
 from datetime import timedelta
 
 
-# Email Configuration
-conf = ConnectionConfig(
-    MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
-    MAIL_PASSWORD=os.getenv("MAIL_PASSWORD"),
-    MAIL_FROM=os.getenv("MAIL_FROM"),
-    MAIL_PORT=465,
-    MAIL_SERVER="smtp.gmail.com",
-    MAIL_FROM_NAME="Your App Name",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-)
-
-
 # SEND EMAIL
 # Sends an email to the specified recipient.
 # - Parameters:
@@ -30,28 +16,44 @@ conf = ConnectionConfig(
 #   - `body` (str): The content of the email body.
 #   - `subtype` (str): The format of the email content, e.g., 'plain' or 'html'.
 # - Raises:
-#   - `HTTPException`: If the email fails to send.
+#   - `HTTPException`: 503 if the mail queue is full, 500 if delivery failed.
 # - Details:
-#   - This function uses FastMail to send an email. It requires the email configuration (`conf`)
-#     to be properly set up with valid credentials and server details.
+#   - The message goes through the pooled `mailer` (see core/mailer.py) and this
+#     call waits until it is delivered or every retry has failed.
 async def send_email(subject: str, recipient: str, body: str, subtype="plain"):
-    """
-    A reusable function to send an email.
-    """
-    message = MessageSchema(
-        subject=subject,
-        recipients=[recipient],
-        body=body,
-        subtype=subtype,
-    )
-
-    fm = FastMail(conf)
+    message = mailer.build_message(subject, recipient, body, subtype)
     try:
-        await fm.send_message(message)
+        await mailer.send(message)
+    except MailQueueFull:
+        raise _mail_busy()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to send email: {e}")
 
 
+# QUEUE EMAIL
+# Queues an email for background delivery and returns without waiting for it.
+# - Parameters: Same as `send_email`.
+# - Raises:
+#   - `HTTPException`: 503 if the mail queue stays full.
+# - Details:
+#   - Use on request paths, where SMTP latency and retries should not hold up
+#     the response; failures are logged and counted in the mail metrics.
+async def queue_email(subject: str, recipient: str, body: str, subtype="plain"):
+    message = mailer.build_message(subject, recipient, body, subtype)
+    try:
+        await mailer.enqueue(message)
+    except MailQueueFull:
+        raise _mail_busy()
+
+
+def _mail_busy():
+    return HTTPException(
+        status_code=503,
+        detail="Email service is busy, please retry shortly.",
+        headers={"Retry-After": "5"},
+    )
+
+
 # GENERATE AND SEND TOTP CODE
 # Sends an email to the specified recipient.
 # - Parameters:
@@ -60,17 +62,15 @@ async def send_email(subject: str, recipient: str, body: str, subtype="plain"):
 #   - `body` (str): The content of the email body.
 #   - `subtype` (str): The format of the email content, e.g., 'plain' or 'html'.
 # - Raises:
-#   - `HTTPException`: If the email fails to send.
+#   - `HTTPException`: 503 if the mail queue is full.
 # - Details:
-#   - This function uses FastMail to send an email. It requires the email configuration (`conf`)
-#     to be properly set up with valid credentials and server details.
+#   - The code is queued for delivery rather than sent inline.
 async def send_otp_code(user: User):
     if not user.otp_secret:
         raise HTTPException(status_code=400, detail="2FA is not enabled for this user.")
-    totp_code = generate_totp_code(user.otp_secret)
-    print(f"Sending TOTP code: {totp_code}")
+    totp_code = totp_verifier.generate(user.id, user.otp_secret)
 
-    await send_email(
+    await queue_email(
         subject="Your TOTP Code",
         recipient=user.email,
         body=f"Your TOTP code is {totp_code}. It will expire in 30 seconds.",
@@ -158,9 +158,46 @@ async def send_password_reset_email(user: User):
         </body>
         </html>
     """
-    await send_email(
+    await queue_email(
         subject="Password Reset Request",
         recipient=user.email,
         body=email_body,
         subtype="html",
     )
+
+
+# ---------------------------
+# Outbox Handlers
+# ---------------------------
+
+
+# DELIVER VERIFICATION EMAIL
+# Outbox handler for "email.verification" events written at signup.
+# - Payload:
+#   - `user_id` (int): The newly registered user.
+# - Details:
+#   - Skips users that were deleted before delivery.
+@outbox_handler("email.verification")
+async def deliver_verification_email(payload: dict):
+    db = SessionLocal()
+    try:
+        user = db.get(User, payload["user_id"])
+    finally:
+        db.close()
+    if user is not None:
+        await send_verification_email(user.email, user)
+
+
+# DELIVER PAYMENT CONFIRMATION EMAIL
+# Outbox handler for "email.payment_confirmation" events written on successful payment.
+# - Payload:
+#   - `email` (str): The customer's email address.
+#   - `amount` (float): The amount paid, in major currency units.
+@outbox_handler("email.payment_confirmation")
+async def deliver_payment_confirmation_email(payload: dict):
+    await send_email(
+        subject="Payment Successful - Thank you for your purchase!",
+        recipient=payload["email"],
+        body=f"Dear customer,\n\nYour payment of NGN{payload['amount']} was successful. Your order will be processed shortly.\n\nThank you for shopping with us!",
+        subtype="plain",
+    )
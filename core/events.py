@@ -0,0 +1,183 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from sqlalchemy import text
+from db.session import engine
+
+logger = logging.getLogger(__name__)
+
+# Channel carrying order status changes
+ORDER_STATUS_CHANNEL = "order_status"
+# Statuses after which an order no longer changes
+TERMINAL_ORDER_STATUSES = {"delivered", "canceled"}
+# Events buffered per subscriber before the oldest is dropped
+SUBSCRIBER_QUEUE_SIZE = 16
+
+
+# ---------------------------
+# Event Bus
+# ---------------------------
+
+
+# EVENT BUS
+# - Broadcasts small JSON events to every worker process.
+# - Details:
+#   - On PostgreSQL, events are sent with `NOTIFY` and every worker runs a
+#     `LISTEN` thread that hands them to the registered callbacks, so all
+#     workers sharing the database see every event.
+#   - On other databases, events are delivered in-process only.
+#   - Callbacks run on the listener (or publishing) thread and must not block.
+class EventBus:
+    def __init__(self):
+        self._callbacks: Dict[str, List[Callable[[dict], None]]] = defaultdict(list)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def uses_notify(self) -> bool:
+        return engine.dialect.name == "postgresql"
+
+    # ADD LISTENER
+    # - Registers `callback` for events published on `channel`.
+    def add_listener(self, channel: str, callback: Callable[[dict], None]):
+        self._callbacks[channel].append(callback)
+
+    # PUBLISH
+    # - Sends `payload` to the listeners of `channel` in every worker.
+    def publish(self, channel: str, payload: dict):
+        if not self.uses_notify:
+            self._dispatch(channel, payload)
+            return
+        try:
+            with engine.connect() as conn:
+                conn.execute(
+                    text("SELECT pg_notify(:channel, :payload)"),
+                    {"channel": channel, "payload": json.dumps(payload, default=str)},
+                )
+                conn.commit()
+        except Exception:
+            logger.exception("Failed to publish event on %s", channel)
+
+    def _dispatch(self, channel: str, payload: dict):
+        for callback in self._callbacks.get(channel, []):
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception("Event listener for %s failed", channel)
+
+    # START / STOP
+    # - Starts the background `LISTEN` thread (PostgreSQL only).
+    def start(self):
+        if not self.uses_notify or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._listen, name="event-bus-listener", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def _listen(self):
+        while not self._stop.is_set():
+            raw = None
+            try:
+                raw = engine.raw_connection()
+                conn = raw.driver_connection
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    for channel in list(self._callbacks):
+                        cursor.execute(f'LISTEN "{channel}"')
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self._dispatch(notify.channel, json.loads(notify.payload))
+            except Exception:
+                logger.exception("Event bus listener failed, reconnecting")
+                self._stop.wait(1)
+            finally:
+                if raw is not None:
+                    raw.close()
+
+
+event_bus = EventBus()
+
+
+# ---------------------------
+# Order Status Stream
+# ---------------------------
+
+
+# ORDER STATUS STREAM
+# - Fans order status events out to the async subscribers of each order reference.
+class OrderStatusStream:
+    def __init__(self, bus: EventBus):
+        self._subscribers: Dict[
+            str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]
+        ] = defaultdict(set)
+        self._lock = threading.Lock()
+        bus.add_listener(ORDER_STATUS_CHANNEL, self._on_event)
+
+    # SUBSCRIBE
+    # - Returns a queue that receives every event for `reference`.
+    # - Must be called from the event loop that will read the queue.
+    def subscribe(self, reference: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[reference].add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, reference: str, queue: asyncio.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(reference)
+            if not subscribers:
+                return
+            subscribers.difference_update({s for s in subscribers if s[1] is queue})
+            if not subscribers:
+                del self._subscribers[reference]
+
+    def _on_event(self, payload: dict):
+        with self._lock:
+            subscribers = list(self._subscribers.get(payload.get("order_reference"), ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._offer, queue, payload)
+
+    @staticmethod
+    def _offer(queue: asyncio.Queue, payload: dict):
+        # A slow client only needs the latest state, so drop the oldest event
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(payload)
+
+
+order_status_stream = OrderStatusStream(event_bus)
+
+
+# PUBLISH ORDER EVENT
+# - Announces a change to an order to every status stream subscriber.
+# - Parameters:
+#   - `reference` (str): The order reference.
+#   - `status`: The order's current status (an `OrderStatus` or its value).
+#   - `event` (str): What happened, e.g. "status_changed" or "payment_succeeded".
+# - Details:
+#   - Call this after the change has been committed.
+def publish_order_event(reference: str, status, event: str = "status_changed"):
+    event_bus.publish(
+        ORDER_STATUS_CHANNEL,
+        {
+            "order_reference": reference,
+            "status": getattr(status, "value", status),
+            "event": event,
+        },
+    )
@@ -0,0 +1,130 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from core.metrics import metrics
+
+# bcrypt cost factor of new hashes; pick it with benchmarks/bench_bcrypt.py
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Threads running bcrypt; the C implementation releases the GIL while hashing
+HASHING_WORKERS = int(os.getenv("HASHING_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Hash/verify calls allowed to wait or run at once before new calls are rejected
+HASHING_MAX_PENDING = int(os.getenv("HASHING_MAX_PENDING", str(HASHING_WORKERS * 16)))
+
+# Password hashing utility. Hashes with a different cost factor still verify.
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS
+)
+
+hashing_pending = metrics.gauge(
+    "password_hashing_pending", "Password hash/verify calls queued or running."
+)
+hashing_queue_seconds = metrics.histogram(
+    "password_hashing_queue_seconds",
+    "Time password hash/verify calls wait for a worker, by operation.",
+)
+hashing_seconds = metrics.histogram(
+    "password_hashing_seconds", "Time spent running bcrypt, by operation."
+)
+hashing_rejected = metrics.counter(
+    "password_hashing_rejected_total",
+    "Password hash/verify calls rejected because the queue was full, by operation.",
+)
+
+
+# ---------------------------
+# Password Hasher
+# ---------------------------
+
+
+# PASSWORD HASHER
+# - Runs bcrypt on a bounded thread pool behind an async API.
+# - Details:
+#   - bcrypt takes hundreds of milliseconds by design; running it on the
+#     event loop would stall every other request on the worker.
+#   - At most `max_pending` calls may be queued or running. Further calls fail
+#     at once with 503 and `Retry-After`, so overload sheds logins instead of
+#     growing latency for everyone.
+class PasswordHasher:
+    def __init__(
+        self, workers: int = HASHING_WORKERS, max_pending: int = HASHING_MAX_PENDING
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    # HASH
+    # - Returns the bcrypt hash of `password`.
+    # - Raises:
+    #   - `HTTPException`: 503 if the hashing queue is full.
+    async def hash(self, password: str) -> str:
+        return await self._submit("hash", pwd_context.hash, password)
+
+    # VERIFY
+    # - Returns whether `password` matches `hashed_password`.
+    # - Raises:
+    #   - `HTTPException`: 503 if the hashing queue is full.
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._submit(
+            "verify", pwd_context.verify, password, hashed_password
+        )
+
+    async def _submit(self, operation: str, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                hashing_rejected.inc(operation=operation)
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Server is busy, please retry shortly.",
+                    headers={"Retry-After": "1"},
+                )
+            self._pending += 1
+            hashing_pending.set(self._pending)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="bcrypt"
+                )
+            executor = self._executor
+        queued_at = time.perf_counter()
+
+        def run():
+            started = time.perf_counter()
+            hashing_queue_seconds.observe(started - queued_at, operation=operation)
+            try:
+                return fn(*args)
+            finally:
+                hashing_seconds.observe(
+                    time.perf_counter() - started, operation=operation
+                )
+                self._release()
+
+        try:
+            future = executor.submit(run)
+        except Exception:
+            self._release()
+            raise
+        # A cancelled request leaves the call running; its slot is released
+        # only when the worker finishes.
+        return await asyncio.wrap_future(future)
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+            hashing_pending.set(self._pending)
+
+    # SHUTDOWN
+    # - Waits for running calls and stops the worker threads.
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+password_hasher = PasswordHasher()
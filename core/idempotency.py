@@ -0,0 +1,305 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import delete, or_, update
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+from db.models import IdempotencyKey
+from db.session import SessionLocal, db_dependency
+
+logger = logging.getLogger(__name__)
+
+
+# How long a stored response can be replayed
+IDEMPOTENCY_TTL = timedelta(hours=24)
+# How long a duplicate request waits for the first one before giving up
+IDEMPOTENCY_WAIT_SECONDS = 30
+IDEMPOTENCY_POLL_SECONDS = 0.1
+# How long an unfinished key stays owned without a lease refresh; a worker
+# killed mid-request thus blocks retries for at most this long
+IDEMPOTENCY_LEASE = timedelta(seconds=30)
+IDEMPOTENCY_LEASE_REFRESH_SECONDS = 10
+# Minimum interval between sweeps of expired keys
+PURGE_INTERVAL_SECONDS = 60
+
+# Requests currently running in this process, by scoped key
+_inflight: Dict[str, asyncio.Future] = {}
+_last_purge = 0.0
+
+
+# ---------------------------
+# Idempotency Helpers
+# ---------------------------
+
+
+# HASH REQUEST
+# - Builds a stable fingerprint of the request parameters.
+# - Parameters:
+#   - `*parts`: JSON-serializable request parameters.
+# - Returns:
+#   - (str): A SHA-256 hex digest of the parameters.
+def hash_request(*parts) -> str:
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# PURGE EXPIRED KEYS
+# - Deletes stored responses whose TTL has passed.
+# - Parameters:
+#   - `db` (db_dependency): The database session.
+# - Returns:
+#   - (int): The number of rows deleted.
+def purge_expired_idempotency_keys(db: db_dependency) -> int:
+    result = db.execute(
+        delete(IdempotencyKey).where(IdempotencyKey.expires_at < datetime.utcnow())
+    )
+    db.commit()
+    return result.rowcount
+
+
+def _maybe_purge(db: db_dependency):
+    global _last_purge
+    now = time.monotonic()
+    if now - _last_purge >= PURGE_INTERVAL_SECONDS:
+        _last_purge = now
+        purge_expired_idempotency_keys(db)
+
+
+def _replay(record: IdempotencyKey, request_hash: str) -> JSONResponse:
+    if record.request_hash != request_hash:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key was already used with different request parameters",
+        )
+    return JSONResponse(
+        content=record.response_body,
+        status_code=record.status_code,
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+def _lease_expired(record: IdempotencyKey) -> bool:
+    return record.locked_until is None or record.locked_until < datetime.utcnow()
+
+
+# CLAIM KEY
+# - Records that this process is now executing the request for `scoped_key`.
+# - Returns:
+#   - (IdempotencyKey | None): The existing record if another request got there first.
+# - Details:
+#   - An unfinished record whose lease lapsed belonged to a worker that died
+#     mid-request; it is taken over with a conditional update.
+def _claim(db: db_dependency, scoped_key: str, request_hash: str):
+    now = datetime.utcnow()
+    record = db.get(IdempotencyKey, scoped_key)
+    if record is not None and record.expires_at < now:
+        db.delete(record)
+        db.commit()
+        record = None
+    if record is not None:
+        if record.status_code is not None or not _lease_expired(record):
+            return record
+        result = db.execute(
+            update(IdempotencyKey)
+            .where(
+                IdempotencyKey.key == scoped_key,
+                IdempotencyKey.status_code.is_(None),
+                or_(
+                    IdempotencyKey.locked_until.is_(None),
+                    IdempotencyKey.locked_until < now,
+                ),
+            )
+            .values(request_hash=request_hash, locked_until=now + IDEMPOTENCY_LEASE)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        if result.rowcount == 1:
+            return None
+        db.expire_all()
+        return db.get(IdempotencyKey, scoped_key)
+    db.add(
+        IdempotencyKey(
+            key=scoped_key,
+            request_hash=request_hash,
+            expires_at=now + IDEMPOTENCY_TTL,
+            locked_until=now + IDEMPOTENCY_LEASE,
+        )
+    )
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return db.get(IdempotencyKey, scoped_key)
+    return None
+
+
+def _poll(db: db_dependency, scoped_key: str):
+    db.expire_all()
+    return db.get(IdempotencyKey, scoped_key)
+
+
+def _complete(db: db_dependency, scoped_key: str, status_code: int, content):
+    record = db.get(IdempotencyKey, scoped_key)
+    record.status_code = status_code
+    record.response_body = content
+    record.locked_until = None
+    db.commit()
+
+
+def _release(db: db_dependency, scoped_key: str):
+    db.rollback()
+    db.execute(delete(IdempotencyKey).where(IdempotencyKey.key == scoped_key))
+    db.commit()
+
+
+def _extend_lease(scoped_key: str):
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(IdempotencyKey)
+            .where(
+                IdempotencyKey.key == scoped_key,
+                IdempotencyKey.status_code.is_(None),
+            )
+            .values(locked_until=datetime.utcnow() + IDEMPOTENCY_LEASE)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+# Refreshes the lease of `scoped_key` until cancelled; uses its own session
+# because the request's session is busy running the work
+async def _hold_lease(scoped_key: str):
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_LEASE_REFRESH_SECONDS)
+        try:
+            await run_in_threadpool(_extend_lease, scoped_key)
+        except Exception:
+            logger.exception("Could not refresh idempotency lease %s", scoped_key)
+
+
+# WAIT FOR ANOTHER WORKER
+# - Polls the stored record until the request that owns it completes.
+# - Returns:
+#   - (IdempotencyKey | None): The completed record, or None if the owner failed
+#     and released it or its lease lapsed, so the key can be claimed again.
+# - Raises:
+#   - `HTTPException`: 409 if the owner does not finish within the wait limit.
+async def _wait_for_record(db: db_dependency, scoped_key: str):
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        record = await run_in_threadpool(_poll, db, scoped_key)
+        if record is None or record.status_code is not None:
+            return record
+        if _lease_expired(record):
+            return None
+        await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="A request with this Idempotency-Key is still being processed",
+    )
+
+
+# ---------------------------
+# Idempotent Execution
+# ---------------------------
+
+
+# RUN IDEMPOTENT
+# - Executes `work` at most once per idempotency key and replays its response.
+# - Parameters:
+#   - `db` (db_dependency): The database session.
+#   - `key` (Optional[str]): The client's `Idempotency-Key` header; when absent, `work` simply runs.
+#   - `scope` (str): Namespace for the key, e.g. the route and caller.
+#   - `request_hash` (str): Fingerprint of the request, from `hash_request`.
+#   - `work` (Callable): A synchronous function returning the response content.
+#   - `status_code` (int): The status code of a successful response.
+# - Returns:
+#   - The response content, or a `JSONResponse` when a key was supplied.
+# - Raises:
+#   - `HTTPException`: 422 if the key is reused with different parameters, 409 if
+#     the original request is still running elsewhere after the wait limit, or
+#     whatever `work` raised.
+# - Details:
+#   - Duplicates arriving in the same process await the first request's result;
+#     duplicates on other workers poll the stored record.
+#   - Failed requests release the key so the client can retry. The owner holds
+#     a lease on the key while `work` runs; if the worker dies the lease lapses
+#     and a retry takes the key over.
+#   - All database bookkeeping runs in the threadpool, like `work` itself.
+async def run_idempotent(
+    db: db_dependency,
+    key: Optional[str],
+    scope: str,
+    request_hash: str,
+    work: Callable[[], Any],
+    status_code: int = 200,
+):
+    if not key:
+        return await run_in_threadpool(work)
+
+    scoped_key = f"{scope}:{key}"
+    pending = _inflight.get(scoped_key)
+    if pending is not None:
+        content, recorded_hash, recorded_status = await asyncio.shield(pending)
+        if recorded_hash != request_hash:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key was already used with different request parameters",
+            )
+        return JSONResponse(
+            content=content,
+            status_code=recorded_status,
+            headers={"Idempotent-Replayed": "true"},
+        )
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[scoped_key] = future
+    try:
+        await run_in_threadpool(_maybe_purge, db)
+        while True:
+            record = await run_in_threadpool(_claim, db, scoped_key, request_hash)
+            if record is None:
+                break
+            if record.status_code is None:
+                record = await _wait_for_record(db, scoped_key)
+                if record is None:
+                    continue
+            future.set_result(
+                (record.response_body, record.request_hash, record.status_code)
+            )
+            return _replay(record, request_hash)
+
+        lease = asyncio.create_task(_hold_lease(scoped_key))
+        try:
+            content = jsonable_encoder(await run_in_threadpool(work))
+        except BaseException:
+            await asyncio.shield(run_in_threadpool(_release, db, scoped_key))
+            raise
+        finally:
+            lease.cancel()
+
+        await run_in_threadpool(_complete, db, scoped_key, status_code, content)
+        future.set_result((content, request_hash, status_code))
+        return JSONResponse(content=content, status_code=status_code)
+    except BaseException as e:
+        if not future.done():
+            if isinstance(e, asyncio.CancelledError):
+                e = HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="The original request was interrupted, please retry",
+                )
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else is waiting on it
+            future.exception()
+        raise
+    finally:
+        _inflight.pop(scoped_key, None)
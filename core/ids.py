@@ -0,0 +1,70 @@
+import os
+import threading
+import time
+import uuid
+from typing import Optional
+
+_lock = threading.Lock()
+_last_ms = 0
+_counter = 0
+
+
+# ---------------------------
+# Identifier Functions
+# ---------------------------
+
+
+# GENERATE UUIDv7
+# - Generates a time-ordered UUID (RFC 9562 version 7).
+# - Returns:
+#   - (uuid.UUID): A UUID whose leading 48 bits are the Unix time in milliseconds.
+# - Details:
+#   - New identifiers sort after older ones, so inserts land at the right edge of
+#     B-tree indexes instead of scattering across them like `uuid4()`.
+#   - Within one millisecond the 12-bit `rand_a` field is used as a counter,
+#     keeping identifiers generated by this process strictly increasing.
+def uuid7() -> uuid.UUID:
+    global _last_ms, _counter
+    with _lock:
+        ms = time.time_ns() // 1_000_000
+        if ms > _last_ms:
+            _last_ms = ms
+            _counter = int.from_bytes(os.urandom(2), "big") & 0x3FF
+        else:
+            _counter += 1
+            if _counter > 0xFFF:
+                _last_ms += 1
+                _counter = 0
+            ms = _last_ms
+        counter = _counter
+    rand_b = int.from_bytes(os.urandom(8), "big") & ((1 << 62) - 1)
+    value = (
+        (ms & ((1 << 48) - 1)) << 80
+        | 0x7 << 76
+        | counter << 64
+        | 0b10 << 62
+        | rand_b
+    )
+    return uuid.UUID(int=value)
+
+
+# NEW IDENTIFIER
+# - Returns a new time-ordered identifier in its canonical string form.
+def new_id() -> str:
+    return str(uuid7())
+
+
+# PARSE IDENTIFIER
+# - Normalizes a client-supplied UUID string (order reference, payment id).
+# - Parameters:
+#   - `value` (str): The identifier as received.
+# - Returns:
+#   - (str | None): The canonical lowercase form, or None if `value` is not a UUID.
+# - Details:
+#   - Both time-ordered and legacy `uuid4()` identifiers are accepted. Lookups
+#     should treat None as "not found" rather than binding it to a UUID column.
+def parse_id(value: str) -> Optional[str]:
+    try:
+        return str(uuid.UUID(str(value)))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from email.message import EmailMessage
+from email.utils import formataddr
+from typing import List, Optional
+import aiosmtplib
+from core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes")
+
+
+# SMTP settings; point MAIL_SERVER/MAIL_PORT at a local sink such as aiosmtpd
+# (`python -m aiosmtpd -n -l localhost:1025`, MAIL_SSL_TLS=false) for testing
+MAIL_SERVER = os.getenv("MAIL_SERVER", "smtp.gmail.com")
+MAIL_PORT = int(os.getenv("MAIL_PORT", "465"))
+MAIL_USERNAME = os.getenv("MAIL_USERNAME")
+MAIL_PASSWORD = os.getenv("MAIL_PASSWORD")
+MAIL_FROM = os.getenv("MAIL_FROM")
+MAIL_FROM_NAME = os.getenv("MAIL_FROM_NAME", "Your App Name")
+MAIL_SSL_TLS = _env_flag("MAIL_SSL_TLS", "true")
+MAIL_STARTTLS = _env_flag("MAIL_STARTTLS", "false")
+MAIL_VALIDATE_CERTS = _env_flag("MAIL_VALIDATE_CERTS", "true")
+MAIL_TIMEOUT_SECONDS = float(os.getenv("MAIL_TIMEOUT_SECONDS", "30"))
+# Persistent SMTP connections, one per delivery worker
+MAIL_POOL_SIZE = int(os.getenv("MAIL_POOL_SIZE", "2"))
+# Messages waiting for a worker before producers are held back
+MAIL_QUEUE_SIZE = int(os.getenv("MAIL_QUEUE_SIZE", "1000"))
+# Seconds a producer waits for queue space before giving up
+MAIL_ENQUEUE_TIMEOUT_SECONDS = float(os.getenv("MAIL_ENQUEUE_TIMEOUT_SECONDS", "5"))
+# Delivery attempts per message, with exponential backoff between them
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "4"))
+MAIL_BACKOFF_BASE_SECONDS = 1.0
+MAIL_BACKOFF_MAX_SECONDS = 30.0
+# Seconds queued messages may still be delivered during shutdown
+MAIL_DRAIN_SECONDS = 10.0
+
+mail_queue_depth = metrics.gauge("mail_queue_depth", "Messages waiting for delivery.")
+mail_sent = metrics.counter("mail_sent_total", "Messages delivered.")
+mail_failed = metrics.counter(
+    "mail_failed_total", "Messages dropped after the last attempt or a full queue."
+)
+mail_retries = metrics.counter("mail_retries_total", "Delivery attempts that failed.")
+mail_connections = metrics.counter(
+    "mail_connections_opened_total", "SMTP connections opened."
+)
+mail_queue_seconds = metrics.histogram(
+    "mail_queue_seconds", "Time messages wait in the queue for a worker."
+)
+mail_send_seconds = metrics.histogram(
+    "mail_send_seconds", "Time to hand one message to the SMTP server."
+)
+
+
+class MailQueueFull(Exception):
+    pass
+
+
+@dataclass
+class _Job:
+    message: EmailMessage
+    future: Optional[asyncio.Future] = None
+    attempts: int = 0
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+# ---------------------------
+# Mailer
+# ---------------------------
+
+
+# MAILER
+# - Delivers email from a bounded queue over a pool of persistent SMTP connections.
+# - Details:
+#   - Each delivery worker keeps one authenticated connection open and sends
+#     message after message over it, so the TLS handshake and login are paid
+#     once per connection instead of once per message.
+#   - A failed attempt closes the connection (the next attempt reconnects) and
+#     the message is retried with exponential backoff and jitter, up to
+#     `MAIL_MAX_ATTEMPTS` times.
+#   - The queue is bounded: producers wait up to `MAIL_ENQUEUE_TIMEOUT_SECONDS`
+#     for space, then get `MailQueueFull`.
+#   - Workers start lazily with the first message and are stopped by the
+#     application lifespan, which gives queued messages a moment to drain.
+class Mailer:
+    def __init__(
+        self,
+        pool_size: int = MAIL_POOL_SIZE,
+        queue_size: int = MAIL_QUEUE_SIZE,
+        max_attempts: int = MAIL_MAX_ATTEMPTS,
+    ):
+        self.pool_size = pool_size
+        self.queue_size = queue_size
+        self.max_attempts = max_attempts
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    # BUILD MESSAGE
+    # - Returns an `EmailMessage` from the configured sender.
+    @staticmethod
+    def build_message(
+        subject: str, recipient: str, body: str, subtype: str = "plain"
+    ) -> EmailMessage:
+        message = EmailMessage()
+        message["Subject"] = subject
+        message["From"] = formataddr((MAIL_FROM_NAME, MAIL_FROM or ""))
+        message["To"] = recipient
+        message.set_content(body, subtype=subtype)
+        return message
+
+    # SEND
+    # - Queues a message and waits until it is delivered.
+    # - Raises:
+    #   - `MailQueueFull`: If the queue stayed full.
+    #   - The last SMTP error if every attempt failed.
+    async def send(self, message: EmailMessage):
+        future = asyncio.get_running_loop().create_future()
+        await self._put(_Job(message, future))
+        await future
+
+    # ENQUEUE
+    # - Queues a message without waiting for its delivery.
+    # - Raises:
+    #   - `MailQueueFull`: If the queue stayed full.
+    async def enqueue(self, message: EmailMessage):
+        await self._put(_Job(message))
+
+    async def _put(self, job: _Job):
+        self._ensure_started()
+        try:
+            await asyncio.wait_for(self._queue.put(job), MAIL_ENQUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            mail_failed.inc(reason="queue_full")
+            raise MailQueueFull("Mail queue is full") from None
+        mail_queue_depth.set(self._queue.qsize())
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._workers:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._workers = [
+            asyncio.create_task(self._run()) for _ in range(self.pool_size)
+        ]
+
+    # STOP
+    # - Lets queued messages drain briefly, then stops the workers.
+    async def stop(self, drain_seconds: float = MAIL_DRAIN_SECONDS):
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), drain_seconds)
+        except asyncio.TimeoutError:
+            logger.warning(
+                "Stopping mailer with %d undelivered messages", self._queue.qsize()
+            )
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._loop = None
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        smtp = aiosmtplib.SMTP(
+            hostname=MAIL_SERVER,
+            port=MAIL_PORT,
+            use_tls=MAIL_SSL_TLS,
+            start_tls=MAIL_STARTTLS if not MAIL_SSL_TLS else False,
+            validate_certs=MAIL_VALIDATE_CERTS,
+            timeout=MAIL_TIMEOUT_SECONDS,
+        )
+        await smtp.connect()
+        if MAIL_USERNAME:
+            await smtp.login(MAIL_USERNAME, MAIL_PASSWORD or "")
+        mail_connections.inc()
+        return smtp
+
+    @staticmethod
+    async def _close(smtp: Optional[aiosmtplib.SMTP]):
+        if smtp is None:
+            return
+        try:
+            if smtp.is_connected:
+                await smtp.quit()
+        except Exception:
+            smtp.close()
+
+    async def _run(self):
+        smtp: Optional[aiosmtplib.SMTP] = None
+        try:
+            while True:
+                job = await self._queue.get()
+                mail_queue_depth.set(self._queue.qsize())
+                mail_queue_seconds.observe(time.monotonic() - job.queued_at)
+                try:
+                    smtp = await self._deliver(job, smtp)
+                finally:
+                    self._queue.task_done()
+        finally:
+            await self._close(smtp)
+
+    # Delivers one job, retrying with backoff; returns the connection to reuse
+    async def _deliver(self, job: _Job, smtp: Optional[aiosmtplib.SMTP]):
+        while True:
+            job.attempts += 1
+            try:
+                if smtp is None or not smtp.is_connected:
+                    smtp = await self._connect()
+                with mail_send_seconds.time():
+                    await smtp.send_message(job.message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self._close(smtp)
+                smtp = None
+                mail_retries.inc()
+                if job.attempts >= self.max_attempts:
+                    mail_failed.inc(reason="attempts")
+                    logger.warning(
+                        "Giving up on mail to %s after %d attempts: %s",
+                        job.message["To"],
+                        job.attempts,
+                        e,
+                    )
+                    if job.future is not None and not job.future.done():
+                        job.future.set_exception(e)
+                    return smtp
+                delay = min(
+                    MAIL_BACKOFF_BASE_SECONDS * 2 ** (job.attempts - 1),
+                    MAIL_BACKOFF_MAX_SECONDS,
+                )
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+                continue
+            mail_sent.inc()
+            if job.future is not None and not job.future.done():
+                job.future.set_result(None)
+            return smtp
+
+
+mailer = Mailer()
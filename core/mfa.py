@@ -1,11 +1,36 @@
 import pyotp
 import qrcode
+import qrcode.image.svg
 from db.models import User
 from db.session import db_dependency
+from core.principal import invalidate_principal
+from core.metrics import metrics
 from fastapi import HTTPException
+from collections import OrderedDict
+import asyncio
+import hashlib
+import hmac
+import os
+import threading
+import time
 import io
 import base64
 
+# Rendered QR codes kept per worker
+QR_CACHE_SIZE = 1024
+# Seconds each emailed TOTP code step lasts
+TOTP_INTERVAL = int(os.getenv("TOTP_INTERVAL", "120"))
+# Steps before or after the current one that are still accepted
+TOTP_DRIFT_STEPS = int(os.getenv("TOTP_DRIFT_STEPS", "1"))
+# Prepared TOTP generators kept per worker
+TOTP_CACHE_SIZE = 10_000
+
+_qr_cache: "OrderedDict[str, str]" = OrderedDict()
+_qr_cache_lock = threading.Lock()
+qr_cache_lookups = metrics.counter(
+    "totp_qr_cache_lookups_total", "2FA QR code cache lookups by result."
+)
+
 
 # **Generate TOTP Secret**
 # - Generates a random base32 secret for TOTP authentication.
@@ -26,9 +51,14 @@ def generate_totp_secret():
 #   - Ensures the user record is committed and refreshed.
 def enable_2fa(db: db_dependency, user: User):
     """Enable 2FA by generating and saving an otp_secret for the user."""
+    previous_secret = user.otp_secret
     totp_secret = generate_totp_secret()
     user.otp_secret = totp_secret  # Generates a TOTP secret
     db.commit()
+    invalidate_principal(user.id)
+    totp_verifier.invalidate(user.id)
+    if previous_secret:
+        invalidate_totp_qr(user.email, previous_secret)
     db.refresh(user)
     return totp_secret
 
@@ -47,46 +77,113 @@ def disable_2fa(db: db_dependency, user: User):
     """Disable 2FA by clearing the otp_secret."""
     if not user.otp_secret:
         raise HTTPException(status_code=400, detail="2FA is not enabled for this user.")
+    previous_secret = user.otp_secret
     user.otp_secret = None
     db.commit()
+    invalidate_principal(user.id)
+    totp_verifier.invalidate(user.id)
+    invalidate_totp_qr(user.email, previous_secret)
     db.refresh(user)
     return {"msg": "2FA disabled"}
 
 
-# **GENERATE TOTP CODE**
-# - Parameters:
-#   - `otp_secret` (str): The user's TOTP secret.
-#   - `interval` (int): The time interval for TOTP generation (default is 120 seconds).
-# - Response:
-#   - A TOTP code as a string.
-# - Details:
-#   - This function generates a time-sensitive one-time password using the TOTP secret.
-def generate_totp_code(otp_secret: str, interval: int = 120) -> str:
-    """Generates a TOTP code based on the user's otp_secret."""
-    totp = pyotp.TOTP(otp_secret, interval=interval)
-    totp_code = totp.now()  # Generate the TOTP code
-    print(f"Generated TOTP code: {totp_code}")
-    return totp.now()
+totp_codes_generated = metrics.counter(
+    "totp_codes_generated_total", "TOTP codes generated for delivery by email."
+)
+totp_verifications = metrics.counter(
+    "totp_verifications_total", "TOTP code verifications by result."
+)
 
 
-# **VERIFY TOTP CODE**
-# - Parameters:
-#   - `otp_secret` (str): The user's TOTP secret.
-#   - `code` (str): The TOTP code to be verified.
-#   - `interval` (int): The time interval for TOTP validation (default is 120 seconds).
-# - Response:
-#   - A boolean indicating whether the code is valid.
+# **TOTP VERIFIER**
+# - Generates and verifies the TOTP codes of each user.
 # - Details:
-#   - This function validates a given TOTP code against the user's TOTP secret.
-#   - Raises a ValueError if the user does not have 2FA enabled.
-def verify_totp_code(otp_secret, code: str, interval: int = 120) -> bool:
-    """Verify a TOTP code using the user's otp_secret."""
-    if not otp_secret:
-        raise ValueError("2FA is not enabled for this user.")
-    totp = pyotp.TOTP(otp_secret, interval=interval)
-    expected_code = totp.now()
-    print(f"Expected TOTP code:{expected_code}")
-    return totp.verify(code)
+#   - Prepared `pyotp.TOTP` objects are cached per user id in a bounded LRU and
+#     replaced when the secret changes.
+#   - A code is accepted within `drift_steps` steps of the current one and
+#     compared in constant time.
+#   - Each accepted (user, step) is remembered in a bucket per step; a second
+#     use of the same code is rejected as a replay. Buckets are dropped whole
+#     once their step can no longer verify.
+#   - The used-code set is per worker, so a replay landing on another worker
+#     within the same step is not detected.
+class TotpVerifier:
+    def __init__(
+        self,
+        interval: int = TOTP_INTERVAL,
+        drift_steps: int = TOTP_DRIFT_STEPS,
+        size: int = TOTP_CACHE_SIZE,
+    ):
+        self.interval = interval
+        self.drift_steps = drift_steps
+        self.size = size
+        self._totps: "OrderedDict[int, tuple]" = OrderedDict()
+        self._used: dict = {}
+        self._lock = threading.Lock()
+
+    def _totp(self, user_id: int, otp_secret: str) -> pyotp.TOTP:
+        with self._lock:
+            entry = self._totps.get(user_id)
+            if entry is not None and entry[0] == otp_secret:
+                self._totps.move_to_end(user_id)
+                return entry[1]
+            totp = pyotp.TOTP(otp_secret, interval=self.interval)
+            self._totps[user_id] = (otp_secret, totp)
+            self._totps.move_to_end(user_id)
+            while len(self._totps) > self.size:
+                self._totps.popitem(last=False)
+            return totp
+
+    # **GENERATE**
+    # - Returns the current TOTP code of a user, e.g. to send it by email.
+    def generate(self, user_id: int, otp_secret: str) -> str:
+        totp = self._totp(user_id, otp_secret)
+        totp_codes_generated.inc()
+        return totp.generate_otp(int(time.time()) // self.interval)
+
+    # **VERIFY**
+    # - Parameters:
+    #   - `user_id` (int): The user the code belongs to.
+    #   - `otp_secret` (str): The user's TOTP secret.
+    #   - `code` (str): The submitted code.
+    # - Response:
+    #   - True if the code is valid and has not been used before.
+    def verify(self, user_id: int, otp_secret: str, code: str) -> bool:
+        if not otp_secret:
+            totp_verifications.inc(result="not_enabled")
+            return False
+        totp = self._totp(user_id, otp_secret)
+        code = (code or "").strip()
+        if len(code) != totp.digits or not code.isdigit():
+            totp_verifications.inc(result="malformed")
+            return False
+        step = int(time.time()) // self.interval
+        matched = None
+        for candidate in range(step - self.drift_steps, step + self.drift_steps + 1):
+            if hmac.compare_digest(totp.generate_otp(candidate), code):
+                matched = candidate
+        if matched is None:
+            totp_verifications.inc(result="invalid")
+            return False
+        with self._lock:
+            for expired in [s for s in self._used if s < step - self.drift_steps]:
+                del self._used[expired]
+            used = self._used.setdefault(matched, set())
+            if user_id in used:
+                totp_verifications.inc(result="replay")
+                return False
+            used.add(user_id)
+        totp_verifications.inc(result="valid")
+        return True
+
+    # **INVALIDATE**
+    # - Drops a user's prepared TOTP object after their secret changed.
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._totps.pop(user_id, None)
+
+
+totp_verifier = TotpVerifier()
 
 
 # GENERATE QR CODE
@@ -108,3 +205,68 @@ def generate_totp_qr_base64(user_email, totp_secret):
     img.save(buffered, format="PNG")
     qr_code_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
     return qr_code_base64
+
+
+# **GENERATE QR CODE AS SVG**
+# - Parameters:
+#   - `user_email` (str): The user's email address.
+#   - `totp_secret` (str): The TOTP secret to be encoded into the QR code.
+# - Response:
+#   - The QR code as SVG markup.
+# - Details:
+#   - Writes vector paths only, skipping raster rendering and PNG compression.
+def generate_totp_qr_svg(user_email, totp_secret):
+    totp_uri = pyotp.TOTP(totp_secret).provisioning_uri(
+        user_email, issuer_name="YourAppName"
+    )
+    img = qrcode.make(totp_uri, image_factory=qrcode.image.svg.SvgPathImage)
+    return img.to_string(encoding="unicode")
+
+
+_QR_RENDERERS = {"png": generate_totp_qr_base64, "svg": generate_totp_qr_svg}
+
+
+# The cache never holds the secret itself as a key
+def _qr_cache_key(fmt: str, user_email: str, totp_secret: str) -> str:
+    material = "\0".join((fmt, user_email, totp_secret)).encode("utf-8")
+    return hashlib.sha256(material).hexdigest()
+
+
+# **GET QR CODE (CACHED)**
+# - Parameters:
+#   - `user_email` (str): The user's email address.
+#   - `totp_secret` (str): The TOTP secret to be encoded into the QR code.
+#   - `fmt` (str): "png" for a Base64-encoded PNG, or "svg" for SVG markup.
+# - Response:
+#   - The rendered QR code.
+# - Details:
+#   - Rendered codes are kept in a bounded LRU keyed by a SHA-256 of the format,
+#     email and secret, so a new secret or email never hits a stale entry.
+#   - Rendering runs in a worker thread to keep the event loop free.
+async def get_totp_qr(user_email: str, totp_secret: str, fmt: str = "png") -> str:
+    key = _qr_cache_key(fmt, user_email, totp_secret)
+    with _qr_cache_lock:
+        cached = _qr_cache.get(key)
+        if cached is not None:
+            _qr_cache.move_to_end(key)
+    if cached is not None:
+        qr_cache_lookups.inc(result="hit")
+        return cached
+    qr_cache_lookups.inc(result="miss")
+    rendered = await asyncio.to_thread(_QR_RENDERERS[fmt], user_email, totp_secret)
+    with _qr_cache_lock:
+        _qr_cache[key] = rendered
+        while len(_qr_cache) > QR_CACHE_SIZE:
+            _qr_cache.popitem(last=False)
+    return rendered
+
+
+# **INVALIDATE QR CODE**
+# - Drops the cached QR codes of a user's email and secret in this worker.
+# - Details:
+#   - Other workers keep their copies until evicted, but those are keyed by the
+#     old secret and are never served again.
+def invalidate_totp_qr(user_email: str, totp_secret: str):
+    with _qr_cache_lock:
+        for fmt in _QR_RENDERERS:
+            _qr_cache.pop(_qr_cache_key(fmt, user_email, totp_secret), None)
@@ -0,0 +1,236 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+from db.models import OutboxEvent
+from db.session import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Events claimed per dispatcher round
+OUTBOX_BATCH_SIZE = 50
+# Seconds between polls when the outbox is idle
+OUTBOX_POLL_SECONDS = 2
+# How long a claimed event stays invisible to other dispatchers
+OUTBOX_LEASE = timedelta(minutes=5)
+# Attempts before an event is parked as failed
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BACKOFF_BASE_SECONDS = 5
+OUTBOX_BACKOFF_MAX_SECONDS = 3600
+# How long delivered events are kept before being purged
+OUTBOX_RETENTION = timedelta(days=7)
+
+OutboxHandler = Callable[[dict], Awaitable[None]]
+_handlers: Dict[str, OutboxHandler] = {}
+
+
+# ---------------------------
+# Outbox Functions
+# ---------------------------
+
+
+# REGISTER OUTBOX HANDLER
+# - Decorator registering the coroutine that delivers events of `topic`.
+# - Details:
+#   - Handlers receive the event payload and must be safe to run more than once
+#     (delivery is at-least-once). Raising schedules a retry with backoff.
+def outbox_handler(topic: str):
+    def register(func: OutboxHandler) -> OutboxHandler:
+        _handlers[topic] = func
+        return func
+
+    return register
+
+
+# ENQUEUE OUTBOX EVENT
+# - Records a side effect in the caller's transaction.
+# - Parameters:
+#   - `db` (Session): The database session of the business change.
+#   - `topic` (str): The handler topic, e.g. "email.verification".
+#   - `payload` (dict): JSON-serializable data for the handler.
+# - Returns:
+#   - (OutboxEvent): The pending event; it is written when the caller commits.
+def enqueue_outbox_event(db: Session, topic: str, payload: dict) -> OutboxEvent:
+    event = OutboxEvent(
+        topic=topic,
+        payload=payload,
+        status="pending",
+        attempts=0,
+        available_at=datetime.utcnow(),
+    )
+    db.add(event)
+    return event
+
+
+def _backoff(attempts: int) -> timedelta:
+    seconds = OUTBOX_BACKOFF_BASE_SECONDS * (2 ** (attempts - 1))
+    return timedelta(seconds=min(seconds, OUTBOX_BACKOFF_MAX_SECONDS))
+
+
+# CLAIM DUE EVENTS
+# - Leases a batch of due events so no other dispatcher picks them up meanwhile.
+# - Returns:
+#   - (List[dict]): The claimed events' `id`, `topic`, `payload` and `attempts`.
+def _claim_due_events(batch_size: int) -> List[dict]:
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        events = (
+            db.query(OutboxEvent)
+            .filter(OutboxEvent.status == "pending", OutboxEvent.available_at <= now)
+            .order_by(OutboxEvent.available_at, OutboxEvent.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        claimed = []
+        for event in events:
+            event.available_at = now + OUTBOX_LEASE
+            claimed.append(
+                {
+                    "id": event.id,
+                    "topic": event.topic,
+                    "payload": event.payload,
+                    "attempts": event.attempts,
+                }
+            )
+        db.commit()
+        return claimed
+    finally:
+        db.close()
+
+
+# RECORD DELIVERY RESULTS
+# - Marks delivered events as sent and reschedules or parks failed ones.
+def _record_results(results: List[tuple]):
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        for event_id, error in results:
+            event = db.get(OutboxEvent, event_id)
+            if event is None:
+                continue
+            event.attempts += 1
+            if error is None:
+                event.status = "sent"
+                event.sent_at = now
+                event.last_error = None
+            else:
+                event.last_error = error[:1000]
+                if event.attempts >= OUTBOX_MAX_ATTEMPTS:
+                    event.status = "failed"
+                else:
+                    event.available_at = now + _backoff(event.attempts)
+        db.commit()
+    finally:
+        db.close()
+
+
+# PURGE DELIVERED EVENTS
+# - Deletes sent events older than the retention period.
+def purge_sent_outbox_events() -> int:
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            delete(OutboxEvent).where(
+                OutboxEvent.status == "sent",
+                OutboxEvent.sent_at < datetime.utcnow() - OUTBOX_RETENTION,
+            )
+        )
+        db.commit()
+        return result.rowcount
+    finally:
+        db.close()
+
+
+# ---------------------------
+# Outbox Dispatcher
+# ---------------------------
+
+
+# OUTBOX DISPATCHER
+# - Background task draining the outbox in batches.
+# - Details:
+#   - Every worker may run a dispatcher; `SELECT ... FOR UPDATE SKIP LOCKED`
+#     plus a lease keeps them from delivering the same event concurrently.
+#   - An event whose dispatcher crashed becomes due again when its lease ends,
+#     so delivery is at-least-once.
+#   - `wake()` lets request handlers trigger delivery without waiting for the
+#     next poll.
+class OutboxDispatcher:
+    def __init__(self, batch_size: int = OUTBOX_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    # WAKE
+    # - Asks the dispatcher to poll now; safe to call from any thread.
+    def wake(self):
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    # DRAIN ONCE
+    # - Delivers one batch of due events.
+    # - Returns:
+    #   - (int): The number of events attempted.
+    async def drain_once(self) -> int:
+        events = await asyncio.to_thread(_claim_due_events, self.batch_size)
+        if not events:
+            return 0
+        outcomes = await asyncio.gather(*(self._deliver(event) for event in events))
+        await asyncio.to_thread(_record_results, list(outcomes))
+        return len(events)
+
+    async def _deliver(self, event: dict):
+        handler = _handlers.get(event["topic"])
+        if handler is None:
+            return event["id"], f"No handler registered for topic {event['topic']}"
+        try:
+            await handler(event["payload"])
+            return event["id"], None
+        except Exception as e:
+            logger.warning("Outbox event %s failed: %s", event["id"], e)
+            return event["id"], str(e) or type(e).__name__
+
+    async def _run(self):
+        last_purge = datetime.utcnow()
+        while True:
+            try:
+                attempted = await self.drain_once()
+                if datetime.utcnow() - last_purge > timedelta(hours=1):
+                    last_purge = datetime.utcnow()
+                    await asyncio.to_thread(purge_sent_outbox_events)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Outbox dispatcher round failed")
+                attempted = 0
+            if attempted < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), OUTBOX_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+
+outbox_dispatcher = OutboxDispatcher()
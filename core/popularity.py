@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import math
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import insert, select
+from db.models import Product, ProductStats
+from db.session import SessionLocal
+from db.upsert import upsert_increment
+
+logger = logging.getLogger(__name__)
+
+# Seconds between flushes of the buffered counters
+POPULARITY_FLUSH_SECONDS = 10
+# Buffered products that trigger an early flush
+POPULARITY_MAX_BUFFERED = 5_000
+# Half-life of the trending score
+TRENDING_HALF_LIFE_SECONDS = 7 * 24 * 3600
+# Fixed landmark of the forward-decay weights. With a 7-day half-life the
+# weights stay within float range for about 19 years after it.
+TRENDING_LANDMARK = datetime(2026, 1, 1)
+# Trending weight of one view and of one unit sold
+TRENDING_VIEW_WEIGHT = 0.1
+TRENDING_SALE_WEIGHT = 1.0
+
+_DECAY_RATE = math.log(2) / TRENDING_HALF_LIFE_SECONDS
+
+
+# ---------------------------
+# Popularity Functions
+# ---------------------------
+
+
+# TRENDING WEIGHT
+# - Returns the forward-decay weight of an event at `moment`.
+# - Details:
+#   - Weights grow as exp(lambda * (t - landmark)); dividing a stored score by
+#     `trending_weight(now)` gives the conventional decayed value, where an event
+#     from one half-life ago counts half as much as one from now.
+def trending_weight(moment: datetime) -> float:
+    return math.exp(_DECAY_RATE * (moment - TRENDING_LANDMARK).total_seconds())
+
+
+# ENSURE PRODUCT STATS
+# - Creates the missing `product_stats` rows, so listings can join on them.
+# - Parameters:
+#   - `db`: Database session.
+# - Returns:
+#   - (int): The number of rows created.
+def ensure_product_stats(db) -> int:
+    missing = select(Product.id).where(
+        ~select(ProductStats.product_id)
+        .where(ProductStats.product_id == Product.id)
+        .exists()
+    )
+    result = db.execute(insert(ProductStats).from_select(["product_id"], missing))
+    db.commit()
+    return result.rowcount
+
+
+# ---------------------------
+# Write-behind Counters
+# ---------------------------
+
+
+# POPULARITY COUNTERS
+# - Buffers product views and sales in memory and flushes them in batches.
+# - Details:
+#   - Recording an event only updates a dictionary under a lock; no database
+#     write happens on the request path.
+#   - A background task flushes every few seconds with one multi-row
+#     `INSERT ... ON CONFLICT DO UPDATE` that adds to the stored counters, so
+#     every worker can flush independently without lost updates.
+#   - Counters that fail to flush are merged back and retried. Events still
+#     buffered when a worker dies are lost, which is acceptable for rankings.
+class PopularityCounters:
+    def __init__(self, flush_seconds: float = POPULARITY_FLUSH_SECONDS):
+        self.flush_seconds = flush_seconds
+        self._pending: Dict[int, List[float]] = defaultdict(lambda: [0, 0, 0.0])
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    # RECORD VIEW
+    # - Counts one view of a product.
+    def record_view(self, product_id: int):
+        self._record(product_id, 1, 0, TRENDING_VIEW_WEIGHT)
+
+    # RECORD SALE
+    # - Counts units of a product sold.
+    def record_sale(self, product_id: int, units: int = 1):
+        self._record(product_id, 0, units, TRENDING_SALE_WEIGHT * units)
+
+    def _record(self, product_id: int, views: int, units: int, weight: float):
+        score = weight * trending_weight(datetime.utcnow())
+        with self._lock:
+            counters = self._pending[product_id]
+            counters[0] += views
+            counters[1] += units
+            counters[2] += score
+            full = len(self._pending) >= POPULARITY_MAX_BUFFERED
+        if full and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    # FLUSH
+    # - Writes the buffered counters to `product_stats`; blocking.
+    # - Returns:
+    #   - (int): The number of products flushed.
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: [0, 0, 0.0])
+        if not pending:
+            return 0
+        db = SessionLocal()
+        try:
+            # Deleted products would violate the foreign key; drop their counters
+            existing = set(
+                db.execute(select(Product.id).where(Product.id.in_(list(pending))))
+                .scalars()
+                .all()
+            )
+            now = datetime.utcnow()
+            rows = [
+                {
+                    "product_id": product_id,
+                    "view_count": views,
+                    "units_sold": units,
+                    "trending_score": score,
+                    "updated_at": now,
+                }
+                for product_id, (views, units, score) in sorted(pending.items())
+                if product_id in existing
+            ]
+            upsert_increment(
+                db,
+                ProductStats,
+                rows,
+                ("product_id",),
+                ("view_count", "units_sold", "trending_score"),
+                set_columns=("updated_at",),
+            )
+            db.commit()
+            return len(rows)
+        except Exception:
+            db.rollback()
+            with self._lock:
+                for product_id, (views, units, score) in pending.items():
+                    counters = self._pending[product_id]
+                    counters[0] += views
+                    counters[1] += units
+                    counters[2] += score
+            raise
+        finally:
+            db.close()
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    # STOP
+    # - Cancels the flush task and writes out whatever is still buffered.
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._loop = None
+        try:
+            await asyncio.to_thread(self.flush)
+        except Exception:
+            logger.exception("Final popularity flush failed")
+
+    async def _run(self):
+        try:
+            await asyncio.to_thread(_ensure_product_stats)
+        except Exception:
+            logger.exception("Product stats backfill failed")
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await asyncio.to_thread(self.flush)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Popularity flush failed")
+
+
+def _ensure_product_stats():
+    db = SessionLocal()
+    try:
+        ensure_product_stats(db)
+    finally:
+        db.close()
+
+
+popularity_counters = PopularityCounters()
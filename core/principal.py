@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+from core.events import event_bus
+from core.metrics import metrics
+from db.models import User
+
+# Channel carrying principal invalidations to every worker
+PRINCIPAL_CHANNEL = "principal_invalidated"
+# Principals kept per worker
+PRINCIPAL_CACHE_SIZE = 10_000
+# Seconds a cached principal is trusted; bounds staleness if an invalidation is lost
+PRINCIPAL_CACHE_TTL_SECONDS = 60
+
+principal_cache_lookups = metrics.counter(
+    "principal_cache_lookups_total", "Principal cache lookups by result."
+)
+
+
+# PRINCIPAL
+# - The immutable identity of an authenticated user, as used for authorization.
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    email: str
+    role: object
+    is_active: bool
+    has_2fa: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(
+            id=user.id,
+            email=user.email,
+            role=user.role,
+            is_active=bool(user.is_active),
+            has_2fa=bool(user.otp_secret),
+        )
+
+
+# ---------------------------
+# Principal Cache
+# ---------------------------
+
+
+# PRINCIPAL CACHE
+# - A bounded LRU cache of principals keyed by user id, with a TTL per entry.
+# - Details:
+#   - Invalidations are broadcast on the event bus so every worker drops its
+#     copy; the TTL bounds how long a missed invalidation can be served.
+class PrincipalCache:
+    def __init__(
+        self,
+        size: int = PRINCIPAL_CACHE_SIZE,
+        ttl_seconds: float = PRINCIPAL_CACHE_TTL_SECONDS,
+    ):
+        self.size = size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        event_bus.add_listener(PRINCIPAL_CHANNEL, self._on_invalidate)
+
+    # GET
+    # - Returns the cached principal of `user_id`, or None if missing or expired.
+    def get(self, user_id: int) -> Optional[Principal]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                principal_cache_lookups.inc(result="hit")
+                return entry[0]
+            if entry is not None:
+                del self._entries[user_id]
+        principal_cache_lookups.inc(result="miss")
+        return None
+
+    # PUT
+    # - Caches `principal`, evicting the least recently used entry when full.
+    def put(self, principal: Principal):
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            self._entries[principal.id] = (principal, expires_at)
+            self._entries.move_to_end(principal.id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    # DISCARD
+    # - Drops `user_id` from this worker's cache only.
+    def discard(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _on_invalidate(self, payload: dict):
+        self.discard(payload["user_id"])
+
+
+principal_cache = PrincipalCache()
+
+
+# INVALIDATE PRINCIPAL
+# - Drops the cached principal of a user in every worker.
+# - Parameters:
+#   - `user_id` (int): The user whose identity, role or 2FA state changed.
+# - Details:
+#   - Call this after the change has been committed. The local entry is dropped
+#     immediately, even when the event bus is down.
+def invalidate_principal(user_id: int):
+    principal_cache.discard(user_id)
+    event_bus.publish(PRINCIPAL_CHANNEL, {"user_id": user_id})
@@ -1,6 +1,6 @@
 from fastapi import Depends, HTTPException, status
-from db.models import User
-from core.security import get_current_user
+from core.principal import Principal
+from core.security import get_current_principal
 
 
 # ROLE-BASED ACCESS CONTROL DEPENDENCY
@@ -11,16 +11,16 @@ from core.security import get_current_user
 # - Nested Function: `role_checker`
 #   - Checks if the `current_user`'s role is in the `required_roles` list.
 #   - Parameters:
-#       - `current_user` (User): The currently authenticated user, retrieved using `get_current_user`.
+#       - `current_user` (Principal): The caller's cached principal, retrieved using `get_current_principal`.
 #   - Raises:
 #       - `HTTPException`: If the user's role is not in `required_roles`, a 403 Forbidden response is raised.
 #   - Returns:
-#       - The `current_user` object if the role validation succeeds.
+#       - The `current_user` principal if the role validation succeeds.
 # - Details:
 #   - This dependency function can be used in FastAPI routes to enforce role-based access control.
 #   - It is reusable and supports checking against multiple roles.
 def has_role(required_roles: list[str]):
-    def role_checker(current_user: User = Depends(get_current_user)):
+    def role_checker(current_user: Principal = Depends(get_current_principal)):
         if current_user.role not in required_roles:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
@@ -0,0 +1,336 @@
+import asyncio
+import heapq
+import logging
+import math
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import func, select, union_all
+from core.events import event_bus
+from db.models import Order, order_product_association, order_product_archive
+from db.session import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Channel carrying new line items to every worker
+ORDER_ITEMS_CHANNEL = "order_items"
+# Related products kept per product
+RELATED_TOP_K = 20
+# Baskets larger than this are ignored; they pair everything with everything
+RELATED_MAX_BASKET_SIZE = 50
+# Line items processed per vectorized pair-generation step
+RELATED_BUILD_CHUNK_SIZE = 200_000
+# Seconds between full rebuilds from `order_product`
+RELATED_REBUILD_SECONDS = 900
+
+# (related product id, cosine score, orders containing both)
+RelatedItem = Tuple[int, float, int]
+
+
+# ---------------------------
+# Co-occurrence Matrix
+# ---------------------------
+
+
+# BASKET PAIRS
+# - Generates every ordered (product, other product) pair within each basket.
+# - Parameters:
+#   - `orders (np.ndarray)`: Order id of each line item, sorted.
+#   - `items (np.ndarray)`: Dense product index of each line item.
+# - Returns:
+#   - `Tuple[np.ndarray, np.ndarray]`: Left and right product indexes.
+# - Details:
+#   - Each line item is repeated once per item in its basket and paired by
+#     offset, so the whole chunk is expanded with `np.repeat`/`arange` and no
+#     Python loop over orders.
+def _basket_pairs(orders: np.ndarray, items: np.ndarray):
+    starts = np.flatnonzero(np.r_[True, orders[1:] != orders[:-1]])
+    sizes = np.diff(np.r_[starts, len(orders)])
+    keep = np.repeat(sizes <= RELATED_MAX_BASKET_SIZE, sizes)
+    if not keep.all():
+        orders, items = orders[keep], items[keep]
+        if len(orders) == 0:
+            return items, items
+        starts = np.flatnonzero(np.r_[True, orders[1:] != orders[:-1]])
+        sizes = np.diff(np.r_[starts, len(orders)])
+    item_size = np.repeat(sizes, sizes)
+    item_start = np.repeat(starts, sizes)
+    left = np.repeat(np.arange(len(items)), item_size)
+    offsets = np.arange(len(left)) - np.repeat(
+        np.cumsum(item_size) - item_size, item_size
+    )
+    right = np.repeat(item_start, item_size) + offsets
+    distinct = left != right
+    return items[left[distinct]], items[right[distinct]]
+
+
+# CO-OCCURRENCE MATRIX
+# - A product-by-product matrix of "ordered together" counts in CSR form.
+# - Details:
+#   - `product_ids[i]` is the product of dense index i; row i's neighbours are
+#     `indices[indptr[i]:indptr[i + 1]]` with counts in `counts`.
+#   - `frequency[i]` is the number of orders containing product i; scores are
+#     the cosine similarity `count / sqrt(frequency[i] * frequency[j])`.
+class CooccurrenceMatrix:
+    def __init__(self, order_ids: np.ndarray, product_ids: np.ndarray):
+        self.product_ids, dense = np.unique(product_ids, return_inverse=True)
+        size = len(self.product_ids)
+        self.position = {int(p): i for i, p in enumerate(self.product_ids)}
+        self.frequency = np.bincount(dense, minlength=size)
+
+        sort = np.argsort(order_ids, kind="stable")
+        order_ids, dense = order_ids[sort], dense[sort]
+        keys, counts = [], []
+        start = 0
+        while start < len(order_ids):
+            # Extend the chunk to a basket boundary so no basket is split
+            end = min(start + RELATED_BUILD_CHUNK_SIZE, len(order_ids))
+            end = int(np.searchsorted(order_ids, order_ids[end - 1], side="right"))
+            left, right = _basket_pairs(order_ids[start:end], dense[start:end])
+            chunk_keys, chunk_counts = np.unique(
+                left * size + right, return_counts=True
+            )
+            keys.append(chunk_keys)
+            counts.append(chunk_counts)
+            start = end
+        if keys:
+            keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+            counts = np.bincount(inverse, weights=np.concatenate(counts)).astype(
+                np.int64
+            )
+        else:
+            keys, counts = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        rows = keys // max(size, 1)
+        self.indices = keys % max(size, 1)
+        self.counts = counts
+        self.indptr = np.searchsorted(rows, np.arange(size + 1))
+        self.scores = counts / np.sqrt(
+            self.frequency[rows].astype(np.float64) * self.frequency[self.indices]
+        )
+
+    # TOP K
+    # - Returns the top-k table for every product with at least one neighbour.
+    def top_k(self, k: int) -> Dict[int, Tuple[RelatedItem, ...]]:
+        rows = np.repeat(np.arange(len(self.product_ids)), np.diff(self.indptr))
+        order = np.lexsort((-self.counts, -self.scores, rows))
+        rank = np.arange(len(order)) - self.indptr[rows[order]]
+        selected = order[rank < k]
+        table = {}
+        bounds = np.searchsorted(rows[selected], np.arange(len(self.product_ids) + 1))
+        for i in np.flatnonzero(np.diff(bounds)):
+            chunk = selected[bounds[i] : bounds[i + 1]]
+            table[int(self.product_ids[i])] = tuple(
+                (int(self.product_ids[j]), round(float(s), 6), int(c))
+                for j, s, c in zip(
+                    self.indices[chunk], self.scores[chunk], self.counts[chunk]
+                )
+            )
+        return table
+
+    # ROW
+    # - Returns one product's neighbours as `{product_id: count}`.
+    def row(self, product_id: int) -> Dict[int, int]:
+        i = self.position.get(product_id)
+        if i is None:
+            return {}
+        span = slice(self.indptr[i], self.indptr[i + 1])
+        return dict(
+            zip(
+                self.product_ids[self.indices[span]].tolist(),
+                self.counts[span].tolist(),
+            )
+        )
+
+    def orders_containing(self, product_id: int) -> int:
+        i = self.position.get(product_id)
+        return 0 if i is None else int(self.frequency[i])
+
+
+# ---------------------------
+# Related Products Service
+# ---------------------------
+
+
+# RELATED PRODUCTS
+# - Serves "frequently bought together" lists from an in-memory top-k table.
+# - Details:
+#   - A full rebuild loads `order_product` (and its archive) into NumPy arrays
+#     and computes the co-occurrence matrix in a worker thread.
+#   - New line items arrive on the event bus from every worker. Their pair
+#     counts are kept in small dictionaries on top of the matrix and only the
+#     rows they touch are re-ranked, so reads stay a dictionary lookup.
+#   - Line items seen during a rebuild are replayed onto the new matrix when
+#     their order was created after the rebuild's snapshot.
+#   - Scores of untouched rows drift slightly as product frequencies change
+#     until the next periodic rebuild.
+class RelatedProducts:
+    def __init__(
+        self, k: int = RELATED_TOP_K, rebuild_seconds: float = RELATED_REBUILD_SECONDS
+    ):
+        self.k = k
+        self.rebuild_seconds = rebuild_seconds
+        self._matrix: Optional[CooccurrenceMatrix] = None
+        self._table: Dict[int, Tuple[RelatedItem, ...]] = {}
+        self._pair_deltas: Dict[int, Dict[int, int]] = defaultdict(
+            lambda: defaultdict(int)
+        )
+        self._frequency_deltas: Dict[int, int] = defaultdict(int)
+        self._replay_log: Optional[List[dict]] = None
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        event_bus.add_listener(ORDER_ITEMS_CHANNEL, self._on_items)
+
+    @property
+    def ready(self) -> bool:
+        return self._matrix is not None
+
+    # RELATED
+    # - Returns up to `limit` products most often bought with `product_id`.
+    def related(self, product_id: int, limit: int = 10) -> Tuple[RelatedItem, ...]:
+        return self._table.get(product_id, ())[:limit]
+
+    # REBUILD
+    # - Recomputes the matrix and top-k table from the database; blocking.
+    def rebuild(self):
+        with self._lock:
+            self._replay_log = []
+        try:
+            db = SessionLocal()
+            try:
+                max_order_id = db.execute(select(func.max(Order.id))).scalar() or 0
+                line_items = union_all(
+                    select(
+                        order_product_association.c.order_id,
+                        order_product_association.c.product_id,
+                    ).where(order_product_association.c.order_id <= max_order_id),
+                    select(
+                        order_product_archive.c.order_id,
+                        order_product_archive.c.product_id,
+                    ),
+                )
+                result = db.execute(
+                    line_items.execution_options(
+                        stream_results=True, yield_per=RELATED_BUILD_CHUNK_SIZE
+                    )
+                )
+                chunks = [
+                    np.array(partition, dtype=np.int64).reshape(-1, 2)
+                    for partition in result.partitions()
+                ]
+            finally:
+                db.close()
+            pairs = (
+                np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.int64)
+            )
+            matrix = CooccurrenceMatrix(pairs[:, 0], pairs[:, 1])
+            table = matrix.top_k(self.k)
+        except Exception:
+            with self._lock:
+                self._replay_log = None
+            raise
+        with self._lock:
+            self._matrix, self._table = matrix, table
+            self._pair_deltas.clear()
+            self._frequency_deltas.clear()
+            replay, self._replay_log = self._replay_log, None
+            for event in replay:
+                if event["order_id"] > max_order_id:
+                    self._apply(event["product_ids"], event["existing_ids"])
+        logger.info(
+            "Related products rebuilt: %d products, %d pairs",
+            len(matrix.product_ids),
+            len(matrix.counts),
+        )
+
+    def _on_items(self, payload: dict):
+        with self._lock:
+            if self._replay_log is not None:
+                self._replay_log.append(payload)
+            if self._matrix is not None:
+                self._apply(payload["product_ids"], payload["existing_ids"])
+
+    # Adds one order's new line items; caller holds the lock
+    def _apply(self, product_ids: Sequence[int], existing_ids: Sequence[int]):
+        if len(product_ids) + len(existing_ids) > RELATED_MAX_BASKET_SIZE:
+            return
+        for product_id in product_ids:
+            self._frequency_deltas[product_id] += 1
+        for i, a in enumerate(product_ids):
+            for b in list(product_ids[i + 1 :]) + list(existing_ids):
+                if a != b:
+                    self._pair_deltas[a][b] += 1
+                    self._pair_deltas[b][a] += 1
+        for product_id in set(product_ids) | set(existing_ids):
+            self._rerank(product_id)
+
+    def _frequency(self, product_id: int) -> int:
+        return self._matrix.orders_containing(product_id) + self._frequency_deltas.get(
+            product_id, 0
+        )
+
+    def _rerank(self, product_id: int):
+        counts = self._matrix.row(product_id)
+        for other, delta in self._pair_deltas.get(product_id, {}).items():
+            counts[other] = counts.get(other, 0) + delta
+        own = self._frequency(product_id)
+        scored = [
+            (other, count / math.sqrt(own * self._frequency(other)), count)
+            for other, count in counts.items()
+            if count > 0
+        ]
+        best = heapq.nlargest(
+            self.k, scored, key=lambda item: (item[1], item[2], -item[0])
+        )
+        # Replace the entry with a new tuple so readers never see a partial list
+        self._table[product_id] = tuple(
+            (other, round(score, 6), count) for other, score, count in best
+        )
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.rebuild)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Related products rebuild failed")
+            await asyncio.sleep(self.rebuild_seconds)
+
+
+related_products = RelatedProducts()
+
+
+# PUBLISH ORDER ITEMS
+# - Announces line items added to an order so every worker updates its table.
+# - Parameters:
+#   - `order_id` (int): The order the items were added to.
+#   - `product_ids` (Iterable[int]): The newly added products.
+#   - `existing_ids` (Iterable[int]): Products already in the order.
+# - Details:
+#   - Call this after the change has been committed.
+def publish_order_items(
+    order_id: int, product_ids: Iterable[int], existing_ids: Iterable[int] = ()
+):
+    event_bus.publish(
+        ORDER_ITEMS_CHANNEL,
+        {
+            "order_id": order_id,
+            "product_ids": list(product_ids),
+            "existing_ids": list(existing_ids),
+        },
+    )
@@ -0,0 +1,270 @@
+import asyncio
+import hashlib
+import logging
+import math
+import threading
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+from fastapi import HTTPException, status
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from core.events import event_bus
+from core.metrics import metrics
+from core.security import (
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    REFRESH_TOKEN_EXPIRE_DAYS,
+    create_access_token,
+    create_refresh_token,
+    verify_refresh_token,
+)
+from db.models import RevokedToken
+from db.session import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Channel carrying revoked token ids to every worker
+REVOCATION_CHANNEL = "token_revoked"
+# Minimum number of revocations the filter is sized for
+REVOCATION_FILTER_CAPACITY = 100_000
+# Target false-positive rate of the filter
+REVOCATION_FILTER_ERROR_RATE = 0.001
+# Seconds between filter rebuilds, which also purge expired revocations
+REVOCATION_REBUILD_SECONDS = 3600
+
+revocation_checks = metrics.counter(
+    "refresh_token_revocation_checks_total",
+    "Refresh token revocation checks, by how they were answered.",
+)
+
+
+# ---------------------------
+# Bloom Filter
+# ---------------------------
+
+
+# BLOOM FILTER
+# - A fixed-size set membership filter with no false negatives.
+# - Details:
+#   - Sized for `capacity` keys at `error_rate` false positives; about 1.8 MB
+#     for a million keys at 0.1%.
+#   - The k bit positions come from one BLAKE2b digest by double hashing.
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = REVOCATION_FILTER_ERROR_RATE):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+
+# ---------------------------
+# Revocation List
+# ---------------------------
+
+
+# REVOCATION LIST
+# - Answers "is this refresh token revoked?" mostly from memory.
+# - Details:
+#   - The filter holds the id of every unexpired revocation. A key that is not
+#     in the filter is certainly not revoked; a hit is confirmed against
+#     `revoked_tokens`, so false positives cost one primary-key lookup.
+#   - Revocations are broadcast on the event bus and added to every worker's
+#     filter. Events received while the filter is being rebuilt are replayed
+#     onto the new filter.
+#   - Until the first build completes, every check goes to the database.
+class RevocationList:
+    def __init__(self, rebuild_seconds: float = REVOCATION_REBUILD_SECONDS):
+        self.rebuild_seconds = rebuild_seconds
+        self._filter: Optional[BloomFilter] = None
+        self._replay_log: Optional[List[str]] = None
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        event_bus.add_listener(REVOCATION_CHANNEL, self._on_revoked)
+
+    # IS REVOKED
+    # - Returns whether any of `keys` (a token id and its family id) is revoked.
+    # - Parameters:
+    #   - `db`: Database session, used only to confirm possible matches.
+    #   - `keys` (Iterable[str]): Revocation ids to check.
+    def is_revoked(self, db, keys: Iterable[str]) -> bool:
+        keys = list(keys)
+        bloom = self._filter
+        if bloom is not None and not any(key in bloom for key in keys):
+            revocation_checks.inc(result="filter")
+            return False
+        revoked = (
+            db.execute(
+                select(RevokedToken.jti).where(
+                    RevokedToken.jti.in_(keys),
+                    RevokedToken.expires_at > datetime.utcnow(),
+                )
+            ).first()
+            is not None
+        )
+        revocation_checks.inc(result="revoked" if revoked else "database")
+        return revoked
+
+    # REVOKE
+    # - Persists a revocation and announces it to every worker.
+    # - Parameters:
+    #   - `db`: Database session; the revocation is committed.
+    #   - `key` (str): The token id, or the family id when `kind` is "family".
+    #   - `expires_at` (datetime): When the last token covered expires.
+    # - Returns:
+    #   - (bool): False if `key` was already revoked.
+    def revoke(
+        self,
+        db,
+        key: str,
+        expires_at: datetime,
+        user_id: Optional[int] = None,
+        kind: str = "token",
+    ) -> bool:
+        db.add(RevokedToken(jti=key, kind=kind, user_id=user_id, expires_at=expires_at))
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return False
+        self._add(key)
+        event_bus.publish(REVOCATION_CHANNEL, {"key": key})
+        return True
+
+    def _on_revoked(self, payload: dict):
+        self._add(payload["key"])
+
+    def _add(self, key: str):
+        with self._lock:
+            if self._replay_log is not None:
+                self._replay_log.append(key)
+            if self._filter is not None:
+                self._filter.add(key)
+
+    # REBUILD
+    # - Purges expired revocations and rebuilds the filter; blocking.
+    def rebuild(self):
+        with self._lock:
+            self._replay_log = []
+        try:
+            db = SessionLocal()
+            try:
+                now = datetime.utcnow()
+                db.execute(delete(RevokedToken).where(RevokedToken.expires_at <= now))
+                db.commit()
+                keys = (
+                    db.execute(
+                        select(RevokedToken.jti).where(RevokedToken.expires_at > now)
+                    )
+                    .scalars()
+                    .all()
+                )
+            finally:
+                db.close()
+            bloom = BloomFilter(max(REVOCATION_FILTER_CAPACITY, 2 * len(keys)))
+            for key in keys:
+                bloom.add(key)
+        except Exception:
+            with self._lock:
+                self._replay_log = None
+            raise
+        with self._lock:
+            for key in self._replay_log:
+                bloom.add(key)
+            self._filter, self._replay_log = bloom, None
+        logger.info("Revocation filter rebuilt: %d revoked tokens", len(keys))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.rebuild)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Revocation filter rebuild failed")
+            await asyncio.sleep(self.rebuild_seconds)
+
+
+revocation_list = RevocationList()
+
+
+# ---------------------------
+# Refresh Token Rotation
+# ---------------------------
+
+
+def _invalid_refresh_token():
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token"
+    )
+
+
+# ROTATE REFRESH TOKEN
+# - Exchanges a refresh token for a new access token and refresh token.
+# - Parameters:
+#   - `db`: Database session.
+#   - `refresh_token` (str): The refresh token presented by the client.
+# - Returns:
+#   - (dict): `access_token`, `refresh_token` and `token_type`.
+# - Raises:
+#   - `HTTPException`: 401 if the token is invalid, expired, revoked or reused.
+# - Details:
+#   - Every refresh token can be used once: its `jti` is revoked before the new
+#     pair is issued, and the new refresh token stays in the same family.
+#   - Presenting an already used token means it was copied, so the whole family
+#     is revoked and both the thief and the owner must log in again.
+#   - Tokens issued before rotation existed carry no `jti` and are rejected.
+def rotate_refresh_token(db, refresh_token: str) -> dict:
+    payload = verify_refresh_token(refresh_token)
+    jti, family = payload.get("jti"), payload.get("fam")
+    user_id, email = payload.get("user_id"), payload.get("email")
+    if not jti or not family or user_id is None or email is None:
+        raise _invalid_refresh_token()
+    expires_at = datetime.utcfromtimestamp(payload["exp"])
+    family_expires_at = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+
+    if revocation_list.is_revoked(db, (jti, family)) or not revocation_list.revoke(
+        db, jti, expires_at, user_id=user_id
+    ):
+        revocation_list.revoke(
+            db, family, family_expires_at, user_id=user_id, kind="family"
+        )
+        raise _invalid_refresh_token()
+
+    access_token = create_access_token(
+        user_id=user_id,
+        email=email,
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+    )
+    return {
+        "access_token": access_token,
+        "refresh_token": create_refresh_token(user_id, email, family=family),
+        "token_type": "bearer",
+    }
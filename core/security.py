@@ -1,8 +1,8 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
+import time
 from typing import Optional
 from db.session import db_dependency
 
@@ -10,6 +10,10 @@ from db.session import db_dependency
 from schema.user import UserRole
 from schema.token import Token, TokenData
 from db.models import User
+from core.metrics import metrics
+from core.principal import Principal, principal_cache
+from core.hashing import password_hasher, pwd_context
+from core.ids import new_id
 from dotenv import dotenv_values
 from dotenv import load_dotenv
 
@@ -23,12 +27,15 @@ REFRESH_TOKEN_EXPIRE_DAYS = 7
 load_dotenv()
 config_credential = dotenv_values(".env")
 
-# Password hashing utility
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # OAuth2 Password Bearer scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 
+# Time spent resolving the caller of an authenticated request
+auth_resolve_seconds = metrics.histogram(
+    "auth_resolve_seconds",
+    "Time spent decoding the token and resolving the caller, by resolver and source.",
+)
+
 
 # ---------------------------
 # Utility Functions
@@ -41,6 +48,8 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 #   - `password` (str): The plain text password to hash.
 # - Returns:
 #   - (str): The hashed password.
+# - Details:
+#   - Blocking; async code should use `password_hasher.hash` instead.
 def generate_hashed_password(password):
     return pwd_context.hash(password)
 
@@ -52,6 +61,8 @@ def generate_hashed_password(password):
 #   - `hashed_password` (str): The hashed password for comparison.
 # - Returns:
 #   - (bool): True if the passwords match; False otherwise.
+# - Details:
+#   - Blocking; async code should use `password_hasher.verify` instead.
 def verify_password(password, hashed_password):
     return pwd_context.verify(password, hashed_password)
 
@@ -125,10 +136,21 @@ def verify_access_token(token: str):
 # - Parameters:
 #   - `user_id` (int): The user's ID.
 #   - `email` (str): The user's email.
+#   - `family` (Optional[str]): The rotation family of the token being replaced;
+#     a new login starts a new family.
 # - Returns:
 #   - (str): A JWT refresh token.
-def create_refresh_token(user_id: int, email: str):
-    to_encode = {"user_id": user_id, "email": email, "type": "refresh"}
+# - Details:
+#   - Every token gets a unique `jti` so it can be revoked on its own; `fam`
+#     lets all tokens rotated from one login be revoked together.
+def create_refresh_token(user_id: int, email: str, family: Optional[str] = None):
+    to_encode = {
+        "user_id": user_id,
+        "email": email,
+        "type": "refresh",
+        "jti": new_id(),
+        "fam": family or new_id(),
+    }
     expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
     to_encode.update({"exp": expire})
     refresh_token = jwt.encode(
@@ -187,38 +209,97 @@ def get_user(db: db_dependency, identifier: str):
 #   - `password` (str): The user's password.
 # - Returns:
 #   - (User | bool): The authenticated user object if successful; False otherwise.
-def authenticate_user(db: db_dependency, identifier: str, password: str):
+# - Raises:
+#   - `HTTPException`: 503 if the password hashing queue is full.
+async def authenticate_user(db: db_dependency, identifier: str, password: str):
     user = get_user(db, identifier)
-    if not user or not verify_password(password, user.hashed_password):
+    if not user or not await password_hasher.verify(password, user.hashed_password):
         return False
     return user
 
 
-# DEPENDENCY TO GET CURRENT USER
-# - Retrieves the currently authenticated user based on the token.
-# - Parameters:
-#   - `db` (db_dependency): The database session.
-#   - `token` (str): The OAuth2 bearer token.
-# - Returns:
-#   - (User): The currently authenticated user.
-# - Raises:
-#   - `HTTPException`: If the token is invalid or the user does not exist.
-async def get_current_user(db: db_dependency, token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+# DECODE ACCESS TOKEN
+# - Extracts the caller's identity from an access token.
+# - Parameters:
+#   - `token` (str): The OAuth2 bearer token.
+# - Returns:
+#   - (TokenData): The user id and email carried by the token.
+# - Raises:
+#   - `HTTPException`: If the token is invalid, expired or incomplete.
+def decode_access_token(token: str) -> TokenData:
     try:
         payload = jwt.decode(token, config_credential["SECRET"], algorithms=[ALGORITHM])
         email: str = payload.get("email")
         user_id: int = payload.get("user_id")
         if email is None or user_id is None:
-            raise credentials_exception
-        token_data = TokenData(email=email, user_id=user_id)
+            raise _credentials_exception()
+        return TokenData(email=email, user_id=user_id)
     except JWTError as exc:
-        raise credentials_exception from exc
-    user = get_user(db, identifier=token_data.email)
-    if user is None:
-        raise credentials_exception
+        raise _credentials_exception() from exc
+
+
+# Loads the token's user by primary key and refreshes its cached principal
+def _load_user(db, token_data: TokenData) -> User:
+    user = db.get(User, token_data.user_id)
+    # A token issued before an email change no longer identifies the user
+    if user is None or user.email != token_data.email:
+        raise _credentials_exception()
+    principal_cache.put(Principal.from_user(user))
     return user
+
+
+# DEPENDENCY TO GET CURRENT USER
+# - Retrieves the currently authenticated user based on the token.
+# - Parameters:
+#   - `db` (db_dependency): The database session.
+#   - `token` (str): The OAuth2 bearer token.
+# - Returns:
+#   - (User): The currently authenticated user.
+# - Raises:
+#   - `HTTPException`: If the token is invalid or the user does not exist.
+# - Details:
+#   - Use this for routes that read or modify the user's record; routes that
+#     only need the caller's identity or role should use `get_current_principal`.
+async def get_current_user(db: db_dependency, token: str = Depends(oauth2_scheme)):
+    with auth_resolve_seconds.time(resolver="user", source="database"):
+        return _load_user(db, decode_access_token(token))
+
+
+# DEPENDENCY TO GET CURRENT PRINCIPAL
+# - Retrieves the identity and role of the caller based on the token.
+# - Parameters:
+#   - `db` (db_dependency): The database session, used on a cache miss only.
+#   - `token` (str): The OAuth2 bearer token.
+# - Returns:
+#   - (Principal): The caller's immutable principal.
+# - Raises:
+#   - `HTTPException`: If the token is invalid or the user does not exist.
+# - Details:
+#   - Principals are cached per worker by user id, so most requests need no
+#     database query. The cache is invalidated when the user changes.
+async def get_current_principal(
+    db: db_dependency, token: str = Depends(oauth2_scheme)
+) -> Principal:
+    started = time.perf_counter()
+    token_data = decode_access_token(token)
+    principal = principal_cache.get(token_data.user_id)
+    if principal is not None:
+        if principal.email != token_data.email:
+            raise _credentials_exception()
+        auth_resolve_seconds.observe(
+            time.perf_counter() - started, resolver="principal", source="cache"
+        )
+        return principal
+    principal = Principal.from_user(_load_user(db, token_data))
+    auth_resolve_seconds.observe(
+        time.perf_counter() - started, resolver="principal", source="database"
+    )
+    return principal
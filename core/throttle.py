@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from fastapi import HTTPException, Request, status
+from sqlalchemy import delete, select
+from core.metrics import metrics
+from db.models import ThrottleCounter
+from db.session import SessionLocal
+from db.upsert import upsert_increment
+
+logger = logging.getLogger(__name__)
+
+# "memory" keeps counters per worker; "database" shares them between workers
+THROTTLE_BACKEND = os.getenv("THROTTLE_BACKEND", "memory")
+# Throttle keys kept per worker by the memory backend
+THROTTLE_MAX_KEYS = 100_000
+# Use the first X-Forwarded-For address as the client IP (behind a trusted proxy)
+THROTTLE_TRUST_FORWARDED = os.getenv("THROTTLE_TRUST_FORWARDED", "") == "1"
+# Minimum interval between sweeps of old database counters
+THROTTLE_PURGE_SECONDS = 60
+
+throttle_rejections = metrics.counter(
+    "throttle_rejections_total", "Requests rejected by throttling, by policy and scope."
+)
+
+
+# ---------------------------
+# Sliding Window
+# ---------------------------
+
+
+# SLIDING WINDOW ESTIMATE
+# - Estimates the attempts in the last `window` seconds from two fixed windows.
+# - Parameters:
+#   - `previous`, `current` (int): Attempts in the previous and current window.
+#   - `elapsed` (float): Fraction of the current window that has passed.
+# - Details:
+#   - The previous window is weighted by the part of it still inside the
+#     sliding window, which assumes its attempts were evenly spread.
+def _estimate(previous: int, current: int, elapsed: float) -> float:
+    return previous * (1 - elapsed) + current
+
+
+# Seconds until the estimate drops to `limit`, assuming no further attempts
+def _retry_after(
+    previous: int, current: int, elapsed: float, limit: int, window: int
+) -> int:
+    if current <= limit and previous:
+        # Wait for enough of the previous window to slide out
+        wait = 1 - (limit - current) / previous - elapsed
+    else:
+        # Wait for the current window to become the previous one and fade
+        wait = 1 - elapsed + (1 - limit / current)
+    return max(1, math.ceil(wait * window))
+
+
+# ---------------------------
+# Throttle Backends
+# ---------------------------
+
+
+# MEMORY THROTTLE BACKEND
+# - Keeps sliding-window counters in a bounded LRU per worker.
+# - Details:
+#   - With N workers a client can make up to N times the limit; use the
+#     database backend when that matters.
+class MemoryThrottleBackend:
+    def __init__(self, max_keys: int = THROTTLE_MAX_KEYS):
+        self.max_keys = max_keys
+        self._entries: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # HIT
+    # - Counts one attempt for `key`.
+    # - Returns:
+    #   - `Tuple[int, int]`: Attempts in the previous and current window.
+    def hit(self, key: str, window_start: int, window: int) -> Tuple[int, int]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = [window_start, 0, 0]
+                if len(self._entries) > self.max_keys:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(key)
+            if entry[0] != window_start:
+                # Slide: the current window becomes the previous one if adjacent
+                entry[2] = entry[1] if window_start - entry[0] == window else 0
+                entry[0], entry[1] = window_start, 0
+            entry[1] += 1
+            return entry[2], entry[1]
+
+
+# DATABASE THROTTLE BACKEND
+# - Keeps fixed-window counters in `throttle_counters`, shared by all workers.
+# - Details:
+#   - Each attempt is one `INSERT ... ON CONFLICT DO UPDATE` and one primary
+#     key read of the current and previous windows.
+#   - Windows older than a day are purged at most once a minute.
+class DatabaseThrottleBackend:
+    def __init__(self):
+        self._last_purge = 0.0
+
+    def hit(self, key: str, window_start: int, window: int) -> Tuple[int, int]:
+        db = SessionLocal()
+        try:
+            upsert_increment(
+                db,
+                ThrottleCounter,
+                [{"key": key, "window_start": window_start, "count": 1}],
+                ("key", "window_start"),
+                ("count",),
+            )
+            counts = dict(
+                db.execute(
+                    select(ThrottleCounter.window_start, ThrottleCounter.count).where(
+                        ThrottleCounter.key == key,
+                        ThrottleCounter.window_start.in_(
+                            (window_start - window, window_start)
+                        ),
+                    )
+                ).all()
+            )
+            self._maybe_purge(db)
+            db.commit()
+            return counts.get(window_start - window, 0), counts.get(window_start, 0)
+        finally:
+            db.close()
+
+    def _maybe_purge(self, db):
+        now = time.monotonic()
+        if now - self._last_purge >= THROTTLE_PURGE_SECONDS:
+            self._last_purge = now
+            db.execute(
+                delete(ThrottleCounter).where(
+                    ThrottleCounter.window_start < int(time.time()) - 86400
+                )
+            )
+
+
+def _make_backend():
+    if THROTTLE_BACKEND == "database":
+        return DatabaseThrottleBackend()
+    return MemoryThrottleBackend()
+
+
+throttle_backend = _make_backend()
+
+
+# ---------------------------
+# Throttle Policies
+# ---------------------------
+
+
+# CLIENT IP
+# - Returns the address used as the per-IP throttle key.
+def client_ip(request: Request) -> str:
+    if THROTTLE_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+# THROTTLE POLICY
+# - Limits attempts per client IP and per account with sliding windows.
+# - Parameters:
+#   - `name` (str): Policy name, used in keys and metrics.
+#   - `per_ip` (Tuple[int, int]): Attempts allowed per IP and window in seconds.
+#   - `per_account` (Tuple[int, int]): Attempts allowed per account and window.
+# - Details:
+#   - Every attempt counts, including rejected ones, so a client that keeps
+#     retrying stays blocked until it backs off.
+#   - If the backend fails the request is let through; throttling must not
+#     take logins down with it.
+class ThrottlePolicy:
+    def __init__(
+        self,
+        name: str,
+        per_ip: Tuple[int, int],
+        per_account: Tuple[int, int],
+        backend=None,
+    ):
+        self.name = name
+        self.per_ip = per_ip
+        self.per_account = per_account
+        self.backend = backend or throttle_backend
+
+    # CHECK
+    # - Counts one attempt and rejects it if a limit is exceeded.
+    # - Parameters:
+    #   - `request` (Request): The incoming request.
+    #   - `account` (Optional[str]): The email or username being targeted.
+    # - Raises:
+    #   - `HTTPException`: 429 with `Retry-After` when over a limit.
+    # - Details:
+    #   - Call this before any password hashing or mail is sent.
+    async def check(self, request: Request, account: Optional[str] = None):
+        scopes = [("ip", client_ip(request), self.per_ip)]
+        if account:
+            scopes.append(("account", account.strip().lower(), self.per_account))
+        for scope, value, (limit, window) in scopes:
+            retry_after = await self._hit(f"{self.name}:{scope}:{value}", limit, window)
+            if retry_after:
+                throttle_rejections.inc(policy=self.name, scope=scope)
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many attempts. Please try again later.",
+                    headers={"Retry-After": str(retry_after)},
+                )
+
+    # Returns the seconds to wait if the attempt is over the limit, else 0
+    async def _hit(self, key: str, limit: int, window: int) -> int:
+        now = time.time()
+        window_start = int(now // window * window)
+        try:
+            if isinstance(self.backend, MemoryThrottleBackend):
+                previous, current = self.backend.hit(key, window_start, window)
+            else:
+                previous, current = await asyncio.to_thread(
+                    self.backend.hit, key, window_start, window
+                )
+        except Exception:
+            logger.exception("Throttle backend failed, allowing request")
+            return 0
+        elapsed = (now - window_start) / window
+        if _estimate(previous, current, elapsed) <= limit:
+            return 0
+        return _retry_after(previous, current, elapsed, limit, window)
+
+
+# Password logins: each attempt costs a bcrypt verification
+login_throttle = ThrottlePolicy("login", per_ip=(30, 60), per_account=(10, 300))
+# One-time codes by email: each request costs an SMTP send
+otp_throttle = ThrottlePolicy("otp", per_ip=(10, 600), per_account=(3, 600))
@@ -0,0 +1,191 @@
+import json
+from typing import Dict, Iterator, List, Optional, Tuple
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import Integer, or_, select, text
+from sqlalchemy.orm import Session
+from db.models import Product, Order, User, USER_SEARCH_COLUMNS
+from db.session import SessionLocal
+
+# Rows fetched per round trip when streaming
+STREAM_CHUNK_SIZE = 1000
+# Shortest term the trigram indexes can serve; shorter terms scan `users`
+MIN_INDEXED_SEARCH_LENGTH = 3
+
+# Columns each admin listing may return, in default output order. Secrets such
+# as password hashes and TOTP secrets are deliberately not listed.
+ADMIN_LIST_COLUMNS = {
+    "products": (
+        Product,
+        ("id", "name", "price", "description", "stock", "image_url"),
+    ),
+    "orders": (
+        Order,
+        ("id", "user_id", "reference", "total_price", "status", "created_at", "updated_at"),
+    ),
+    "users": (
+        User,
+        (
+            "id",
+            "username",
+            "full_name",
+            "email",
+            "phone_number",
+            "role",
+            "is_active",
+            "created_at",
+        ),
+    ),
+}
+
+
+# ---------------------------
+# Admin Listing Functions
+# ---------------------------
+
+
+# RESOLVE FIELDS
+# - Validates a comma-separated field projection for an admin listing.
+# - Parameters:
+#   - `resource (str)`: One of "products", "orders" or "users".
+#   - `fields (str)`: Comma-separated column names, or None for all listed columns.
+# - Returns:
+#   - `Tuple[model, List[str]]`: The model and the selected column names, always including `id`.
+# - Raises:
+#   - `ValueError`: If a field is unknown or not exposed.
+def resolve_fields(resource: str, fields: Optional[str] = None) -> Tuple[type, List[str]]:
+    model, allowed = ADMIN_LIST_COLUMNS[resource]
+    if not fields:
+        return model, list(allowed)
+    selected = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in selected if name not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    if "id" not in selected:
+        selected.insert(0, "id")
+    return model, list(dict.fromkeys(selected))
+
+
+def _query(model, columns: List[str], after_id: Optional[int]):
+    statement = select(*(getattr(model, name) for name in columns)).order_by(model.id)
+    if after_id is not None:
+        statement = statement.where(model.id > after_id)
+    return statement
+
+
+# LIST PAGE
+# - Retrieves one keyset-paginated page of an admin listing.
+# - Parameters:
+#   - `db (Session)`: Database session.
+#   - `model`: The model to list.
+#   - `columns (List[str])`: Column names to return (no relationships are loaded).
+#   - `limit (int)`: Maximum number of rows.
+#   - `after_id (int)`: Return rows with an id greater than this, if given.
+# - Returns:
+#   - `Tuple[List[dict], Optional[int]]`: The rows and the `after_id` of the next page.
+def list_page(
+    db: Session, model, columns: List[str], limit: int, after_id: Optional[int] = None
+) -> Tuple[List[Dict], Optional[int]]:
+    rows = db.execute(_query(model, columns, after_id).limit(limit + 1)).mappings().all()
+    next_after_id = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_after_id = rows[-1]["id"]
+    return [dict(row) for row in rows], next_after_id
+
+
+# STREAM ROWS
+# - Yields an admin listing as NDJSON lines or as one incrementally written JSON array.
+# - Parameters:
+#   - `model`: The model to list.
+#   - `columns (List[str])`: Column names to return.
+#   - `fmt (str)`: "ndjson" or "json".
+#   - `after_id (int)`: Start after this id, if given.
+# - Returns:
+#   - `Iterator[str]`: Output chunks.
+# - Details:
+#   - Uses its own session because the request's session is closed before a
+#     streaming response body is sent.
+#   - Rows are fetched with a server-side cursor (`stream_results`/`yield_per`),
+#     so memory stays constant regardless of table size.
+def stream_rows(
+    model, columns: List[str], fmt: str = "ndjson", after_id: Optional[int] = None
+) -> Iterator[str]:
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            _query(model, columns, after_id).execution_options(
+                stream_results=True, yield_per=STREAM_CHUNK_SIZE
+            )
+        ).mappings()
+        if fmt == "json":
+            yield "["
+        first = True
+        for partition in result.partitions():
+            lines = [json.dumps(jsonable_encoder(dict(row))) for row in partition]
+            if fmt == "json":
+                yield ("" if first else ",") + ",".join(lines)
+            else:
+                yield "\n".join(lines) + "\n"
+            first = False
+        if fmt == "json":
+            yield "]"
+    finally:
+        db.close()
+
+
+def _like_pattern(term: str, mode: str) -> str:
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{escaped}%" if mode == "prefix" else f"%{escaped}%"
+
+
+# SEARCH USERS
+# - Finds users whose email, username, full name or phone number matches a term.
+# - Parameters:
+#   - `db (Session)`: Database session.
+#   - `term (str)`: The text to look for (case-insensitive).
+#   - `mode (str)`: "prefix" (a column starts with the term) or "substring".
+#   - `limit (int)`: Maximum number of rows.
+#   - `after_id (int)`: Return users with an id greater than this, if given.
+# - Returns:
+#   - `Tuple[List[dict], Optional[int]]`: The matching users (admin listing
+#     columns) in id order and the `after_id` of the next page.
+# - Details:
+#   - PostgreSQL answers the `ILIKE` predicates from the pg_trgm GIN indexes.
+#   - SQLite first narrows candidates through the `users_search` FTS5 trigram
+#     table, then applies the same `LIKE` predicates to rows it found. Terms
+#     shorter than three characters cannot use a trigram index on either
+#     database and fall back to scanning in id order.
+def search_users(
+    db: Session,
+    term: str,
+    mode: str = "substring",
+    limit: int = 50,
+    after_id: Optional[int] = None,
+) -> Tuple[List[Dict], Optional[int]]:
+    pattern = _like_pattern(term, mode)
+    _, columns = ADMIN_LIST_COLUMNS["users"]
+    statement = select(*(getattr(User, name) for name in columns)).where(
+        or_(
+            *(
+                getattr(User, name).ilike(pattern, escape="\\")
+                for name in USER_SEARCH_COLUMNS
+            )
+        )
+    )
+    if db.bind.dialect.name == "sqlite" and len(term) >= MIN_INDEXED_SEARCH_LENGTH:
+        phrase = '"' + term.replace('"', '""') + '"'
+        statement = statement.where(
+            User.id.in_(
+                text("SELECT rowid FROM users_search WHERE users_search MATCH :phrase")
+                .bindparams(phrase=phrase)
+                .columns(rowid=Integer)
+            )
+        )
+    if after_id is not None:
+        statement = statement.where(User.id > after_id)
+    rows = db.execute(statement.order_by(User.id).limit(limit + 1)).mappings().all()
+    next_after_id = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_after_id = rows[-1]["id"]
+    return [dict(row) for row in rows], next_after_id
@@ -0,0 +1,187 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import select, insert, delete, literal, text
+from db.models import (
+    Order,
+    OrderStatus,
+    Payment,
+    ArchivedOrder,
+    ArchivedPayment,
+    order_product_association,
+    order_product_archive,
+)
+from datetime import datetime
+from typing import Iterable, Set, Tuple
+
+# Orders in these statuses no longer change and may be archived
+CLOSED_ORDER_STATUSES = (OrderStatus.DELIVERED, OrderStatus.CANCELED)
+
+# Archive tables that are range-partitioned by month on PostgreSQL
+ARCHIVE_PARTITIONED_TABLES = (
+    "orders_archive",
+    "order_product_archive",
+    "payments_archive",
+)
+
+
+# ---------------------------
+# Archive Helpers
+# ---------------------------
+
+
+# SUBTRACT MONTHS
+# - Returns the first instant of the month `months` before `moment`'s month.
+def _months_ago(moment: datetime, months: int) -> datetime:
+    index = moment.year * 12 + (moment.month - 1) - months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _next_month(year: int, month: int) -> Tuple[int, int]:
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+# ENSURE ARCHIVE PARTITIONS
+# - Creates the monthly partitions of the archive tables on PostgreSQL.
+# - Parameters:
+#   - `db (Session)`: Database session.
+#   - `months (Iterable[Tuple[int, int]])`: `(year, month)` pairs that need a partition.
+# - Details:
+#   - A no-op on databases without declarative partitioning.
+def ensure_archive_partitions(db: Session, months: Iterable[Tuple[int, int]]):
+    if db.bind.dialect.name != "postgresql":
+        return
+    for year, month in sorted(set(months)):
+        next_year, next_month = _next_month(year, month)
+        start = f"{year:04d}-{month:02d}-01"
+        end = f"{next_year:04d}-{next_month:02d}-01"
+        for table in ARCHIVE_PARTITIONED_TABLES:
+            db.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {table}_y{year:04d}m{month:02d} "
+                    f"PARTITION OF {table} FOR VALUES FROM ('{start}') TO ('{end}')"
+                )
+            )
+
+
+# ---------------------------
+# Archive Functions
+# ---------------------------
+
+
+# ARCHIVE CLOSED ORDERS
+# - Moves closed orders older than `older_than_months` into the archive tables.
+# - Parameters:
+#   - `db (Session)`: Database session.
+#   - `older_than_months (int)`: Minimum age, in whole months, of archived orders.
+#   - `batch_size (int)`: Number of orders moved per transaction.
+# - Returns:
+#   - `int`: The number of orders archived.
+# - Details:
+#   - Each batch copies the orders, their line items and their payments with
+#     `INSERT ... SELECT` and deletes them from the hot tables in one
+#     transaction, so an interrupted run can simply be restarted.
+#   - Per-user order aggregates are unaffected; archived orders still count.
+def archive_closed_orders(
+    db: Session, older_than_months: int = 6, batch_size: int = 500
+) -> int:
+    cutoff = _months_ago(datetime.utcnow(), older_than_months)
+    archived = 0
+    while True:
+        batch = db.execute(
+            select(Order.id, Order.created_at)
+            .where(Order.status.in_(CLOSED_ORDER_STATUSES), Order.created_at < cutoff)
+            .order_by(Order.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if not batch:
+            break
+        order_ids = [row.id for row in batch]
+        months: Set[Tuple[int, int]] = {
+            (row.created_at.year, row.created_at.month) for row in batch
+        }
+        months.update(
+            (created_at.year, created_at.month)
+            for created_at in db.execute(
+                select(Payment.created_at).where(Payment.order_id.in_(order_ids))
+            ).scalars()
+        )
+        ensure_archive_partitions(db, months)
+        now = datetime.utcnow()
+
+        db.execute(
+            insert(ArchivedOrder).from_select(
+                [
+                    "id",
+                    "user_id",
+                    "total_price",
+                    "reference",
+                    "status",
+                    "created_at",
+                    "updated_at",
+                    "archived_at",
+                ],
+                select(
+                    Order.id,
+                    Order.user_id,
+                    Order.total_price,
+                    Order.reference,
+                    Order.status,
+                    Order.created_at,
+                    Order.updated_at,
+                    literal(now),
+                ).where(Order.id.in_(order_ids)),
+            )
+        )
+        db.execute(
+            insert(order_product_archive).from_select(
+                ["order_id", "product_id", "order_created_at"],
+                select(
+                    order_product_association.c.order_id,
+                    order_product_association.c.product_id,
+                    Order.created_at,
+                )
+                .join(Order, Order.id == order_product_association.c.order_id)
+                .where(order_product_association.c.order_id.in_(order_ids)),
+            )
+        )
+        db.execute(
+            insert(ArchivedPayment).from_select(
+                [
+                    "id",
+                    "order_id",
+                    "reference",
+                    "amount",
+                    "status",
+                    "paid_at",
+                    "created_at",
+                    "updated_at",
+                    "archived_at",
+                ],
+                select(
+                    Payment.id,
+                    Payment.order_id,
+                    Payment.reference,
+                    Payment.amount,
+                    Payment.status,
+                    Payment.paid_at,
+                    Payment.created_at,
+                    Payment.updated_at,
+                    literal(now),
+                ).where(Payment.order_id.in_(order_ids)),
+            )
+        )
+
+        db.execute(delete(Payment).where(Payment.order_id.in_(order_ids)))
+        db.execute(
+            delete(order_product_association).where(
+                order_product_association.c.order_id.in_(order_ids)
+            )
+        )
+        db.execute(
+            delete(Order)
+            .where(Order.id.in_(order_ids))
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        archived += len(order_ids)
+    return archived
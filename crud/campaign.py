@@ -0,0 +1,605 @@
+import asyncio
+import html
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from string import Template
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException, status
+from sqlalchemy import and_, exists, func, or_, select, update
+from sqlalchemy.orm import Session
+from core.mailer import mailer
+from core.metrics import metrics
+from db.models import Campaign, CampaignDelivery, Order, OrderStatus, User
+from db.session import SessionLocal
+from db.upsert import insert_missing
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on recipients read, claimed and sent between two checkpoints
+CAMPAIGN_CHUNK_SIZE = int(os.getenv("CAMPAIGN_CHUNK_SIZE", "200"))
+# Send rate of campaigns created without one, in messages per second
+CAMPAIGN_RATE_PER_SECOND = float(os.getenv("CAMPAIGN_RATE_PER_SECOND", "10"))
+# Seconds of sending per chunk; slow campaigns use smaller chunks
+CAMPAIGN_CHUNK_SECONDS = 60
+# A running campaign without a checkpoint for this long may be taken over
+CAMPAIGN_STALE_SECONDS = 300
+# Pending orders older than this, but not older than the max age, are abandoned carts
+ABANDONED_CART_AFTER = timedelta(hours=24)
+ABANDONED_CART_MAX_AGE = timedelta(days=30)
+
+campaign_messages = metrics.counter(
+    "campaign_messages_total", "Campaign messages handed to the mailer, by result."
+)
+
+
+# ---------------------------
+# Segments
+# ---------------------------
+
+
+def _user_fields(row) -> dict:
+    name = row.full_name or row.username or ""
+    return {
+        "id": row.id,
+        "email": row.email,
+        "username": row.username or "",
+        "full_name": row.full_name or "",
+        "first_name": name.split()[0] if name.strip() else "",
+    }
+
+
+def _active_users(after_id: int, limit: int):
+    return (
+        select(User.id, User.email, User.username, User.full_name)
+        .where(User.is_active == True, User.id > after_id)  # noqa: E712
+        .order_by(User.id)
+        .limit(limit)
+    )
+
+
+# All active users
+def _all_active_chunk(db: Session, after_id: int, limit: int) -> List[dict]:
+    return [_user_fields(row) for row in db.execute(_active_users(after_id, limit))]
+
+
+# Active users with a pending order placed between 24 hours and 30 days ago
+def _abandoned_cart_chunk(db: Session, after_id: int, limit: int) -> List[dict]:
+    now = datetime.utcnow()
+    in_window = and_(
+        Order.status == OrderStatus.PENDING,
+        Order.created_at <= now - ABANDONED_CART_AFTER,
+        Order.created_at > now - ABANDONED_CART_MAX_AGE,
+    )
+    rows = db.execute(
+        _active_users(after_id, limit).where(
+            exists().where(Order.user_id == User.id, in_window)
+        )
+    ).all()
+    if not rows:
+        return []
+    carts = {
+        user_id: (count, total)
+        for user_id, count, total in db.execute(
+            select(Order.user_id, func.count(Order.id), func.sum(Order.total_price))
+            .where(Order.user_id.in_([row.id for row in rows]), in_window)
+            .group_by(Order.user_id)
+        )
+    }
+    recipients = []
+    for row in rows:
+        count, total = carts.get(row.id, (0, 0.0))
+        fields = _user_fields(row)
+        fields["pending_orders"] = str(count)
+        fields["cart_total"] = f"{total or 0:,.2f}"
+        recipients.append(fields)
+    return recipients
+
+
+_USER_PLACEHOLDERS = ("first_name", "full_name", "username", "email")
+
+# Segment name -> (chunk query, placeholders available to its templates)
+SEGMENTS = {
+    "all_active": (_all_active_chunk, _USER_PLACEHOLDERS),
+    "abandoned_cart": (
+        _abandoned_cart_chunk,
+        _USER_PLACEHOLDERS + ("pending_orders", "cart_total"),
+    ),
+}
+
+
+# ---------------------------
+# Templates
+# ---------------------------
+
+
+# VALIDATE CAMPAIGN TEMPLATES
+# - Checks that `subject` and `body` are valid `string.Template` texts that only
+#   use the placeholders of `segment`, e.g. `Hi $first_name`.
+# - Raises:
+#   - `ValueError`: With a message naming the problem.
+def validate_campaign_templates(segment: str, subject: str, body: str):
+    if segment not in SEGMENTS:
+        raise ValueError(f"Unknown segment {segment!r}")
+    allowed = SEGMENTS[segment][1]
+    for label, text in (("subject", subject), ("body", body)):
+        template = Template(text)
+        if not template.is_valid():
+            raise ValueError(f"{label}: invalid placeholder; use $name or ${{name}}")
+        unknown = sorted(set(template.get_identifiers()) - set(allowed))
+        if unknown:
+            raise ValueError(
+                f"{label}: unknown placeholders {', '.join(unknown)}; "
+                f"available: {', '.join(allowed)}"
+            )
+
+
+# CAMPAIGN RENDERER
+# - Parses a campaign's templates once and fills them in per recipient.
+# - Details:
+#   - Values are HTML-escaped in the body of HTML campaigns.
+#   - Line breaks in values are replaced by spaces in the subject, which must
+#     stay a single header line.
+class CampaignRenderer:
+    def __init__(self, subject: str, body: str, subtype: str = "plain"):
+        self.subject = Template(subject)
+        self.body = Template(body)
+        self.subtype = subtype
+
+    def render(self, recipient: dict):
+        body_fields = recipient
+        if self.subtype == "html":
+            body_fields = {
+                key: html.escape(str(value)) for key, value in recipient.items()
+            }
+        subject_fields = {
+            key: " ".join(str(value).splitlines()) for key, value in recipient.items()
+        }
+        return mailer.build_message(
+            self.subject.substitute(subject_fields),
+            recipient["email"],
+            self.body.substitute(body_fields),
+            self.subtype,
+        )
+
+
+# ---------------------------
+# Campaign Records
+# ---------------------------
+
+
+# CREATE CAMPAIGN
+# - Validates and stores a draft campaign.
+# - Raises:
+#   - `HTTPException`: 400 if the segment or templates are invalid.
+def create_campaign(
+    db: Session,
+    name: str,
+    segment: str,
+    subject: str,
+    body: str,
+    subtype: str = "plain",
+    rate_per_second: Optional[float] = None,
+) -> Campaign:
+    try:
+        validate_campaign_templates(segment, subject, body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    campaign = Campaign(
+        name=name,
+        segment=segment,
+        subject=subject,
+        body=body,
+        subtype=subtype,
+        rate_per_second=rate_per_second or CAMPAIGN_RATE_PER_SECOND,
+        status="draft",
+        checkpoint_user_id=0,
+        sent_count=0,
+        failed_count=0,
+    )
+    db.add(campaign)
+    db.commit()
+    db.refresh(campaign)
+    return campaign
+
+
+# GET CAMPAIGN PROGRESS
+# - Returns a campaign's settings, counters and deliveries by status.
+# - Raises:
+#   - `HTTPException`: 404 if the campaign does not exist.
+def get_campaign_progress(db: Session, campaign_id: int) -> dict:
+    campaign = db.get(Campaign, campaign_id)
+    if campaign is None:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    deliveries = dict(
+        db.execute(
+            select(CampaignDelivery.status, func.count())
+            .where(CampaignDelivery.campaign_id == campaign_id)
+            .group_by(CampaignDelivery.status)
+        ).all()
+    )
+    return {
+        "id": campaign.id,
+        "name": campaign.name,
+        "segment": campaign.segment,
+        "status": campaign.status,
+        "rate_per_second": campaign.rate_per_second,
+        "checkpoint_user_id": campaign.checkpoint_user_id,
+        "sent": campaign.sent_count,
+        "failed": campaign.failed_count,
+        "deliveries": deliveries,
+        "last_error": campaign.last_error,
+        "created_at": campaign.created_at,
+        "started_at": campaign.started_at,
+        "completed_at": campaign.completed_at,
+    }
+
+
+# Takes the campaign's run lease; returns its settings, or None if it is
+# completed or another runner is alive. Raises 404 if it does not exist.
+def _acquire(campaign_id: int, rate_per_second: Optional[float]) -> Optional[dict]:
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        values = {
+            "status": "running",
+            "heartbeat_at": now,
+            "started_at": func.coalesce(Campaign.started_at, now),
+            "last_error": None,
+        }
+        if rate_per_second:
+            values["rate_per_second"] = rate_per_second
+        result = db.execute(
+            update(Campaign)
+            .where(
+                Campaign.id == campaign_id,
+                or_(
+                    Campaign.status.in_(("draft", "paused", "failed")),
+                    and_(
+                        Campaign.status == "running",
+                        Campaign.heartbeat_at
+                        < now - timedelta(seconds=CAMPAIGN_STALE_SECONDS),
+                    ),
+                ),
+            )
+            .values(**values)
+        )
+        if result.rowcount != 1:
+            db.rollback()
+            if db.get(Campaign, campaign_id) is None:
+                raise HTTPException(status_code=404, detail="Campaign not found")
+            return None
+        # Claims left by a run that died mid-chunk may or may not have been sent
+        db.execute(
+            update(CampaignDelivery)
+            .where(
+                CampaignDelivery.campaign_id == campaign_id,
+                CampaignDelivery.status == "claimed",
+            )
+            .values(status="unconfirmed")
+        )
+        campaign = db.get(Campaign, campaign_id)
+        settings = {
+            "id": campaign.id,
+            "segment": campaign.segment,
+            "subject": campaign.subject,
+            "body": campaign.body,
+            "subtype": campaign.subtype,
+            "rate_per_second": campaign.rate_per_second,
+            "checkpoint_user_id": campaign.checkpoint_user_id,
+        }
+        db.commit()
+        return settings
+    finally:
+        db.close()
+
+
+# Reads the next chunk of the segment and claims its unsent recipients.
+# Returns the claimed recipients and the last user id read (None when done).
+def _claim_chunk(
+    campaign_id: int, segment: str, after_id: int, limit: int
+) -> Tuple[List[dict], Optional[int]]:
+    db = SessionLocal()
+    try:
+        chunk = SEGMENTS[segment][0](db, after_id, limit)
+        if not chunk:
+            return [], None
+        now = datetime.utcnow()
+        claimed = set(
+            insert_missing(
+                db,
+                CampaignDelivery,
+                [
+                    {
+                        "campaign_id": campaign_id,
+                        "user_id": recipient["id"],
+                        "status": "claimed",
+                        "claimed_at": now,
+                    }
+                    for recipient in chunk
+                ],
+                ("campaign_id", "user_id"),
+                returning="user_id",
+            )
+        )
+        db.commit()
+        return [r for r in chunk if r["id"] in claimed], chunk[-1]["id"]
+    finally:
+        db.close()
+
+
+# Records the outcome of a chunk and moves the checkpoint.
+# Claims of recipients that were never attempted are released for the next run.
+# Returns the campaign status, which an admin may have changed meanwhile.
+def _checkpoint(
+    campaign_id: int,
+    checkpoint_user_id: int,
+    sent: List[int],
+    failed: Dict[int, str],
+    released: List[int],
+) -> str:
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        rows = [
+            {
+                "campaign_id": campaign_id,
+                "user_id": user_id,
+                "status": "sent",
+                "sent_at": now,
+            }
+            for user_id in sent
+        ] + [
+            {
+                "campaign_id": campaign_id,
+                "user_id": user_id,
+                "status": "failed",
+                "error": error,
+            }
+            for user_id, error in failed.items()
+        ]
+        if rows:
+            db.execute(update(CampaignDelivery), rows)
+        if released:
+            db.query(CampaignDelivery).filter(
+                CampaignDelivery.campaign_id == campaign_id,
+                CampaignDelivery.user_id.in_(released),
+            ).delete(synchronize_session=False)
+        db.execute(
+            update(Campaign)
+            .where(Campaign.id == campaign_id)
+            .values(
+                checkpoint_user_id=checkpoint_user_id,
+                sent_count=Campaign.sent_count + len(sent),
+                failed_count=Campaign.failed_count + len(failed),
+                heartbeat_at=now,
+            )
+        )
+        current = db.execute(
+            select(Campaign.status).where(Campaign.id == campaign_id)
+        ).scalar_one()
+        db.commit()
+        return current
+    finally:
+        db.close()
+
+
+# Ends a run; a campaign paused by an admin keeps its status
+def _finish(campaign_id: int, new_status: str, error: Optional[str] = None):
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(Campaign)
+            .where(Campaign.id == campaign_id, Campaign.status == "running")
+            .values(
+                status=new_status,
+                last_error=error,
+                completed_at=datetime.utcnow() if new_status == "completed" else None,
+            )
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+# ---------------------------
+# Campaign Runner
+# ---------------------------
+
+
+# The chunk a run is sending: its claimed recipients and what happened so far
+@dataclass
+class _Chunk:
+    after_id: int
+    recipients: List[dict]
+    sends: Dict[int, asyncio.Task] = field(default_factory=dict)
+    failed: Dict[int, str] = field(default_factory=dict)
+    attempted: int = 0
+
+    # Waits for the messages in flight; returns the sent, failed and
+    # never attempted recipients
+    async def outcome(self) -> Tuple[List[int], Dict[int, str], List[int]]:
+        results = await asyncio.gather(*self.sends.values(), return_exceptions=True)
+        sent, failed = [], dict(self.failed)
+        for user_id, result in zip(self.sends, results):
+            if isinstance(result, Exception):
+                failed[user_id] = str(result)[:500]
+            else:
+                sent.append(user_id)
+        released = [r["id"] for r in self.recipients[self.attempted :]]
+        return sent, failed, released
+
+
+# CAMPAIGN RUNNER
+# - Sends campaigns chunk by chunk through the pooled mailer.
+# - Details:
+#   - Recipients come from a keyset scan of the segment (`ix_users_active_id`),
+#     so memory use does not grow with the user base.
+#   - Each chunk is claimed in `campaign_deliveries` before anything is sent,
+#     then sent at `rate_per_second`, then checkpointed. A resumed or taken
+#     over campaign skips every claimed recipient, so nobody gets it twice.
+#   - Chunks hold at most `CAMPAIGN_CHUNK_SECONDS` of sending, which keeps
+#     the heartbeat fresh and bounds the work a crash can leave unconfirmed.
+#   - Pausing, shutting down or cancelling the run stops before the next
+#     message; in-flight messages are recorded, and the claims of recipients
+#     not yet attempted are released and sent on resume. A run that fails
+#     records its current chunk the same way before it is marked failed.
+#   - A recipient whose message cannot be rendered is recorded as failed,
+#     like an SMTP error, and the run goes on.
+class CampaignRunner:
+    def __init__(self):
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._stops: Dict[int, asyncio.Event] = {}
+        self._chunks: Dict[int, _Chunk] = {}
+
+    # RUN
+    # - Runs a campaign to completion (or until paused) in the foreground.
+    # - Raises:
+    #   - `HTTPException`: 404 if it does not exist, 409 if it is completed or
+    #     already running.
+    async def run(self, campaign_id: int, rate_per_second: Optional[float] = None):
+        settings = await self._acquire(campaign_id, rate_per_second)
+        await self._run(settings)
+
+    # START
+    # - Starts a campaign in the background of this worker.
+    # - Raises:
+    #   - `HTTPException`: 404 if it does not exist, 409 if it is completed or
+    #     already running.
+    async def start(self, campaign_id: int, rate_per_second: Optional[float] = None):
+        settings = await self._acquire(campaign_id, rate_per_second)
+        task = asyncio.create_task(self._run(settings))
+        self._tasks[campaign_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(campaign_id, None))
+
+    # PAUSE
+    # - Marks a running campaign as paused; its runner stops before the next message.
+    # - Returns:
+    #   - (bool): False if the campaign was not running.
+    def pause(self, db: Session, campaign_id: int) -> bool:
+        result = db.execute(
+            update(Campaign)
+            .where(Campaign.id == campaign_id, Campaign.status == "running")
+            .values(status="paused")
+        )
+        db.commit()
+        stop = self._stops.get(campaign_id)
+        if stop is not None:
+            stop.set()
+        return result.rowcount == 1
+
+    # STOP
+    # - Interrupts the campaigns running in this worker and waits for their checkpoint.
+    async def stop(self):
+        for stop in self._stops.values():
+            stop.set()
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def _acquire(self, campaign_id: int, rate_per_second: Optional[float]):
+        settings = await asyncio.to_thread(_acquire, campaign_id, rate_per_second)
+        if settings is None:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Campaign is completed or already running",
+            )
+        return settings
+
+    async def _run(self, settings: dict):
+        campaign_id = settings["id"]
+        stop = self._stops[campaign_id] = asyncio.Event()
+        sending = asyncio.ensure_future(self._send_all(settings, stop))
+        try:
+            try:
+                await asyncio.shield(sending)
+            except asyncio.CancelledError:
+                # Cancelled (e.g. Ctrl-C in `manage.py run-campaign`): finish the
+                # chunk like a pause, so nothing is left claimed, then re-raise
+                stop.set()
+                await sending
+                raise
+        except Exception as e:
+            logger.exception("Campaign %d failed", campaign_id)
+            chunk = self._chunks.pop(campaign_id, None)
+            if chunk is not None:
+                await self._abandon(campaign_id, chunk)
+            await asyncio.to_thread(_finish, campaign_id, "failed", str(e)[:500])
+        finally:
+            self._stops.pop(campaign_id, None)
+            self._chunks.pop(campaign_id, None)
+
+    # Records the chunk of a failed run without moving the checkpoint, so
+    # recipients not yet attempted are released instead of left claimed
+    async def _abandon(self, campaign_id: int, chunk: _Chunk):
+        try:
+            sent, failed, released = await chunk.outcome()
+            await asyncio.to_thread(
+                _checkpoint, campaign_id, chunk.after_id, sent, failed, released
+            )
+        except Exception:
+            logger.exception("Could not checkpoint failed campaign %d", campaign_id)
+
+    async def _send_all(self, settings: dict, stop: asyncio.Event):
+        campaign_id = settings["id"]
+        renderer = CampaignRenderer(
+            settings["subject"], settings["body"], settings["subtype"]
+        )
+        rate = settings["rate_per_second"]
+        chunk_size = max(
+            1, min(CAMPAIGN_CHUNK_SIZE, int(rate * CAMPAIGN_CHUNK_SECONDS))
+        )
+        after_id = settings["checkpoint_user_id"]
+        next_send = time.monotonic()
+        while True:
+            if stop.is_set():
+                await asyncio.to_thread(_finish, campaign_id, "paused", "Interrupted")
+                return
+            recipients, last_id = await asyncio.to_thread(
+                _claim_chunk, campaign_id, settings["segment"], after_id, chunk_size
+            )
+            if last_id is None:
+                await asyncio.to_thread(_finish, campaign_id, "completed")
+                return
+
+            chunk = self._chunks[campaign_id] = _Chunk(after_id, recipients)
+            for recipient in recipients:
+                delay = next_send - time.monotonic()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(stop.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                if stop.is_set():
+                    break
+                chunk.attempted += 1
+                try:
+                    message = renderer.render(recipient)
+                except Exception as e:
+                    chunk.failed[recipient["id"]] = f"Render failed: {e}"[:500]
+                    continue
+                next_send = max(next_send, time.monotonic()) + 1 / rate
+                chunk.sends[recipient["id"]] = asyncio.create_task(mailer.send(message))
+            sent, failed, released = await chunk.outcome()
+            campaign_messages.inc(len(sent), result="sent")
+            campaign_messages.inc(len(failed), result="failed")
+            current = await asyncio.to_thread(
+                _checkpoint,
+                campaign_id,
+                after_id if released else last_id,
+                sent,
+                failed,
+                released,
+            )
+            del self._chunks[campaign_id]
+            if released or current != "running":
+                if current == "running":
+                    await asyncio.to_thread(
+                        _finish, campaign_id, "paused", "Interrupted"
+                    )
+                return
+            after_id = last_id
+
+
+campaign_runner = CampaignRunner()
@@ -0,0 +1,235 @@
+import csv
+import io
+import zlib
+from datetime import datetime
+from typing import Iterator, List, Optional
+from sqlalchemy import and_, or_, select, union_all
+from sqlalchemy.orm import Session
+from db.models import (
+    Order,
+    OrderStatus,
+    User,
+    Product,
+    Payment,
+    ArchivedOrder,
+    ArchivedPayment,
+    order_product_association,
+    order_product_archive,
+)
+from db.session import SessionLocal
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_CHUNK_SIZE = 2000
+# Uncompressed bytes buffered before they are handed to the compressor
+EXPORT_FLUSH_BYTES = 64 * 1024
+
+# Column headers of the order export, in output order
+ORDER_EXPORT_COLUMNS = (
+    "order_id",
+    "order_reference",
+    "order_status",
+    "order_created_at",
+    "order_total",
+    "user_id",
+    "username",
+    "email",
+    "product_id",
+    "product_name",
+    "product_price",
+    "payment_reference",
+    "payment_status",
+    "payment_amount",
+    "paid_at",
+)
+
+
+# ---------------------------
+# Export Functions
+# ---------------------------
+
+
+def _tier_query(
+    order, line_items, line_item_order, payment, start, end, statuses, after
+):
+    statement = (
+        select(
+            order.id.label("order_id"),
+            order.reference.label("order_reference"),
+            order.status.label("order_status"),
+            order.created_at.label("order_created_at"),
+            order.total_price.label("order_total"),
+            User.id.label("user_id"),
+            User.username,
+            User.email,
+            Product.id.label("product_id"),
+            Product.name.label("product_name"),
+            Product.price.label("product_price"),
+            payment.reference.label("payment_reference"),
+            payment.status.label("payment_status"),
+            payment.amount.label("payment_amount"),
+            payment.paid_at,
+        )
+        .select_from(order)
+        .join(User, User.id == order.user_id)
+        .join(line_items, line_item_order == order.id)
+        .join(Product, Product.id == line_items.c.product_id)
+        .outerjoin(payment, payment.order_id == order.id)
+    )
+    if start is not None:
+        statement = statement.where(order.created_at >= start)
+    if end is not None:
+        statement = statement.where(order.created_at < end)
+    if statuses:
+        statement = statement.where(order.status.in_(statuses))
+    if after is not None:
+        after_created_at, after_id = after
+        statement = statement.where(
+            or_(
+                order.created_at > after_created_at,
+                and_(order.created_at == after_created_at, order.id > after_id),
+            )
+        )
+    return statement
+
+
+# RESOLVE EXPORT POSITION
+# - Finds the `(created_at, id)` keyset position of an already exported order.
+# - Parameters:
+#   - `db (Session)`: Database session.
+#   - `order_id (int)`: The last order fully received by the client.
+# - Returns:
+#   - `Tuple[datetime, int]`: The position to resume after.
+# - Raises:
+#   - `ValueError`: If the order exists in neither the live nor the archive tier.
+def resolve_export_position(db: Session, order_id: int):
+    for model in (Order, ArchivedOrder):
+        created_at = db.execute(
+            select(model.created_at).where(model.id == order_id)
+        ).scalar()
+        if created_at is not None:
+            return created_at, order_id
+    raise ValueError(f"Order {order_id} not found")
+
+
+# BUILD ORDER EXPORT QUERY
+# - Builds the joined order export query over the live and archive tiers.
+# - Parameters:
+#   - `start (datetime)`: Include orders created at or after this time, if given.
+#   - `end (datetime)`: Include orders created before this time, if given.
+#   - `statuses (List[OrderStatus])`: Include only these statuses, if given.
+#   - `after (Tuple[datetime, int])`: Resume after this `(created_at, id)` position.
+# - Returns:
+#   - A `SELECT` producing one row per order line item and payment, ordered by
+#     `(order_created_at, order_id, product_id)`.
+# - Details:
+#   - Filters and the resume position are pushed into each tier's WHERE clause
+#     and served by the `(created_at, id)` indexes. On PostgreSQL the ordered
+#     tiers are merged rather than sorted as a whole.
+def build_order_export_query(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    statuses: Optional[List[OrderStatus]] = None,
+    after=None,
+):
+    live = _tier_query(
+        Order,
+        order_product_association,
+        order_product_association.c.order_id,
+        Payment,
+        start,
+        end,
+        statuses,
+        after,
+    )
+    archived = _tier_query(
+        ArchivedOrder,
+        order_product_archive,
+        order_product_archive.c.order_id,
+        ArchivedPayment,
+        start,
+        end,
+        statuses,
+        after,
+    )
+    combined = union_all(live, archived).subquery()
+    return select(combined).order_by(
+        combined.c.order_created_at, combined.c.order_id, combined.c.product_id
+    )
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return getattr(value, "value", value)
+
+
+# STREAM ORDER EXPORT
+# - Yields the order export as gzip-compressed CSV chunks.
+# - Parameters:
+#   - `start`, `end`, `statuses`: Filters passed to `build_order_export_query`.
+#   - `after_order_id (int)`: Resume after this order, if given.
+#   - `compress (bool)`: Whether to gzip the output (default: True).
+# - Returns:
+#   - `Iterator[bytes]`: Output chunks; concatenated they form one gzip file.
+# - Raises:
+#   - `ValueError`: If `after_order_id` does not exist.
+# - Details:
+#   - Uses its own session because the request's session is closed before a
+#     streaming response body is sent.
+#   - Rows come from a server-side cursor and are compressed incrementally, so
+#     memory use does not depend on the size of the export.
+#   - Rows of one order are contiguous. A client that lost the connection can
+#     resume with the id of the last order it received completely; resumed
+#     exports omit the header row so they can be appended to the partial file.
+def stream_order_export(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    statuses: Optional[List[OrderStatus]] = None,
+    after_order_id: Optional[int] = None,
+    compress: bool = True,
+) -> Iterator[bytes]:
+    db = SessionLocal()
+    try:
+        after = None
+        if after_order_id is not None:
+            after = resolve_export_position(db, after_order_id)
+    except Exception:
+        db.close()
+        raise
+    return _stream_order_export(db, start, end, statuses, after, compress)
+
+
+def _stream_order_export(db, start, end, statuses, after, compress) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def drain() -> bytes:
+        data = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+
+    try:
+        if after is None:
+            writer.writerow(ORDER_EXPORT_COLUMNS)
+        result = db.execute(
+            build_order_export_query(start, end, statuses, after).execution_options(
+                stream_results=True, yield_per=EXPORT_CHUNK_SIZE
+            )
+        )
+        for partition in result.partitions():
+            writer.writerows([_csv_value(value) for value in row] for row in partition)
+            if buffer.tell() >= EXPORT_FLUSH_BYTES:
+                chunk = drain()
+                if chunk:
+                    yield chunk
+        chunk = drain()
+        if compressor:
+            chunk += compressor.flush()
+        if chunk:
+            yield chunk
+    finally:
+        db.close()
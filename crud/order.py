@@ -1,8 +1,107 @@
-from sqlalchemy.orm import Session
-from db.models import Order, User, Product
+from sqlalchemy.orm import Session, selectinload
+from db.models import (
+    Order,
+    OrderStatus,
+    User,
+    Product,
+    UserOrderStats,
+    ArchivedOrder,
+)
 from schema.order import OrderUpdate
-from sqlalchemy import func
-from typing import List
+from core.events import publish_order_event
+from core.recommendations import publish_order_items
+from core.popularity import popularity_counters
+from core.ids import parse_id
+from crud.rollups import (
+    record_order_created,
+    record_product_added,
+    record_order_change,
+    record_order_deleted,
+    record_status_changes,
+)
+from db.upsert import upsert_increment
+from sqlalchemy import func, insert, select, delete, update, and_, or_, union_all
+from typing import List, Optional, Tuple, Union
+from datetime import datetime
+import base64
+
+
+# Statuses an order may move to, mapped to the statuses it may move from
+ORDER_STATUS_TRANSITIONS = {
+    OrderStatus.PENDING: set(),
+    OrderStatus.IN_PROGRESS: {OrderStatus.PENDING},
+    OrderStatus.SHIPPED: {OrderStatus.PENDING, OrderStatus.IN_PROGRESS},
+    OrderStatus.DELIVERED: {OrderStatus.SHIPPED},
+    OrderStatus.CANCELED: {OrderStatus.PENDING, OrderStatus.IN_PROGRESS},
+}
+
+
+# ---------------------------
+# Order Aggregate Helpers
+# ---------------------------
+
+
+# APPLY ORDER STATS DELTA
+# - Adjusts the per-user order aggregates inside the caller's transaction.
+# - Parameters:
+#   - `db (Session)`: Database session.
+#   - `user_id (int)`: ID of the user whose aggregates change.
+#   - `count_delta (int)`: Change in the number of orders.
+#   - `total_delta (float)`: Change in the lifetime order total.
+#   - `order_time (datetime)`: Creation time of an order added to the user, if any.
+# - Details:
+#   - A single `INSERT ... ON CONFLICT (user_id) DO UPDATE`, so the first orders
+#     of a new user cannot race to create the row, and the row stays locked
+#     until the caller commits. Nothing is committed here.
+def _apply_order_stats(
+    db: Session,
+    user_id: int,
+    count_delta: int = 0,
+    total_delta: float = 0.0,
+    order_time: Optional[datetime] = None,
+):
+    upsert_increment(
+        db,
+        UserOrderStats,
+        [
+            {
+                "user_id": user_id,
+                "order_count": count_delta,
+                "lifetime_total": total_delta,
+                "last_order_at": order_time,
+                "updated_at": datetime.utcnow(),
+            }
+        ],
+        ("user_id",),
+        ("order_count", "lifetime_total"),
+        set_columns=("updated_at",),
+        max_columns=("last_order_at",),
+    )
+
+
+# Returns the user's aggregate row as written by `_apply_order_stats`
+def _load_order_stats(db: Session, user_id: int) -> UserOrderStats:
+    return db.get(UserOrderStats, user_id, populate_existing=True)
+
+
+# REFRESH LAST ORDER TIME
+# - Recomputes `last_order_at` after the user's most recent order went away.
+# - Parameters:
+#   - `db (Session)`: Database session.
+#   - `stats (UserOrderStats)`: The aggregate row to refresh.
+#   - `exclude_order_id (int)`: ID of the order being removed or reassigned.
+# - Details:
+#   - Archived orders are included, matching `rebuild_user_order_stats`.
+def _refresh_last_order_at(db: Session, stats: UserOrderStats, exclude_order_id: int):
+    order_times = union_all(
+        select(Order.created_at).where(
+            Order.user_id == stats.user_id, Order.id != exclude_order_id
+        ),
+        select(ArchivedOrder.created_at).where(ArchivedOrder.user_id == stats.user_id),
+    ).subquery()
+    stats.last_order_at = db.execute(
+        select(func.max(order_times.c.created_at))
+    ).scalar()
 
 
 # ---------------------------
@@ -28,10 +127,21 @@ def create_order(db: Session, user_id: int, product_ids: List[int]) -> Order:
     if len(products) != len(product_ids):
         raise ValueError("Some products not found")
     total_price = sum(product.price for product in products)
-    order = Order(user_id=user_id, total_price=total_price, products=products)
+    created_at = datetime.utcnow()
+    order = Order(
+        user_id=user_id,
+        total_price=total_price,
+        products=products,
+        created_at=created_at,
+    )
     db.add(order)
+    _apply_order_stats(db, user_id, 1, total_price, created_at)
+    record_order_created(db, order)
     db.commit()
     db.refresh(order)
+    publish_order_items(order.id, [product.id for product in products])
+    for product in products:
+        popularity_counters.record_sale(product.id)
     return order
 
 
@@ -40,10 +150,137 @@ def create_order(db: Session, user_id: int, product_ids: List[int]) -> Order:
 # - Parameters:
 #   - `db (Session)`: Database session.
 #   - `order_id (int)`: ID of the order to fetch.
+#   - `include_archive (bool)`: Whether to fall back to the archive tier (default: True).
+# - Returns:
+#   - `Order | ArchivedOrder`: The retrieved order if found; `None` otherwise.
+# - Details:
+#   - Archived orders are read-only; callers that modify the order pass `include_archive=False`.
+def get_order(
+    db: Session, order_id: int, include_archive: bool = True
+) -> Union[Order, ArchivedOrder, None]:
+    order = db.query(Order).filter(Order.id == order_id).first()
+    if order is None and include_archive:
+        order = db.query(ArchivedOrder).filter(ArchivedOrder.id == order_id).first()
+    return order
+
+
+# GET ORDER BY REFERENCE
+# - Retrieves an order by its reference, falling back to the archive tier.
+# - Parameters:
+#   - `db (Session)`: Database session.
+#   - `reference (str)`: Reference of the order to fetch.
+#   - `include_archive (bool)`: Whether to fall back to the archive tier (default: True).
+# - Returns:
+#   - `Order | ArchivedOrder`: The retrieved order if found; `None` otherwise.
+def get_order_by_reference(
+    db: Session, reference: str, include_archive: bool = True
+) -> Union[Order, ArchivedOrder, None]:
+    reference = parse_id(reference)
+    if reference is None:
+        return None
+    order = db.query(Order).filter(Order.reference == reference).first()
+    if order is None and include_archive:
+        order = (
+            db.query(ArchivedOrder).filter(ArchivedOrder.reference == reference).first()
+        )
+    return order
+
+
+# ENCODE ORDER CURSOR
+# - Builds an opaque keyset cursor from the last order of a page.
+# - Parameters:
+#   - `order (Order)`: The last order returned on the page.
+# - Returns:
+#   - `str`: A URL-safe cursor encoding `(created_at, id)`.
+def encode_order_cursor(order: Order) -> str:
+    raw = f"{order.created_at.isoformat()}|{order.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+# DECODE ORDER CURSOR
+# - Parses a cursor produced by `encode_order_cursor`.
+# - Parameters:
+#   - `cursor (str)`: The opaque cursor string.
+# - Returns:
+#   - `Tuple[datetime, int]`: The `(created_at, id)` position of the cursor.
+# - Raises:
+#   - `ValueError`: If the cursor is malformed.
+def decode_order_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at, order_id = raw.split("|")
+        return datetime.fromisoformat(created_at), int(order_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+
+# Returns up to `limit` of a user's orders from `model` past the keyset position
+def _user_orders_after(
+    db: Session,
+    model,
+    user_id: int,
+    position: Optional[Tuple[datetime, int]],
+    limit: int,
+    status: Optional[OrderStatus],
+) -> list:
+    query = db.query(model).filter(model.user_id == user_id)
+    if status is not None:
+        query = query.filter(model.status == status)
+    if position is not None:
+        created_at, order_id = position
+        query = query.filter(
+            or_(
+                model.created_at < created_at,
+                and_(model.created_at == created_at, model.id > order_id),
+            )
+        )
+    return (
+        query.options(selectinload(model.products))
+        .order_by(model.created_at.desc(), model.id)
+        .limit(limit)
+        .all()
+    )
+
+
+# GET USER ORDERS PAGE
+# - Retrieves one page of a user's order history, newest first.
+# - Parameters:
+#   - `db (Session)`: Database session.
+#   - `user_id (int)`: ID of the user whose orders are listed.
+#   - `limit (int)`: Maximum number of orders on the page.
+#   - `cursor (str)`: Cursor returned with the previous page, if any.
+#   - `status (OrderStatus)`: Optional status filter.
 # - Returns:
-#   - `Order`: The retrieved order if found; `None` otherwise.
-def get_order(db: Session, order_id: int) -> Order:
-    return db.query(Order).filter(Order.id == order_id).first()
+#   - `Tuple[List[Order | ArchivedOrder], Optional[str]]`: The orders and the
+#     cursor for the next page.
+# - Details:
+#   - Uses keyset pagination on `(created_at, id)`, which is served by the
+#     `ix_orders_user_created_id` index, so deep pages cost the same as the first.
+#   - Only closed orders are archived, so an old open order can be older than
+#     archived ones: both `orders` and `orders_archive` are read past the
+#     cursor (`limit + 1` rows each) and merged into one page.
+#   - Line items are loaded with one `IN` query per table for the page only.
+def get_user_orders_page(
+    db: Session,
+    user_id: int,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    status: Optional[OrderStatus] = None,
+) -> Tuple[List[Union[Order, ArchivedOrder]], Optional[str]]:
+    position = decode_order_cursor(cursor) if cursor else None
+    orders = [
+        order
+        for model in (Order, ArchivedOrder)
+        for order in _user_orders_after(db, model, user_id, position, limit + 1, status)
+    ]
+    # Newest first, ties by id: the keyset order of both tables
+    orders.sort(key=lambda order: order.id)
+    orders.sort(key=lambda order: order.created_at, reverse=True)
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_order_cursor(orders[-1])
+    return orders, next_cursor
 
 
 # ADD PRODUCT TO ORDER
@@ -57,14 +294,19 @@ def get_order(db: Session, order_id: int) -> Order:
 # - Raises:
 #   - `ValueError`: If the product or order is not found.
 def add_product_to_order(db: Session, order_id: int, product_id: int) -> Order:
-    order = get_order(db, order_id)
+    order = get_order(db, order_id, include_archive=False)
     product = db.query(Product).filter(Product.id == product_id).first()
     if not order or not product:
         return None
+    existing_ids = [item.id for item in order.products]
     order.products.append(product)
     order.total_price += product.price
+    _apply_order_stats(db, order.user_id, total_delta=product.price)
+    record_product_added(db, order, product)
     db.commit()
     db.refresh(order)
+    publish_order_items(order.id, [product.id], existing_ids)
+    popularity_counters.record_sale(product.id)
     return order
 
 
@@ -79,13 +321,27 @@ def add_product_to_order(db: Session, order_id: int, product_id: int) -> Order:
 # - Raises:
 #   - `ValueError`: If the order is not found or invalid data is provided.
 def update_order(db: Session, order_id: int, order_data: OrderUpdate) -> Order:
-    order = get_order(db, order_id)
+    order = get_order(db, order_id, include_archive=False)
     if not order:
         return None
+    old_user_id, old_total, old_status = order.user_id, order.total_price, order.status
     for key, value in order_data.dict(exclude_unset=True).items():
         setattr(order, key, value)
+    if order.user_id != old_user_id:
+        _apply_order_stats(db, old_user_id, -1, -old_total)
+        stats = _load_order_stats(db, old_user_id)
+        if stats.last_order_at == order.created_at:
+            _refresh_last_order_at(db, stats, order.id)
+        _apply_order_stats(db, order.user_id, 1, order.total_price, order.created_at)
+    elif order.total_price != old_total:
+        _apply_order_stats(db, order.user_id, total_delta=order.total_price - old_total)
+    record_order_change(
+        db, order.created_at, old_status, old_total, order.status, order.total_price
+    )
     db.commit()
     db.refresh(order)
+    if order.status != old_status:
+        publish_order_event(order.reference, order.status)
     return order
 
 
@@ -99,16 +355,130 @@ def update_order(db: Session, order_id: int, order_data: OrderUpdate) -> Order:
 # - Raises:
 #   - `ValueError`: If the order is not found or cannot be deleted.
 def delete_order(db: Session, order_id: int) -> bool:
-    order = get_order(db, order_id)
+    order = get_order(db, order_id, include_archive=False)
     if not order:
         return False
+    _apply_order_stats(db, order.user_id, -1, -order.total_price)
+    stats = _load_order_stats(db, order.user_id)
+    if stats.last_order_at == order.created_at:
+        _refresh_last_order_at(db, stats, order.id)
+    record_order_deleted(db, order)
     db.delete(order)
     db.commit()
     return True
 
 
+# BULK UPDATE ORDER STATUS
+# - Moves many orders, identified by reference, to a target status at once.
+# - Parameters:
+#   - `db (Session)`: Database session.
+#   - `references (List[str])`: References of the orders to transition.
+#   - `target (OrderStatus)`: The status to move the orders to.
+# - Returns:
+#   - `Tuple[List[str], List[str]]`: The references that changed and those rejected.
+# - Details:
+#   - Allowed source statuses come from `ORDER_STATUS_TRANSITIONS` and are checked
+#     set-wise by a single `UPDATE ... WHERE reference IN (...) AND status IN (...)`.
+#   - References that are unknown or not in an allowed source status are rejected.
+#   - The matching rows are locked first so their previous statuses can be moved
+#     out of the sales rollups in the same transaction, with one summed upsert.
+def bulk_update_order_status(
+    db: Session, references: List[str], target: OrderStatus
+) -> Tuple[List[str], List[str]]:
+    references = list(dict.fromkeys(references))
+    allowed = ORDER_STATUS_TRANSITIONS[target]
+    # Map canonical references back to what the caller sent
+    requested = {parse_id(reference): reference for reference in references}
+    requested.pop(None, None)
+    if not requested or not allowed:
+        return [], references
+    matched = db.execute(
+        select(Order.id, Order.status, Order.total_price, Order.created_at)
+        .where(Order.reference.in_(list(requested)), Order.status.in_(allowed))
+        .with_for_update()
+    ).all()
+    if not matched:
+        db.rollback()
+        return [], references
+    result = db.execute(
+        update(Order)
+        .where(Order.id.in_([row.id for row in matched]), Order.status.in_(allowed))
+        .values(status=target, updated_at=datetime.utcnow())
+        .returning(Order.reference),
+        execution_options={"synchronize_session": False},
+    )
+    changed_ids = result.scalars().all()
+    record_status_changes(
+        db,
+        [(row.created_at, row.status, row.total_price) for row in matched],
+        target,
+    )
+    db.commit()
+    for reference in changed_ids:
+        publish_order_event(reference, target)
+    changed = {requested[parse_id(reference)] for reference in changed_ids}
+    updated = [reference for reference in references if reference in changed]
+    rejected = [reference for reference in references if reference not in changed]
+    return updated, rejected
+
+
+# ---------------------------
+# Order Aggregate Functions
+# ---------------------------
+
+
+# GET USER ORDER STATS
+# - Retrieves the maintained order aggregates for a user by primary key.
+# - Parameters:
+#   - `db (Session)`: Database session.
+#   - `user_id (int)`: ID of the user.
+# - Returns:
+#   - `UserOrderStats`: The aggregate row, or `None` if the user never ordered.
+def get_user_order_stats(db: Session, user_id: int) -> Optional[UserOrderStats]:
+    return db.get(UserOrderStats, user_id)
+
+
+# GET TOTAL ORDER PRICE
+# - Returns the lifetime order total for a user from the aggregates table.
+# - Parameters:
+#   - `user_id (int)`: ID of the user.
+#   - `db (Session)`: Database session.
+# - Returns:
+#   - `float`: The user's lifetime order total, or 0.0 if there are no orders.
 def get_total_order_price(user_id: int, db: Session) -> float:
-    return (
-        db.query(func.sum(Order.total_price)).filter(Order.user_id == user_id).scalar()
-        or 0.0
+    stats = get_user_order_stats(db, user_id)
+    return stats.lifetime_total if stats else 0.0
+
+
+# REBUILD USER ORDER STATS
+# - Recomputes every per-user aggregate row from the `orders` table.
+# - Parameters:
+#   - `db (Session)`: Database session.
+# - Returns:
+#   - `int`: The number of aggregate rows written.
+# - Details:
+#   - Used to backfill the table for existing data or to repair drift. Runs as a
+#     single `INSERT ... SELECT` inside one transaction.
+#   - Archived orders are included, matching the incremental maintenance.
+def rebuild_user_order_stats(db: Session) -> int:
+    db.execute(delete(UserOrderStats))
+    all_orders = union_all(
+        select(Order.user_id, Order.total_price, Order.created_at),
+        select(
+            ArchivedOrder.user_id, ArchivedOrder.total_price, ArchivedOrder.created_at
+        ),
+    ).subquery()
+    aggregates = select(
+        all_orders.c.user_id,
+        func.count(),
+        func.coalesce(func.sum(all_orders.c.total_price), 0.0),
+        func.max(all_orders.c.created_at),
+    ).group_by(all_orders.c.user_id)
+    result = db.execute(
+        insert(UserOrderStats).from_select(
+            ["user_id", "order_count", "lifetime_total", "last_order_at"],
+            aggregates,
+        )
     )
+    db.commit()
+    return result.rowcount
@@ -1,8 +1,8 @@
-from db.models import Product, ProductImage
+from db.models import Product, ProductImage, ProductStats
 from schema.product import ProductCreate
 import os
 from fastapi import UploadFile, HTTPException
-from typing import List
+from typing import List, Optional
 import shutil
 from db.session import db_dependency
 from PIL import Image
@@ -166,6 +166,9 @@ def create_product(
     )
 
     db.add(db_product)
+    db.flush()
+    # Every product has a stats row so the popularity sorts can use an inner join
+    db.add(ProductStats(product_id=db_product.id))
     db.commit()
     db.refresh(db_product)
     return db_product
@@ -177,12 +180,27 @@ def create_product(
 #   - `db (db_dependency)`: Database session.
 #   - `skip (int)`: Number of products to skip (default: 0).
 #   - `limit (int)`: Maximum number of products to return (default: 10).
+#   - `sort (str)`: Optional ranking, "popular" (units sold, then views) or "trending".
 # - Returns:
 #   - `List[Product]`: List of products.
+# - Details:
+#   - The rankings read `product_stats` through the `ix_product_stats_popular`
+#     and `ix_product_stats_trending` indexes.
 def get_all_products(
-    db: db_dependency, skip: int = 0, limit: int = 10
+    db: db_dependency, skip: int = 0, limit: int = 10, sort: Optional[str] = None
 ) -> List[Product]:
-    products = db.query(Product).offset(skip).limit(limit).all()
+    query = db.query(Product)
+    if sort == "popular":
+        query = query.join(ProductStats).order_by(
+            ProductStats.units_sold.desc(),
+            ProductStats.view_count.desc(),
+            ProductStats.product_id,
+        )
+    elif sort == "trending":
+        query = query.join(ProductStats).order_by(
+            ProductStats.trending_score.desc(), ProductStats.product_id
+        )
+    products = query.offset(skip).limit(limit).all()
     return products
 
 
@@ -234,6 +252,7 @@ def delete_product_by_id(db: db_dependency, product_id: int):
     product = db.query(Product).filter(Product.id == product_id).first()
     if not product:
         return None
+    db.query(ProductStats).filter(ProductStats.product_id == product_id).delete()
     db.delete(product)
     db.commit()
     return product
@@ -0,0 +1,311 @@
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+from pydantic import ValidationError
+from sqlalchemy import insert, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from core.hashing import pwd_context
+from db.models import OutboxEvent, Role, User
+from schema.user import UserCreate
+
+# Records validated, hashed and inserted together
+PROVISION_BATCH_SIZE = 500
+# Rejected records listed in the summary; the rest are only counted
+PROVISION_MAX_REPORTED = 100
+# Processes hashing provisioned passwords
+PROVISION_WORKERS = int(os.getenv("PROVISION_WORKERS", str(os.cpu_count() or 1)))
+
+_hash_pool: Optional[ProcessPoolExecutor] = None
+_hash_pool_pid: Optional[int] = None
+_hash_pool_lock = threading.Lock()
+
+
+# Runs in the worker processes; must be importable at module level
+def _hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+# GET HASH POOL
+# - Returns this process's password hashing pool, starting it on first use.
+# - Details:
+#   - Workers are started with forkserver (spawn where unavailable): forking a
+#     server process that runs threads could copy a lock held by another
+#     thread into the child.
+#   - A process forked after the pool started gets a pool of its own.
+def get_hash_pool(workers: int = PROVISION_WORKERS) -> ProcessPoolExecutor:
+    global _hash_pool, _hash_pool_pid
+    with _hash_pool_lock:
+        if _hash_pool is None or _hash_pool_pid != os.getpid():
+            methods = multiprocessing.get_all_start_methods()
+            method = "forkserver" if "forkserver" in methods else "spawn"
+            _hash_pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context(method)
+            )
+            _hash_pool_pid = os.getpid()
+        return _hash_pool
+
+
+# SHUTDOWN HASH POOL
+# - Waits for running hashes and stops the hashing processes, if started.
+def shutdown_hash_pool():
+    global _hash_pool
+    with _hash_pool_lock:
+        pool, _hash_pool = _hash_pool, None
+    if pool is not None and _hash_pool_pid == os.getpid():
+        pool.shutdown()
+
+
+# PARSE RECORD LINE
+# - Decodes one NDJSON line; undecodable lines are returned as-is and
+#   reported as invalid by the provisioner.
+def parse_record_line(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return line
+
+
+# ITERATE NDJSON RECORDS
+# - Yields the records of an NDJSON byte stream, such as a request body.
+async def iter_ndjson_records(chunks: AsyncIterator[bytes]):
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield parse_record_line(line)
+    if pending.strip():
+        yield parse_record_line(pending)
+
+
+# ---------------------------
+# User Provisioning
+# ---------------------------
+
+
+# USER PROVISIONER
+# - Creates users in bulk from a stream of records.
+# - Parameters:
+#   - `db (Session)`: Database session; each batch is committed on its own.
+#   - `send_verification (bool)`: Queue a verification email per new user.
+#   - `workers (int)`: Hashing processes, used when the process-wide pool is
+#     first started (default: `PROVISION_WORKERS`).
+# - Details:
+#   - Records are validated with the `UserCreate` schema. Usernames and emails
+#     are checked with one query per batch and against the records seen
+#     earlier in the stream; duplicates are skipped and reported.
+#   - Passwords are hashed across the process-wide pool from `get_hash_pool`,
+#     so bcrypt runs on every core without a pool start-up per request.
+#   - Each batch is one multi-row `INSERT ... RETURNING` plus one insert of
+#     "email.verification" outbox events, delivered later by the dispatcher.
+#   - A name taken by a concurrent signup after the check fails the insert;
+#     the batch is then re-checked and retried without the taken rows.
+class UserProvisioner:
+    def __init__(
+        self,
+        db: Session,
+        send_verification: bool = True,
+        workers: Optional[int] = None,
+    ):
+        self.db = db
+        self.send_verification = send_verification
+        self.workers = workers or PROVISION_WORKERS
+        self._usernames = set()
+        self._emails = set()
+        self.created = 0
+        self.skipped = 0
+        self.invalid = 0
+        self.rejected: List[dict] = []
+        self._line = 0
+
+    # PROVISION
+    # - Provisions every record of `records`, batch by batch.
+    def provision(self, records: Iterable[dict]) -> dict:
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= PROVISION_BATCH_SIZE:
+                self.provision_batch(batch)
+                batch = []
+        if batch:
+            self.provision_batch(batch)
+        return self.summary()
+
+    # PROVISION BATCH
+    # - Validates, de-duplicates, hashes and inserts one batch of records.
+    # - Returns:
+    #   - (int): The number of users created.
+    def provision_batch(self, records: List[dict]) -> int:
+        candidates = []
+        for record in records:
+            self._line += 1
+            if not isinstance(record, dict):
+                self._invalid({}, "not a JSON object")
+                continue
+            try:
+                user = UserCreate.model_validate(record)
+            except ValidationError as e:
+                error = e.errors()[0]
+                field = ".".join(str(part) for part in error["loc"])
+                self._invalid(record, f"{field}: {error['msg']}")
+                continue
+            try:
+                role = Role(user.role)
+            except ValueError:
+                self._invalid(record, f"role: unknown role {user.role!r}")
+                continue
+            candidates.append((self._line, user, role))
+        candidates = self._unique(candidates)
+        if not candidates:
+            return 0
+
+        hashes = list(
+            get_hash_pool(self.workers).map(
+                _hash_password,
+                [user.password for _, user, _ in candidates],
+                chunksize=max(1, len(candidates) // (self.workers * 4)),
+            )
+        )
+        now = datetime.now()
+        rows = [
+            {
+                "username": user.username,
+                "email": user.email,
+                "phone_number": user.phone_number,
+                "full_name": user.full_name,
+                "hashed_password": hashed,
+                "role": role,
+                "is_active": True,
+                "created_at": now,
+            }
+            for (_, user, role), hashed in zip(candidates, hashes)
+        ]
+        created = self._insert_unique([line for line, _, _ in candidates], rows)
+        self.created += created
+        return created
+
+    # Inserts `rows`, dropping the ones a concurrent signup took after the
+    # check, until the insert succeeds or no row is left
+    def _insert_unique(self, lines: List[int], rows: List[dict]) -> int:
+        while rows:
+            try:
+                return self._insert(rows)
+            except IntegrityError:
+                self.db.rollback()
+                taken = self._taken(rows)
+                kept_lines, kept_rows = [], []
+                for line, row in zip(lines, rows):
+                    reason = self._conflict(row, taken)
+                    if reason:
+                        self.skipped += 1
+                        self._reject(row, reason, line)
+                    else:
+                        kept_lines.append(line)
+                        kept_rows.append(row)
+                if len(kept_rows) == len(rows):
+                    # Not a taken name; retrying would fail the same way
+                    raise
+                lines, rows = kept_lines, kept_rows
+        return 0
+
+    def _insert(self, rows: List[dict]) -> int:
+        user_ids = (
+            self.db.execute(insert(User).returning(User.id), rows).scalars().all()
+        )
+        if self.send_verification:
+            now = datetime.utcnow()
+            self.db.execute(
+                insert(OutboxEvent),
+                [
+                    {
+                        "topic": "email.verification",
+                        "payload": {"user_id": user_id},
+                        "status": "pending",
+                        "attempts": 0,
+                        "available_at": now,
+                    }
+                    for user_id in user_ids
+                ],
+            )
+        self.db.commit()
+        return len(user_ids)
+
+    # Drops records whose username or email is taken or repeated in the stream
+    def _unique(self, candidates):
+        if not candidates:
+            return []
+        taken = self._taken(
+            [
+                {"username": user.username, "email": user.email}
+                for _, user, _ in candidates
+            ]
+        )
+        unique = []
+        for line, user, role in candidates:
+            row = {"username": user.username, "email": user.email}
+            reason = self._conflict(row, taken)
+            if reason is None and user.username in self._usernames:
+                reason = "username repeated in input"
+            elif reason is None and user.email in self._emails:
+                reason = "email repeated in input"
+            if reason:
+                self.skipped += 1
+                self._reject(row, reason, line)
+                continue
+            self._usernames.add(user.username)
+            self._emails.add(user.email)
+            unique.append((line, user, role))
+        return unique
+
+    # Returns the usernames and emails of `rows` that already exist
+    def _taken(self, rows: List[dict]) -> Dict[str, set]:
+        usernames = [row["username"] for row in rows]
+        emails = [row["email"] for row in rows]
+        existing = self.db.execute(
+            select(User.username, User.email).where(
+                or_(User.username.in_(usernames), User.email.in_(emails))
+            )
+        ).all()
+        return {
+            "username": {username for username, _ in existing},
+            "email": {email for _, email in existing},
+        }
+
+    @staticmethod
+    def _conflict(row: dict, taken: Dict[str, set]) -> Optional[str]:
+        if row["username"] in taken["username"]:
+            return "Username already taken"
+        if row["email"] in taken["email"]:
+            return "Email already registered"
+        return None
+
+    def _invalid(self, record: dict, reason: str):
+        self.invalid += 1
+        self._reject(record, reason)
+
+    def _reject(self, record: dict, reason: str, line: Optional[int] = None):
+        if len(self.rejected) < PROVISION_MAX_REPORTED:
+            self.rejected.append(
+                {
+                    "line": line or self._line,
+                    "username": record.get("username"),
+                    "email": record.get("email"),
+                    "reason": reason,
+                }
+            )
+
+    # SUMMARY
+    # - Returns the counts so far and the first rejected records.
+    def summary(self) -> dict:
+        return {
+            "created": self.created,
+            "skipped": self.skipped,
+            "invalid": self.invalid,
+            "rejected": sorted(self.rejected, key=lambda record: record["line"]),
+        }
@@ -0,0 +1,474 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import delete, func, select, union_all
+from sqlalchemy.orm import Session
+from db.models import (
+    Order,
+    OrderStatus,
+    Payment,
+    Product,
+    ArchivedOrder,
+    ArchivedPayment,
+    OrderStatusRollup,
+    RevenueRollup,
+    ProductSalesRollup,
+    order_product_association,
+    order_product_archive,
+)
+from db.upsert import upsert_increment
+
+# Bucket sizes every rollup is maintained at
+ROLLUP_GRAINS = ("hour", "day")
+
+# Rows per round trip when rebuilding from the order tables
+REBUILD_CHUNK_SIZE = 5000
+
+
+# ---------------------------
+# Rollup Helpers
+# ---------------------------
+
+
+# BUCKET START
+# - Truncates a timestamp to the start of its rollup bucket.
+# - Parameters:
+#   - `moment (datetime)`: The timestamp to truncate.
+#   - `grain (str)`: "hour" or "day".
+# - Returns:
+#   - `datetime`: The start of the bucket containing `moment`.
+def bucket_start(moment: datetime, grain: str) -> datetime:
+    if grain == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _status_rows(moment: datetime, status: OrderStatus, count: int, value: float):
+    return [
+        {
+            "grain": grain,
+            "bucket_start": bucket_start(moment, grain),
+            "status": status,
+            "order_count": count,
+            "order_value": value,
+        }
+        for grain in ROLLUP_GRAINS
+    ]
+
+
+def _product_rows(moment: datetime, products: Iterable[Product], sign: int = 1):
+    units: Dict[int, List[float]] = defaultdict(lambda: [0, 0.0])
+    for product in products:
+        units[product.id][0] += sign
+        units[product.id][1] += sign * product.price
+    return [
+        {
+            "grain": grain,
+            "bucket_start": bucket_start(moment, grain),
+            "product_id": product_id,
+            "units": count,
+            "revenue": revenue,
+        }
+        for grain in ROLLUP_GRAINS
+        for product_id, (count, revenue) in units.items()
+    ]
+
+
+def _status_key(row: Dict):
+    status = row["status"]
+    return row["grain"], row["bucket_start"], getattr(status, "value", status)
+
+
+# Rows are written in key order, so concurrent writers lock buckets in the same
+# order and cannot deadlock each other
+def _upsert_status(db: Session, rows: List[Dict]):
+    upsert_increment(
+        db,
+        OrderStatusRollup,
+        sorted(rows, key=_status_key),
+        ("grain", "bucket_start", "status"),
+        ("order_count", "order_value"),
+    )
+
+
+def _upsert_products(db: Session, rows: List[Dict]):
+    upsert_increment(
+        db,
+        ProductSalesRollup,
+        sorted(
+            rows,
+            key=lambda row: (row["grain"], row["bucket_start"], row["product_id"]),
+        ),
+        ("grain", "bucket_start", "product_id"),
+        ("units", "revenue"),
+    )
+
+
+def _upsert_revenue(db: Session, rows: List[Dict]):
+    upsert_increment(
+        db,
+        RevenueRollup,
+        rows,
+        ("grain", "bucket_start"),
+        ("payment_count", "revenue"),
+    )
+
+
+# ---------------------------
+# Incremental Maintenance
+# ---------------------------
+# Each function adds a delta inside the caller's transaction and commits
+# nothing, so the rollups change atomically with the order or payment.
+# Orders are bucketed by creation time and payments by payment time.
+
+
+# RECORD ORDER CREATED
+# - Counts a new order under its status and the units of each of its products.
+# - Parameters:
+#   - `db (Session)`: Database session.
+#   - `order (Order)`: The new order, with `created_at` and `products` set.
+def record_order_created(db: Session, order: Order):
+    status = order.status or OrderStatus.PENDING
+    _upsert_status(db, _status_rows(order.created_at, status, 1, order.total_price))
+    _upsert_products(db, _product_rows(order.created_at, order.products))
+
+
+# RECORD PRODUCT ADDED
+# - Counts a product added to an existing order.
+# - Parameters:
+#   - `db (Session)`: Database session.
+#   - `order (Order)`: The order the product was added to.
+#   - `product (Product)`: The added product.
+def record_product_added(db: Session, order: Order, product: Product):
+    _upsert_status(db, _status_rows(order.created_at, order.status, 0, product.price))
+    _upsert_products(db, _product_rows(order.created_at, [product]))
+
+
+# RECORD ORDER CHANGE
+# - Moves an order's count and value after its status and/or total changed.
+# - Parameters:
+#   - `db (Session)`: Database session.
+#   - `created_at (datetime)`: Creation time of the order.
+#   - `old_status (OrderStatus)`: Status before the change.
+#   - `old_total (float)`: Total before the change.
+#   - `new_status (OrderStatus)`: Status after the change.
+#   - `new_total (float)`: Total after the change.
+def record_order_change(
+    db: Session,
+    created_at: datetime,
+    old_status: OrderStatus,
+    old_total: float,
+    new_status: OrderStatus,
+    new_total: float,
+):
+    if old_status == new_status:
+        if old_total != new_total:
+            _upsert_status(
+                db, _status_rows(created_at, new_status, 0, new_total - old_total)
+            )
+        return
+    _upsert_status(
+        db,
+        _status_rows(created_at, old_status, -1, -old_total)
+        + _status_rows(created_at, new_status, 1, new_total),
+    )
+
+
+# RECORD STATUS CHANGES
+# - Moves many orders to `new_status` with a single upsert.
+# - Parameters:
+#   - `db (Session)`: Database session.
+#   - `changes (Iterable[tuple])`: `(created_at, old_status, total)` per order.
+#   - `new_status (OrderStatus)`: Status the orders moved to.
+# - Details:
+#   - Deltas are summed per bucket and status first, so a bulk transition
+#     writes each rollup row once however many orders it covers.
+def record_status_changes(
+    db: Session, changes: Iterable[tuple], new_status: OrderStatus
+):
+    deltas: Dict[tuple, List[float]] = defaultdict(lambda: [0, 0.0])
+    for created_at, old_status, total in changes:
+        if old_status == new_status:
+            continue
+        for grain in ROLLUP_GRAINS:
+            start = bucket_start(created_at, grain)
+            deltas[(grain, start, old_status)][0] -= 1
+            deltas[(grain, start, old_status)][1] -= total
+            deltas[(grain, start, new_status)][0] += 1
+            deltas[(grain, start, new_status)][1] += total
+    _upsert_status(
+        db,
+        [
+            {
+                "grain": grain,
+                "bucket_start": start,
+                "status": status,
+                "order_count": count,
+                "order_value": value,
+            }
+            for (grain, start, status), (count, value) in deltas.items()
+        ],
+    )
+
+
+# RECORD ORDER DELETED
+# - Removes a deleted order and its product units from the rollups.
+# - Parameters:
+#   - `db (Session)`: Database session.
+#   - `order (Order)`: The order being deleted, before the delete is flushed.
+def record_order_deleted(db: Session, order: Order):
+    _upsert_status(
+        db, _status_rows(order.created_at, order.status, -1, -order.total_price)
+    )
+    _upsert_products(db, _product_rows(order.created_at, order.products, sign=-1))
+
+
+# RECORD PAYMENT
+# - Counts a payment that has just become successful.
+# - Parameters:
+#   - `db (Session)`: Database session.
+#   - `paid_at (datetime)`: When the payment was made.
+#   - `amount (float)`: The amount paid.
+def record_payment(db: Session, paid_at: datetime, amount: float):
+    _upsert_revenue(
+        db,
+        [
+            {
+                "grain": grain,
+                "bucket_start": bucket_start(paid_at, grain),
+                "payment_count": 1,
+                "revenue": amount,
+            }
+            for grain in ROLLUP_GRAINS
+        ],
+    )
+
+
+# ---------------------------
+# Rollup Rebuild
+# ---------------------------
+
+
+def _stream(db: Session, statement):
+    return db.execute(
+        statement.execution_options(stream_results=True, yield_per=REBUILD_CHUNK_SIZE)
+    )
+
+
+# REBUILD ROLLUPS
+# - Recomputes every rollup table from the order and payment tables.
+# - Parameters:
+#   - `db (Session)`: Database session.
+# - Returns:
+#   - `Dict[str, int]`: Number of rows written per rollup table.
+# - Details:
+#   - Used to backfill existing data or repair drift. Source rows are streamed
+#     with a server-side cursor and bucketed in Python, which keeps the
+#     bucketing identical to the incremental path on every database.
+#   - Archived orders and payments are included.
+#   - Product revenue uses current product prices, since line items do not
+#     record the price paid.
+def rebuild_rollups(db: Session) -> Dict[str, int]:
+    statuses: Dict[tuple, List[float]] = defaultdict(lambda: [0, 0.0])
+    orders = union_all(
+        select(Order.created_at, Order.status, Order.total_price),
+        select(
+            ArchivedOrder.created_at, ArchivedOrder.status, ArchivedOrder.total_price
+        ),
+    )
+    for created_at, status, total_price in _stream(db, orders):
+        for grain in ROLLUP_GRAINS:
+            entry = statuses[(grain, bucket_start(created_at, grain), status)]
+            entry[0] += 1
+            entry[1] += total_price or 0.0
+
+    products: Dict[tuple, List[float]] = defaultdict(lambda: [0, 0.0])
+    line_items = union_all(
+        select(Order.created_at, Product.id, Product.price)
+        .join(order_product_association, order_product_association.c.order_id == Order.id)
+        .join(Product, Product.id == order_product_association.c.product_id),
+        select(order_product_archive.c.order_created_at, Product.id, Product.price).join(
+            Product, Product.id == order_product_archive.c.product_id
+        ),
+    )
+    for created_at, product_id, price in _stream(db, line_items):
+        for grain in ROLLUP_GRAINS:
+            entry = products[(grain, bucket_start(created_at, grain), product_id)]
+            entry[0] += 1
+            entry[1] += price
+
+    revenue: Dict[tuple, List[float]] = defaultdict(lambda: [0, 0.0])
+    payments = union_all(
+        select(func.coalesce(Payment.paid_at, Payment.created_at), Payment.amount).where(
+            Payment.status == "success"
+        ),
+        select(
+            func.coalesce(ArchivedPayment.paid_at, ArchivedPayment.created_at),
+            ArchivedPayment.amount,
+        ).where(ArchivedPayment.status == "success"),
+    )
+    for paid_at, amount in _stream(db, payments):
+        for grain in ROLLUP_GRAINS:
+            entry = revenue[(grain, bucket_start(paid_at, grain))]
+            entry[0] += 1
+            entry[1] += amount
+
+    for model in (OrderStatusRollup, ProductSalesRollup, RevenueRollup):
+        db.execute(delete(model))
+    _bulk_insert(
+        db,
+        OrderStatusRollup,
+        [
+            {
+                "grain": grain,
+                "bucket_start": start,
+                "status": status,
+                "order_count": count,
+                "order_value": value,
+            }
+            for (grain, start, status), (count, value) in statuses.items()
+        ],
+    )
+    _bulk_insert(
+        db,
+        ProductSalesRollup,
+        [
+            {
+                "grain": grain,
+                "bucket_start": start,
+                "product_id": product_id,
+                "units": count,
+                "revenue": value,
+            }
+            for (grain, start, product_id), (count, value) in products.items()
+        ],
+    )
+    _bulk_insert(
+        db,
+        RevenueRollup,
+        [
+            {
+                "grain": grain,
+                "bucket_start": start,
+                "payment_count": count,
+                "revenue": value,
+            }
+            for (grain, start), (count, value) in revenue.items()
+        ],
+    )
+    db.commit()
+    return {
+        "order_status_rollups": len(statuses),
+        "product_sales_rollups": len(products),
+        "revenue_rollups": len(revenue),
+    }
+
+
+def _bulk_insert(db: Session, model, rows: List[Dict]):
+    for offset in range(0, len(rows), REBUILD_CHUNK_SIZE):
+        db.execute(model.__table__.insert(), rows[offset : offset + REBUILD_CHUNK_SIZE])
+
+
+# ---------------------------
+# Rollup Reports
+# ---------------------------
+
+
+def _in_range(statement, model, grain: str, start: Optional[datetime], end: Optional[datetime]):
+    statement = statement.where(model.grain == grain)
+    if start is not None:
+        statement = statement.where(model.bucket_start >= bucket_start(start, grain))
+    if end is not None:
+        statement = statement.where(model.bucket_start < end)
+    return statement
+
+
+# GET REVENUE SERIES
+# - Returns successful payment counts and revenue per bucket.
+# - Parameters:
+#   - `db (Session)`: Database session.
+#   - `grain (str)`: "hour" or "day".
+#   - `start (datetime)`: Include the bucket containing this time and later ones.
+#   - `end (datetime)`: Include buckets starting before this time.
+# - Returns:
+#   - `List[dict]`: `{bucket_start, payment_count, revenue}` in time order.
+def get_revenue_series(
+    db: Session, grain: str, start: Optional[datetime] = None, end: Optional[datetime] = None
+) -> List[Dict]:
+    statement = _in_range(
+        select(RevenueRollup.bucket_start, RevenueRollup.payment_count, RevenueRollup.revenue),
+        RevenueRollup,
+        grain,
+        start,
+        end,
+    ).order_by(RevenueRollup.bucket_start)
+    return [dict(row) for row in db.execute(statement).mappings()]
+
+
+# GET ORDERS BY STATUS SERIES
+# - Returns order counts and values per bucket and current status.
+# - Parameters:
+#   - `db (Session)`: Database session.
+#   - `grain (str)`: "hour" or "day".
+#   - `start (datetime)`: Include the bucket containing this time and later ones.
+#   - `end (datetime)`: Include buckets starting before this time.
+# - Returns:
+#   - `List[dict]`: `{bucket_start, status, order_count, order_value}` in time order.
+def get_orders_by_status_series(
+    db: Session, grain: str, start: Optional[datetime] = None, end: Optional[datetime] = None
+) -> List[Dict]:
+    statement = (
+        _in_range(
+            select(
+                OrderStatusRollup.bucket_start,
+                OrderStatusRollup.status,
+                OrderStatusRollup.order_count,
+                OrderStatusRollup.order_value,
+            ),
+            OrderStatusRollup,
+            grain,
+            start,
+            end,
+        )
+        .where(OrderStatusRollup.order_count != 0)
+        .order_by(OrderStatusRollup.bucket_start, OrderStatusRollup.status)
+    )
+    return [dict(row) for row in db.execute(statement).mappings()]
+
+
+# GET TOP PRODUCTS
+# - Returns the products with the most units ordered in a time range.
+# - Parameters:
+#   - `db (Session)`: Database session.
+#   - `grain (str)`: Rollup to read; "day" scans fewer rows for long ranges.
+#   - `start (datetime)`: Include the bucket containing this time and later ones.
+#   - `end (datetime)`: Include buckets starting before this time.
+#   - `limit (int)`: Maximum number of products.
+# - Returns:
+#   - `List[dict]`: `{product_id, units, revenue}`, most units first.
+def get_top_products(
+    db: Session,
+    grain: str = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = 10,
+) -> List[Dict]:
+    units = func.sum(ProductSalesRollup.units).label("units")
+    statement = (
+        _in_range(
+            select(
+                ProductSalesRollup.product_id,
+                units,
+                func.sum(ProductSalesRollup.revenue).label("revenue"),
+            ),
+            ProductSalesRollup,
+            grain,
+            start,
+            end,
+        )
+        .group_by(ProductSalesRollup.product_id)
+        .having(units > 0)
+        .order_by(units.desc(), ProductSalesRollup.product_id)
+        .limit(limit)
+    )
+    return [dict(row) for row in db.execute(statement).mappings()]
@@ -1,19 +1,24 @@
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
 from db.models import User
 from schema.user import UserCreate, UserLogin
 from core.security import (
-    generate_hashed_password,
-    verify_password,
     create_access_token,
+    create_refresh_token,
     ACCESS_TOKEN_EXPIRE_MINUTES,
 )
+from core.hashing import password_hasher
 from datetime import datetime
 from db.session import db_dependency
 from fastapi import HTTPException, status
-from core.mfa import verify_totp_code
+from core.mfa import totp_verifier
+from core.outbox import enqueue_outbox_event
+from core.principal import invalidate_principal
 from schema.token import Token
 from schema.user import UserUpdate
 from datetime import timedelta
+from typing import Optional
 
 
 # ---------------------------
@@ -52,33 +57,81 @@ def get_user_by_email(db: Session, email: str):
 #   - `User`: The newly created user object.
 # - Raises:
 #   - `HTTPException`: If the username or email already exists in the system.
+# - Details:
+#   - Uniqueness is enforced by the constraints on `username` and `email`: the
+#     user is written with a single INSERT that returns the new id (`RETURNING`
+#     on PostgreSQL) and a duplicate-key error is mapped to the matching 400
+#     message.
+#   - The verification email is recorded in the outbox in the same transaction
+#     and delivered in the background by the outbox dispatcher.
+#   - The returned user is detached with its values already loaded, so building
+#     the response needs no further query.
 async def create_user(
     user: UserCreate,
     db: db_dependency,
 ):
-
-    if db.query(User).filter(User.username == user.username).first():
-        raise HTTPException(status_code=400, detail="Username already taken")
-    if db.query(User).filter(User.email == user.email).first():
-        raise HTTPException(status_code=400, detail="Email already registered")
-
     db_user = User(
         username=user.username,
         email=user.email,
         phone_number=user.phone_number,
         full_name=user.full_name,
-        hashed_password=generate_hashed_password(user.password),
+        hashed_password=await password_hasher.hash(user.password),
         role=user.role,
         is_active=True,
         created_at=datetime.now(),
     )
 
     db.add(db_user)
+    try:
+        db.flush()
+    except IntegrityError as e:
+        db.rollback()
+        detail = _duplicate_user_detail(e)
+        if detail is None:
+            raise
+        raise HTTPException(status_code=400, detail=detail)
+    enqueue_outbox_event(db, "email.verification", {"user_id": db_user.id})
+    # A new user has no orders; detach it so the commit does not expire it
+    set_committed_value(db_user, "orders", [])
+    db.expunge(db_user)
     db.commit()
-    db.refresh(db_user)
     return db_user
 
 
+# Signup error messages for the unique columns of `users`
+DUPLICATE_USER_DETAILS = {
+    "email": "Email already registered",
+    "username": "Username already taken",
+}
+# PostgreSQL names of the unique constraint / index behind each column
+USER_UNIQUE_CONSTRAINTS = {
+    "users_email_key": "email",
+    "ix_users_username": "username",
+}
+PG_UNIQUE_VIOLATION = "23505"
+
+
+# Maps a unique violation on `users.email` / `users.username` to the signup
+# error message; returns None for any other integrity error
+def _duplicate_user_detail(error: IntegrityError) -> Optional[str]:
+    diag = getattr(error.orig, "diag", None)
+    if diag is not None:
+        if getattr(error.orig, "pgcode", None) != PG_UNIQUE_VIOLATION:
+            return None
+        column = USER_UNIQUE_CONSTRAINTS.get(diag.constraint_name)
+    else:
+        message = str(error.orig)
+        column = next(
+            (
+                name
+                for name in DUPLICATE_USER_DETAILS
+                if f"UNIQUE constraint failed: users.{name}" in message
+            ),
+            None,
+        )
+    return DUPLICATE_USER_DETAILS.get(column)
+
+
 # LOGIN USER
 # - Authenticates a user and issues an access token.
 # - Parameters:
@@ -90,7 +143,7 @@ async def create_user(
 # - Raises:
 #   - `HTTPException`: If the credentials are invalid or the TOTP code is incorrect.
 # NOTE: ENABLING 2FA IN CASE THERES AN ERROR
-def login_user(
+async def login_user(
     db: db_dependency,
     user_login: UserLogin,  # Login request data
     totp_code: str,
@@ -108,7 +161,9 @@ def login_user(
         )
 
     # Verify password if user exists
-    if not user or not verify_password(user_login.password, user.hashed_password):
+    if not user or not await password_hasher.verify(
+        user_login.password, user.hashed_password
+    ):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials",
@@ -117,14 +172,11 @@ def login_user(
     # Check if 2FA is enabled for the user
     if user.otp_secret:
         # If enabled, verify the provided TOTP code
-        if not verify_totp_code(user.otp_secret, totp_code):
+        if not totp_verifier.verify(user.id, user.otp_secret, totp_code):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid TOTP code",
             )
-    else:
-        # If 2FA is not enabled, skip TOTP verification
-        print("2FA is not enabled for this user. Proceeding without TOTP verification.")
 
     # Generate an access token upon successful login
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -134,7 +186,11 @@ def login_user(
         expires_delta=access_token_expires,
     )
 
-    return Token(access_token=access_token, token_type="bearer")
+    return Token(
+        access_token=access_token,
+        refresh_token=create_refresh_token(user.id, user.email),
+        token_type="bearer",
+    )
 
 
 # UPDATE USER
@@ -154,6 +210,7 @@ def update_user(db: Session, user_id: int, user_update: UserUpdate):
     for field, value in user_update.dict(exclude_unset=True).items():
         setattr(user, field, value)
     db.commit()
+    invalidate_principal(user_id)
     db.refresh(user)
     return user
 
@@ -170,6 +227,7 @@ def delete_user(db: Session, user_id: int):
     if user:
         db.delete(user)
         db.commit()
+        invalidate_principal(user_id)
     return None
 
 
@@ -188,10 +246,11 @@ def delete_user(db: Session, user_id: int):
 #   - `User`: The updated user object with the new password.
 # - Raises:
 #   - `ValueError`: If the user is not found.
-def change_user_password(db: Session, user_id: int, new_password: str):
+async def change_user_password(db: Session, user_id: int, new_password: str):
     user = db.query(User).filter(User.id == user_id).first()
     if user:
-        user.hashed_password = generate_hashed_password(new_password)
+        user.hashed_password = await password_hasher.hash(new_password)
         db.commit()
+        invalidate_principal(user_id)
         db.refresh(user)
     return user
@@ -1,4 +1,5 @@
 from sqlalchemy import (
+    Index,
     Column,
     Integer,
     String,
@@ -8,13 +9,17 @@ from sqlalchemy import (
     Boolean,
     Table,
     JSON,
+    Uuid,
+    and_,
+    DDL,
+    event,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, foreign
 from datetime import datetime
 from db.session import Base
 from sqlalchemy.sql.sqltypes import Enum as SQLAEnum
 from enum import Enum
-import uuid
+from core.ids import new_id
 
 order_product_association = Table(
     "order_product",
@@ -47,6 +52,60 @@ class User(Base):
     # Relationship to orders
     orders = relationship("Order", back_populates="user")
 
+    # Serves keyset scans of active users, such as campaign recipient chunks
+    __table_args__ = (Index("ix_users_active_id", is_active, id),)
+
+
+# USER SEARCH INDEXES
+# Substring search over the contact columns used by the admin user search.
+# PostgreSQL gets pg_trgm GIN indexes, which serve `ILIKE '%term%'` directly.
+# SQLite gets an external-content FTS5 table with the trigram tokenizer, kept in
+# sync with `users` by triggers. Existing databases get them from migration
+# 0002_user_search_indexes.
+USER_SEARCH_COLUMNS = ("email", "username", "full_name", "phone_number")
+
+USER_SEARCH_DDL = {
+    "postgresql": [
+        f"CREATE INDEX IF NOT EXISTS ix_users_{column}_trgm "
+        f"ON users USING gin ({column} gin_trgm_ops)"
+        for column in USER_SEARCH_COLUMNS
+    ],
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS users_search USING fts5("
+        "email, username, full_name, phone_number, "
+        "content='users', content_rowid='id', tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS users_search_ai AFTER INSERT ON users BEGIN "
+        "INSERT INTO users_search(rowid, email, username, full_name, phone_number) "
+        "VALUES (new.id, new.email, new.username, new.full_name, new.phone_number); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS users_search_ad AFTER DELETE ON users BEGIN "
+        "INSERT INTO users_search"
+        "(users_search, rowid, email, username, full_name, phone_number) "
+        "VALUES ('delete', old.id, old.email, old.username, old.full_name, "
+        "old.phone_number); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS users_search_au AFTER UPDATE ON users BEGIN "
+        "INSERT INTO users_search"
+        "(users_search, rowid, email, username, full_name, phone_number) "
+        "VALUES ('delete', old.id, old.email, old.username, old.full_name, "
+        "old.phone_number); "
+        "INSERT INTO users_search(rowid, email, username, full_name, phone_number) "
+        "VALUES (new.id, new.email, new.username, new.full_name, new.phone_number); "
+        "END",
+    ],
+}
+
+event.listen(
+    User.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+for _dialect, _statements in USER_SEARCH_DDL.items():
+    for _statement in _statements:
+        event.listen(
+            User.__table__, "after_create", DDL(_statement).execute_if(dialect=_dialect)
+        )
+
 
 # ORDER MODEL
 class OrderStatus(Enum):
@@ -62,12 +121,13 @@ class Order(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     total_price = Column(Float, nullable=False)
+    # Time-ordered UUIDv7, stored natively where supported (see core.ids)
     reference = Column(
-        String,
+        Uuid(as_uuid=False),
         unique=True,
         index=True,
         nullable=False,
-        default=lambda: str(uuid.uuid4()),
+        default=new_id,
     )
     status = Column(SQLAEnum(OrderStatus), default=OrderStatus.PENDING)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -85,6 +145,12 @@ class Order(Base):
         "User", back_populates="orders"
     )  # Link orders to users (if applicable)
 
+    # Serves per-user lookups and keyset pagination of a user's order history
+    __table_args__ = (
+        Index("ix_orders_user_created_id", user_id, created_at.desc(), id),
+        Index("ix_orders_created_id", created_at, id),
+    )
+
 
 # PRODUCT MODEL
 class Product(Base):
@@ -113,8 +179,8 @@ class ProductImage(Base):
 class Payment(Base):
     __tablename__ = "payments"
 
-    id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
-    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
+    id = Column(Uuid(as_uuid=False), primary_key=True, index=True, default=new_id)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False, index=True)
     reference = Column(String, unique=True, nullable=False)
     amount = Column(Float, nullable=False)
     status = Column(String, default="initialized")
@@ -125,3 +191,266 @@ class Payment(Base):
     order = relationship(
         "Order", back_populates="payments"
     )  # Establish relationship with the Order model
+
+
+# USER ORDER STATS MODEL
+# Per-user order aggregates, maintained transactionally by the order CRUD
+# functions so totals can be read with a primary key lookup.
+class UserOrderStats(Base):
+    __tablename__ = "user_order_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+    lifetime_total = Column(Float, nullable=False, default=0.0)
+    last_order_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# IDEMPOTENCY KEY MODEL
+# Stores the outcome of requests sent with an `Idempotency-Key` header so
+# retries replay the first response instead of repeating the work.
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True)  # "<scope>:<client key>"
+    request_hash = Column(String, nullable=False)
+    status_code = Column(Integer, nullable=True)  # NULL while still processing
+    response_body = Column(JSON, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    # Processing lease, refreshed while the request runs; once it lapses an
+    # unfinished key may be taken over by a retry
+    locked_until = Column(DateTime, nullable=True)
+
+
+# OUTBOX EVENT MODEL
+# Side effects (emails, notifications) recorded in the same transaction as the
+# business change and delivered later by the outbox dispatcher.
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    topic = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending/sent/failed
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+    # Serves the dispatcher's "next due pending events" scan
+    __table_args__ = (Index("ix_outbox_events_status_available", status, available_at),)
+
+
+# ---------------------------
+# Archive Tier
+# ---------------------------
+# Closed orders older than the retention window are moved out of the hot
+# `orders`, `order_product` and `payments` tables into these archive tables.
+# On PostgreSQL they are range-partitioned by creation month (partitions are
+# created by `crud.archive`); on other databases they are plain tables.
+
+order_product_archive = Table(
+    "order_product_archive",
+    Base.metadata,
+    Column("order_id", Integer, primary_key=True),
+    Column("product_id", Integer, ForeignKey("products.id"), primary_key=True),
+    Column("order_created_at", DateTime, primary_key=True),
+    postgresql_partition_by="RANGE (order_created_at)",
+)
+
+
+# ARCHIVED ORDER MODEL
+class ArchivedOrder(Base):
+    __tablename__ = "orders_archive"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    total_price = Column(Float, nullable=False)
+    reference = Column(Uuid(as_uuid=False), nullable=False, index=True)
+    status = Column(SQLAEnum(OrderStatus), nullable=False)
+    created_at = Column(DateTime, primary_key=True)
+    updated_at = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+    products = relationship(
+        "Product",
+        secondary=order_product_archive,
+        primaryjoin=lambda: and_(
+            ArchivedOrder.id == order_product_archive.c.order_id,
+            ArchivedOrder.created_at == order_product_archive.c.order_created_at,
+        ),
+        secondaryjoin=lambda: Product.id == order_product_archive.c.product_id,
+        viewonly=True,
+    )
+    payments = relationship(
+        "ArchivedPayment",
+        primaryjoin=lambda: ArchivedOrder.id == foreign(ArchivedPayment.order_id),
+        viewonly=True,
+    )
+
+    __table_args__ = (
+        Index("ix_orders_archive_user_created", user_id, created_at),
+        Index("ix_orders_archive_created_id", created_at, id),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+
+# ARCHIVED PAYMENT MODEL
+class ArchivedPayment(Base):
+    __tablename__ = "payments_archive"
+    id = Column(Uuid(as_uuid=False), primary_key=True)
+    order_id = Column(Integer, nullable=False, index=True)
+    reference = Column(String, nullable=False, index=True)
+    amount = Column(Float, nullable=False)
+    status = Column(String)
+    paid_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, primary_key=True)
+    updated_at = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = ({"postgresql_partition_by": "RANGE (created_at)"},)
+
+
+# ---------------------------
+# Sales Rollups
+# ---------------------------
+# Hourly and daily aggregates maintained incrementally by the order and payment
+# flows (see crud.rollups) so dashboards never scan the order tables.
+
+
+# ORDER STATUS ROLLUP MODEL
+# Orders created in each bucket, by their current status.
+class OrderStatusRollup(Base):
+    __tablename__ = "order_status_rollups"
+
+    grain = Column(String, primary_key=True)  # "hour" or "day"
+    bucket_start = Column(DateTime, primary_key=True)
+    status = Column(SQLAEnum(OrderStatus), primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+    order_value = Column(Float, nullable=False, default=0.0)
+
+
+# REVENUE ROLLUP MODEL
+# Successful payments in each bucket, by payment time.
+class RevenueRollup(Base):
+    __tablename__ = "revenue_rollups"
+
+    grain = Column(String, primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    payment_count = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
+
+
+# PRODUCT SALES ROLLUP MODEL
+# Units of each product ordered in each bucket, by order time.
+class ProductSalesRollup(Base):
+    __tablename__ = "product_sales_rollups"
+
+    grain = Column(String, primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    product_id = Column(Integer, primary_key=True)
+    units = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
+
+
+# PRODUCT STATS MODEL
+# View and sales counters flushed in batches from core.popularity.
+# `trending_score` is a forward-decayed sum: each event adds
+# exp(lambda * (t - landmark)), so ordering by the stored value equals ordering
+# by the decayed score at any later time without rewriting old rows.
+class ProductStats(Base):
+    __tablename__ = "product_stats"
+
+    product_id = Column(
+        Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True
+    )
+    view_count = Column(Integer, nullable=False, default=0)
+    units_sold = Column(Integer, nullable=False, default=0)
+    trending_score = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index(
+            "ix_product_stats_popular",
+            units_sold.desc(),
+            view_count.desc(),
+            product_id,
+        ),
+        Index("ix_product_stats_trending", trending_score.desc(), product_id),
+    )
+
+
+# REVOKED TOKEN MODEL
+# Refresh tokens that may no longer be used, checked through the in-memory
+# filter in core.revocation. A row revokes either one token (`kind` "token",
+# keyed by its `jti`) or a whole rotation family (`kind` "family", keyed by the
+# family id). Rows are purged once every token they cover has expired.
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+
+    jti = Column(Uuid(as_uuid=False), primary_key=True)
+    kind = Column(String, nullable=False, default="token")
+    user_id = Column(Integer, nullable=True)
+    revoked_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+# THROTTLE COUNTER MODEL
+# Attempts per throttle key and fixed window, shared by all workers when the
+# database throttle backend is enabled. `window_start` is in Unix seconds.
+class ThrottleCounter(Base):
+    __tablename__ = "throttle_counters"
+
+    key = Column(String, primary_key=True)
+    window_start = Column(Integer, primary_key=True, index=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+# ---------------------------
+# Email Campaigns
+# ---------------------------
+
+
+# CAMPAIGN MODEL
+# A bulk email to one user segment, sent by `crud.campaign.CampaignRunner`.
+# `subject` and `body` are `string.Template` texts. `checkpoint_user_id` is the
+# last user id of the last fully processed chunk; a resumed run continues after
+# it. `heartbeat_at` is refreshed at every checkpoint, so a "running" campaign
+# whose runner died can be taken over once it goes stale.
+class Campaign(Base):
+    __tablename__ = "campaigns"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    segment = Column(String, nullable=False)  # see crud.campaign.SEGMENTS
+    subject = Column(String, nullable=False)
+    body = Column(String, nullable=False)
+    subtype = Column(String, nullable=False, default="plain")  # plain/html
+    rate_per_second = Column(Float, nullable=False)
+    # draft/running/paused/completed/failed
+    status = Column(String, nullable=False, default="draft")
+    checkpoint_user_id = Column(Integer, nullable=False, default=0)
+    sent_count = Column(Integer, nullable=False, default=0)
+    failed_count = Column(Integer, nullable=False, default=0)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+
+
+# CAMPAIGN DELIVERY MODEL
+# One row per campaign and recipient, inserted ("claimed") before the message
+# is handed to the mailer, so no user is sent the same campaign twice. A claim
+# left behind by a crashed run is marked "unconfirmed" and not retried.
+class CampaignDelivery(Base):
+    __tablename__ = "campaign_deliveries"
+
+    campaign_id = Column(Integer, ForeignKey("campaigns.id"), primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    # claimed/sent/failed/unconfirmed
+    status = Column(String, nullable=False, default="claimed")
+    error = Column(String, nullable=True)
+    claimed_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
@@ -0,0 +1,89 @@
+from typing import Dict, Iterable, List, Sequence
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+
+
+# ---------------------------
+# Upsert Helpers
+# ---------------------------
+
+
+def _dialect_insert(db: Session, helper: str):
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"{helper} is not supported on {dialect}")
+    return insert
+
+
+# UPSERT INCREMENT
+# - Inserts counter rows, or adds to the existing rows with the same key.
+# - Parameters:
+#   - `db (Session)`: Database session; nothing is committed here.
+#   - `model`: The model class or `Table` to write to.
+#   - `rows (List[dict])`: Rows containing the key, increment and set columns.
+#   - `key_columns (Sequence[str])`: Columns of the primary key / unique constraint.
+#   - `increment_columns (Sequence[str])`: Columns added to on conflict.
+#   - `set_columns (Sequence[str])`: Columns overwritten on conflict.
+#   - `max_columns (Sequence[str])`: Columns keeping the larger of the stored and
+#     new value on conflict; NULL counts as smaller than any value.
+# - Details:
+#   - Runs a single multi-row `INSERT ... ON CONFLICT DO UPDATE`, so concurrent
+#     writers never lose increments and no read round trip is needed.
+#   - Supported on PostgreSQL and SQLite.
+def upsert_increment(
+    db: Session,
+    model,
+    rows: List[Dict],
+    key_columns: Sequence[str],
+    increment_columns: Sequence[str],
+    set_columns: Iterable[str] = (),
+    max_columns: Iterable[str] = (),
+):
+    if not rows:
+        return
+    table = getattr(model, "__table__", model)
+    statement = _dialect_insert(db, "upsert_increment")(table).values(rows)
+    updates = {name: table.c[name] + statement.excluded[name] for name in increment_columns}
+    updates.update({name: statement.excluded[name] for name in set_columns})
+    for name in max_columns:
+        stored, new = table.c[name], statement.excluded[name]
+        updates[name] = case((new > stored, new), else_=func.coalesce(stored, new))
+    db.execute(
+        statement.on_conflict_do_update(index_elements=list(key_columns), set_=updates)
+    )
+
+
+# INSERT MISSING
+# - Inserts the rows whose key does not exist yet and skips the others.
+# - Parameters:
+#   - `db (Session)`: Database session; nothing is committed here.
+#   - `model`: The model class or `Table` to write to.
+#   - `rows (List[dict])`: Rows to insert.
+#   - `key_columns (Sequence[str])`: Columns of the primary key / unique constraint.
+#   - `returning (str)`: Column returned for each inserted row.
+# - Returns:
+#   - (List): The `returning` values of the rows actually inserted.
+# - Details:
+#   - A single multi-row `INSERT ... ON CONFLICT DO NOTHING RETURNING`, so two
+#     writers can never both insert the same key.
+def insert_missing(
+    db: Session,
+    model,
+    rows: List[Dict],
+    key_columns: Sequence[str],
+    returning: str,
+) -> List:
+    if not rows:
+        return []
+    table = getattr(model, "__table__", model)
+    statement = (
+        _dialect_insert(db, "insert_missing")(table)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=list(key_columns))
+        .returning(table.c[returning])
+    )
+    return db.execute(statement).scalars().all()
@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from api.user import router as user_router
@@ -6,10 +7,45 @@ from api.order import router as order_router
 from api.mfa import router as mfa_router
 from api.email import router as email_router
 from api.auth import router as auth_router
+from api.admin_dashboard import router as admin_router
+from api.metrics import router as metrics_router
 from payment.paystack_routers import router as payment_router
 from db.session import Base, engine
+from core.events import event_bus
+from core.outbox import outbox_dispatcher
+from core.analytics import analytics_store
+from core.recommendations import related_products
+from core.popularity import popularity_counters
+from core.hashing import password_hasher
+from core.revocation import revocation_list
+from core.mailer import mailer
+from crud.campaign import campaign_runner
+from crud.provisioning import shutdown_hash_pool
 
-app = FastAPI()
+
+# Start and stop the background services shared by all requests
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    event_bus.start()
+    outbox_dispatcher.start()
+    analytics_store.start()
+    related_products.start()
+    popularity_counters.start()
+    revocation_list.start()
+    yield
+    await campaign_runner.stop()
+    await revocation_list.stop()
+    await popularity_counters.stop()
+    await related_products.stop()
+    await analytics_store.stop()
+    await outbox_dispatcher.stop()
+    await mailer.stop()
+    event_bus.stop()
+    password_hasher.shutdown()
+    shutdown_hash_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Mount the directory as a static route to serve images
 app.mount(
@@ -25,6 +61,8 @@ app.include_router(mfa_router, prefix="/mfa", tags=["mfa"])
 app.include_router(email_router, prefix="/email", tags=["email"])
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
 app.include_router(payment_router, prefix="/payments", tags=["payments"])
+app.include_router(admin_router, tags=["admin"])
+app.include_router(metrics_router, tags=["metrics"])
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import csv
+import json
+import sys
+from datetime import datetime
+from fastapi import HTTPException
+from db.session import Base, SessionLocal, engine
+import db.models  # noqa: F401  (registers the models on Base.metadata)
+from crud.order import rebuild_user_order_stats
+from crud.archive import archive_closed_orders
+from crud.rollups import rebuild_rollups as rebuild_sales_rollups
+from crud.export import stream_order_export
+from crud.provisioning import UserProvisioner, parse_record_line, shutdown_hash_pool
+from crud.campaign import campaign_runner, get_campaign_progress
+from core.mailer import mailer
+from db.models import OrderStatus
+
+
+# ---------------------------
+# Management Commands
+# ---------------------------
+
+
+# REBUILD ORDER STATS
+# - Recomputes the per-user order aggregates from the `orders` table.
+# - Usage:
+#   - `python manage.py rebuild-order-stats`
+def rebuild_order_stats(args):
+    db = SessionLocal()
+    try:
+        rows = rebuild_user_order_stats(db)
+        print(f"Rebuilt order stats for {rows} users.")
+    finally:
+        db.close()
+
+
+# ARCHIVE ORDERS
+# - Moves delivered and canceled orders older than N months into the archive tier.
+# - Usage:
+#   - `python manage.py archive-orders --months 6 --batch-size 500`
+def archive_orders(args):
+    db = SessionLocal()
+    try:
+        count = archive_closed_orders(
+            db, older_than_months=args.months, batch_size=args.batch_size
+        )
+        print(f"Archived {count} orders.")
+    finally:
+        db.close()
+
+
+# REBUILD ROLLUPS
+# - Recomputes the hourly and daily sales rollups from the order and payment tables.
+# - Usage:
+#   - `python manage.py rebuild-rollups`
+def rebuild_rollups(args):
+    db = SessionLocal()
+    try:
+        counts = rebuild_sales_rollups(db)
+        for table, rows in counts.items():
+            print(f"Rebuilt {rows} rows in {table}.")
+    finally:
+        db.close()
+
+
+# EXPORT ORDERS
+# - Writes orders joined with users, line items and payments as gzip-compressed CSV.
+# - Usage:
+#   - `python manage.py export-orders --start 2026-09-01 --end 2026-10-01 -o september.csv.gz`
+#   - `--status delivered --status canceled` limits the statuses.
+#   - `--after-order-id N` resumes after the last order in an interrupted export;
+#     the output is then a separate gzip member that can be appended to the file.
+def export_orders(args):
+    statuses = [OrderStatus(status) for status in args.status] if args.status else None
+    chunks = stream_order_export(
+        args.start, args.end, statuses, args.after_order_id, compress=not args.plain
+    )
+    if args.output == "-":
+        output = sys.stdout.buffer
+    else:
+        output = open(args.output, "ab" if args.after_order_id else "wb")
+    try:
+        for chunk in chunks:
+            output.write(chunk)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+
+
+# PROVISION USERS
+# - Creates users in bulk from an NDJSON or CSV file (header row with the `UserCreate` fields).
+# - Usage:
+#   - `python manage.py provision-users customers.ndjson`
+#   - `python manage.py provision-users customers.csv --no-verification-email --workers 8`
+def provision_users(args):
+    source = sys.stdin if args.path == "-" else open(args.path, newline="")
+    db = SessionLocal()
+    try:
+        if args.path.endswith(".csv"):
+            records = csv.DictReader(source)
+        else:
+            records = (parse_record_line(line) for line in source if line.strip())
+        provisioner = UserProvisioner(
+            db, send_verification=not args.no_verification_email, workers=args.workers
+        )
+        summary = provisioner.provision(records)
+        print(
+            f"Created {summary['created']} users, skipped {summary['skipped']} "
+            f"duplicates, {summary['invalid']} invalid records."
+        )
+        for rejected in summary["rejected"]:
+            print(json.dumps(rejected), file=sys.stderr)
+    finally:
+        db.close()
+        shutdown_hash_pool()
+        if source is not sys.stdin:
+            source.close()
+
+
+# RUN CAMPAIGN
+# - Sends an email campaign in the foreground, resuming after its last checkpoint.
+# - Usage:
+#   - `python manage.py run-campaign 3`
+#   - `python manage.py run-campaign 3 --rate 50` also changes the send rate.
+#   - Ctrl-C pauses the campaign; run the command again to resume it.
+def run_campaign(args):
+    async def run():
+        try:
+            await campaign_runner.run(args.campaign_id, args.rate)
+        finally:
+            await campaign_runner.stop()
+            await mailer.stop()
+
+    try:
+        asyncio.run(run())
+    except HTTPException as e:
+        sys.exit(f"Cannot run campaign {args.campaign_id}: {e.detail}")
+    except KeyboardInterrupt:
+        pass
+    db = SessionLocal()
+    try:
+        progress = get_campaign_progress(db, args.campaign_id)
+        print(
+            f"Campaign {progress['id']} is {progress['status']}: sent {progress['sent']}, "
+            f"failed {progress['failed']}, checkpoint user {progress['checkpoint_user_id']}."
+        )
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="E-commerce maintenance commands.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser(
+        "rebuild-order-stats", help="Backfill or repair per-user order aggregates."
+    ).set_defaults(func=rebuild_order_stats)
+
+    archive = commands.add_parser(
+        "archive-orders", help="Move old closed orders into the archive tier."
+    )
+    archive.add_argument("--months", type=int, default=6)
+    archive.add_argument("--batch-size", type=int, default=500)
+    archive.set_defaults(func=archive_orders)
+
+    commands.add_parser(
+        "rebuild-rollups", help="Backfill or repair the sales rollup tables."
+    ).set_defaults(func=rebuild_rollups)
+
+    export = commands.add_parser(
+        "export-orders", help="Export orders as gzip-compressed CSV."
+    )
+    export.add_argument("--start", type=datetime.fromisoformat)
+    export.add_argument("--end", type=datetime.fromisoformat)
+    export.add_argument(
+        "--status", action="append", choices=[status.value for status in OrderStatus]
+    )
+    export.add_argument("--after-order-id", type=int)
+    export.add_argument("--plain", action="store_true", help="Write uncompressed CSV.")
+    export.add_argument("-o", "--output", default="-")
+    export.set_defaults(func=export_orders)
+
+    provision = commands.add_parser(
+        "provision-users", help="Create users in bulk from an NDJSON or CSV file."
+    )
+    provision.add_argument("path", help="Input file, or - for NDJSON on stdin.")
+    provision.add_argument("--workers", type=int, help="Hashing processes.")
+    provision.add_argument("--no-verification-email", action="store_true")
+    provision.set_defaults(func=provision_users)
+
+    campaign = commands.add_parser(
+        "run-campaign", help="Send or resume an email campaign."
+    )
+    campaign.add_argument("campaign_id", type=int)
+    campaign.add_argument("--rate", type=float, help="Messages per second.")
+    campaign.set_defaults(func=run_campaign)
+
+    args = parser.parse_args()
+    Base.metadata.create_all(bind=engine)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
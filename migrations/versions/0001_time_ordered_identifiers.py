@@ -0,0 +1,69 @@
+"""Store order references and payment ids as native UUIDs
+
+Revision ID: 0001_time_ordered_identifiers
+Revises:
+Create Date: 2026-10-19 00:00:00.000000
+
+New identifiers are time-ordered UUIDv7 values (see core.ids). Existing
+uuid4() strings are valid UUIDs, so they are converted in place and stay
+readable. PostgreSQL gets the native 16-byte `uuid` type; SQLite stores the
+32-character hex form used by SQLAlchemy's `Uuid` type.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001_time_ordered_identifiers"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (table, column) pairs holding order references or payment ids
+UUID_COLUMNS = (
+    ("orders", "reference"),
+    ("payments", "id"),
+    ("orders_archive", "reference"),
+    ("payments_archive", "id"),
+)
+
+
+def _existing_columns():
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+    return [(table, column) for table, column in UUID_COLUMNS if table in tables]
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    for table, column in _existing_columns():
+        if dialect == "postgresql":
+            op.execute(
+                f"ALTER TABLE {table} ALTER COLUMN {column} "
+                f"TYPE uuid USING {column}::uuid"
+            )
+        else:
+            op.execute(
+                f"UPDATE {table} SET {column} = lower(replace({column}, '-', '')) "
+                f"WHERE length({column}) = 36"
+            )
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    for table, column in _existing_columns():
+        if dialect == "postgresql":
+            op.execute(
+                f"ALTER TABLE {table} ALTER COLUMN {column} "
+                f"TYPE varchar USING {column}::text"
+            )
+        else:
+            op.execute(
+                f"UPDATE {table} SET {column} = "
+                f"substr({column}, 1, 8) || '-' || substr({column}, 9, 4) || '-' || "
+                f"substr({column}, 13, 4) || '-' || substr({column}, 17, 4) || '-' || "
+                f"substr({column}, 21, 12) WHERE length({column}) = 32"
+            )
@@ -0,0 +1,48 @@
+"""Add trigram search indexes over user contact columns
+
+Revision ID: 0002_user_search_indexes
+Revises: 0001_time_ordered_identifiers
+Create Date: 2026-10-19 00:00:00.000000
+
+Backs the admin user search. PostgreSQL gets pg_trgm GIN indexes on email,
+username, full_name and phone_number. SQLite gets an external-content FTS5
+table with the trigram tokenizer, kept in sync by triggers and populated from
+the existing rows.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002_user_search_indexes"
+down_revision: Union[str, None] = "0001_time_ordered_identifiers"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+SEARCH_COLUMNS = ("email", "username", "full_name", "phone_number")
+
+
+def upgrade() -> None:
+    from db.models import USER_SEARCH_DDL
+
+    dialect = op.get_bind().dialect.name
+    if dialect == "postgresql":
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for statement in USER_SEARCH_DDL.get(dialect, []):
+        op.execute(statement)
+    if dialect == "sqlite":
+        op.execute("INSERT INTO users_search(users_search) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == "postgresql":
+        for column in SEARCH_COLUMNS:
+            op.execute(f"DROP INDEX IF EXISTS ix_users_{column}_trgm")
+    elif dialect == "sqlite":
+        for trigger in ("users_search_ai", "users_search_ad", "users_search_au"):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS users_search")
@@ -0,0 +1,52 @@
+"""Index orders by creation time and payments by order
+
+Revision ID: 0003_order_export_indexes
+Revises: 0002_user_search_indexes
+Create Date: 2026-10-19 00:00:00.000000
+
+Serves the date-range filter and keyset resume position of the order export,
+and the payments join on order_id.
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0003_order_export_indexes"
+down_revision: Union[str, None] = "0002_user_search_indexes"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (index name, table, columns)
+INDEXES = (
+    ("ix_orders_created_id", "orders", ["created_at", "id"]),
+    ("ix_orders_archive_created_id", "orders_archive", ["created_at", "id"]),
+    ("ix_payments_order_id", "payments", ["order_id"]),
+)
+
+
+def _missing(inspector, name, table):
+    if table not in inspector.get_table_names():
+        return False
+    return name not in {index["name"] for index in inspector.get_indexes(table)}
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    for name, table, columns in INDEXES:
+        if _missing(inspector, name, table):
+            op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    for name, table, _ in INDEXES:
+        if (
+            not _missing(inspector, name, table)
+            and table in inspector.get_table_names()
+        ):
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,41 @@
+"""Index users by active flag and id
+
+Revision ID: 0004_user_active_index
+Revises: 0003_order_export_indexes
+Create Date: 2026-10-19 00:00:00.000000
+
+Serves the keyset scan of active users that feeds email campaigns. The
+campaign tables themselves are new and created by `create_all`.
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0004_user_active_index"
+down_revision: Union[str, None] = "0003_order_export_indexes"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEX_NAME = "ix_users_active_id"
+
+
+def _existing(inspector):
+    if "users" not in inspector.get_table_names():
+        return None
+    return {index["name"] for index in inspector.get_indexes("users")}
+
+
+def upgrade() -> None:
+    existing = _existing(sa.inspect(op.get_bind()))
+    if existing is not None and INDEX_NAME not in existing:
+        op.create_index(INDEX_NAME, "users", ["is_active", "id"])
+
+
+def downgrade() -> None:
+    existing = _existing(sa.inspect(op.get_bind()))
+    if existing is not None and INDEX_NAME in existing:
+        op.drop_index(INDEX_NAME, table_name="users")
@@ -0,0 +1,42 @@
+"""Add a processing lease to idempotency keys
+
+Revision ID: 0005_idempotency_lease
+Revises: 0004_user_active_index
+Create Date: 2026-10-19 00:00:00.000000
+
+Unfinished keys whose lease lapsed belonged to a worker that died
+mid-request and may be taken over by a retry.
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0005_idempotency_lease"
+down_revision: Union[str, None] = "0004_user_active_index"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _columns(inspector):
+    if "idempotency_keys" not in inspector.get_table_names():
+        return None
+    return {column["name"] for column in inspector.get_columns("idempotency_keys")}
+
+
+def upgrade() -> None:
+    columns = _columns(sa.inspect(op.get_bind()))
+    if columns is not None and "locked_until" not in columns:
+        op.add_column(
+            "idempotency_keys", sa.Column("locked_until", sa.DateTime(), nullable=True)
+        )
+
+
+def downgrade() -> None:
+    columns = _columns(sa.inspect(op.get_bind()))
+    if columns is not None and "locked_until" in columns:
+        with op.batch_alter_table("idempotency_keys") as batch_op:
+            batch_op.drop_column("locked_until")
@@ -0,0 +1,53 @@
+"""Index orders by user, newest first
+
+Revision ID: 0006_order_user_history_index
+Revises: 0005_idempotency_lease
+Create Date: 2026-10-19 00:00:00.000000
+
+Serves the keyset-paginated order history of a user and the per-user order
+lookups of the abandoned-cart campaign segment. Replaces the single-column
+user_id index, which the composite index covers.
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0006_order_user_history_index"
+down_revision: Union[str, None] = "0005_idempotency_lease"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEX_NAME = "ix_orders_user_created_id"
+REPLACED_INDEX_NAME = "ix_orders_user_id"
+
+
+def _existing(inspector):
+    if "orders" not in inspector.get_table_names():
+        return None
+    return {index["name"] for index in inspector.get_indexes("orders")}
+
+
+def upgrade() -> None:
+    existing = _existing(sa.inspect(op.get_bind()))
+    if existing is None:
+        return
+    if INDEX_NAME not in existing:
+        op.create_index(
+            INDEX_NAME, "orders", ["user_id", sa.text("created_at DESC"), "id"]
+        )
+    if REPLACED_INDEX_NAME in existing:
+        op.drop_index(REPLACED_INDEX_NAME, table_name="orders")
+
+
+def downgrade() -> None:
+    existing = _existing(sa.inspect(op.get_bind()))
+    if existing is None:
+        return
+    if REPLACED_INDEX_NAME not in existing:
+        op.create_index(REPLACED_INDEX_NAME, "orders", ["user_id"])
+    if INDEX_NAME in existing:
+        op.drop_index(INDEX_NAME, table_name="orders")
@@ -8,9 +8,14 @@ import logging
 import requests
 from db.session import db_dependency
 from db.models import Order, Payment
-from core.email import send_email
+from core.outbox import enqueue_outbox_event, outbox_dispatcher
+from sqlalchemy import or_, update
 from sqlalchemy.orm import Session
 from schema.payment import PaymentInitializationError
+from core.events import publish_order_event
+from crud.order import get_order_by_reference as crud_get_order_by_reference
+from crud.rollups import record_payment
+from datetime import datetime, timezone
 
 
 load_dotenv()
@@ -25,17 +30,18 @@ CALLBACK_URL = os.getenv("PAYSTACK_CALLBACK_URL")
 
 
 # GET ORDER BY REFERENCE
-# - Fetches an order by its reference ID from the database.
+# - Fetches an order by its reference ID from the database, including archived orders.
 # - Parameters:
 #   - `db (Session)`: Database session.
 #   - `reference (str)`: Reference ID of the order to fetch.
+#   - `include_archive (bool)`: Whether to fall back to archived orders (default: True).
 # - Returns:
-#   - `Order`: The order object if found, `None` otherwise.
-def get_order_by_reference(db: Session, reference: str):
+#   - `Order | ArchivedOrder`: The order object if found, `None` otherwise.
+def get_order_by_reference(db: Session, reference: str, include_archive: bool = True):
     """
     Fetch an order by its reference ID.
     """
-    return db.query(Order).filter(Order.reference == reference).first()
+    return crud_get_order_by_reference(db, reference, include_archive=include_archive)
 
 
 # INITIALIZE PAYMENT
@@ -78,6 +84,24 @@ def initialize_payment(order, db: Session):
     return response_data["data"]["authorization_url"]
 
 
+# PARSE PAID AT
+# - Converts Paystack's ISO 8601 `paid_at` (e.g. "2024-01-01T12:00:00.000Z") to a naive UTC datetime.
+# - Parameters:
+#   - `value (str)`: The timestamp from Paystack, or None.
+# - Returns:
+#   - `datetime`: The parsed timestamp, or `None` if missing or malformed.
+def _parse_paid_at(value):
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
 # VERIFY PAYMENT
 # - Verifies a payment using the reference ID by calling the Paystack API.
 # - Parameters:
@@ -98,10 +122,25 @@ def verify_payment(reference: str, db: Session):
     if not payment:
         raise HTTPException(status_code=404, detail="Payment not found")
 
-    payment.status = "success"
-    payment.paid_at = response["data"].get("paid_at")
+    # Only the verification that moves the payment to "success" counts it in the
+    # revenue rollups; a concurrent one (client retry plus webhook) matches no row
+    first_success = (
+        db.execute(
+            update(Payment)
+            .where(
+                Payment.id == payment.id,
+                or_(Payment.status.is_(None), Payment.status != "success"),
+            )
+            .values(status="success")
+        ).rowcount
+        == 1
+    )
+    payment.paid_at = _parse_paid_at(response["data"].get("paid_at"))
     payment.amount = response["data"]["amount"] / 100  # Convert to major currency unit
+    if first_success:
+        record_payment(db, payment.paid_at or datetime.utcnow(), payment.amount)
     db.commit()
+    publish_order_event(payment.order.reference, payment.order.status, "payment_verified")
 
     return response["data"]
 
@@ -142,14 +181,14 @@ def redirect_to_payment_page(payment_url):
 
 
 # HANDLE SUCCESSFUL PAYMENT
-# - Handles the payment confirmation process by updating the order status and sending a confirmation email to the customer.
+# - Handles the payment confirmation process by updating the order status and queueing a confirmation email to the customer.
 # - Parameters:
 #   - `db (db_dependency)`: Database session for handling database operations.
 #   - `payment_data (dict)`: The payment data received from Paystack upon a successful payment.
 # - Returns:
 #   - `dict`: A dictionary indicating the payment status and associated payment data.
 # - Raises:
-#   - `HTTPException`: If an error occurs while updating the order or sending the email.
+#   - `HTTPException`: If an error occurs while updating the order.
 def handle_successful_payment(db: db_dependency, payment_data: dict):
     # Extract data from payment_data
     transaction_reference = payment_data.get("reference")
@@ -159,7 +198,9 @@ def handle_successful_payment(db: db_dependency, payment_data: dict):
 
     # Update Order in Database
     try:
-        order = db.query(Order).filter(Order.reference == transaction_reference).first()
+        order = get_order_by_reference(
+            db, transaction_reference, include_archive=False
+        )
         if order is None:
             raise HTTPException(status_code=404, detail="Order not found")
 
@@ -168,19 +209,19 @@ def handle_successful_payment(db: db_dependency, payment_data: dict):
         order.paid_at = payment_data.get("paid_at")  # Set to payment timestamp
         order.amount_paid = amount / 100  # Convert from kobo to naira, for example
 
+        # Queue the confirmation email in the same transaction as the order update
+        if user_email:
+            enqueue_outbox_event(
+                db,
+                "email.payment_confirmation",
+                {"email": user_email, "amount": amount / 100},
+            )
+
         db.commit()
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error updating order: {str(e)}")
-
-    # Send Confirmation Email to Customer
-    try:
-        email_subject = "Payment Successful - Thank you for your purchase!"
-        email_body = f"Dear customer,\n\nYour payment of NGN{amount / 100} was successful. Your order will be processed shortly.\n\nThank you for shopping with us!"
-
-        send_email(to_address=user_email, subject=email_subject, body=email_body)
-    except Exception as e:
-        # Log or handle email sending failure (optional)
-        print(f"Error sending confirmation email: {str(e)}")
+    publish_order_event(order.reference, order.status, "payment_succeeded")
+    outbox_dispatcher.wake()
 
     return {"status": "success", "payment_data": payment_data}
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, Request, Depends
+from fastapi import APIRouter, HTTPException, Request, Depends, Header
 from fastapi.responses import JSONResponse
 from payment.paystack_crud import (
     initialize_payment,
@@ -17,6 +17,8 @@ import hmac
 import hashlib
 import json
 from core.rbac import has_role
+from core.idempotency import run_idempotent, hash_request
+from typing import Optional
 
 
 router = APIRouter()
@@ -37,6 +39,8 @@ PAYLOAD = '{"event": "charge.success", "data": {"reference": "test_reference", "
 # - Parameters:
 #   - `order_reference (str)`: The reference ID of the order.
 #   - `db (db_dependency)`: The database session.
+#   - `idempotency_key (str)`: Optional `Idempotency-Key` header; retries with the same key replay the first response
+#     instead of calling Paystack and inserting another payment.
 # - Returns:
 #   - A dictionary with a "status" key and the Paystack payment URL for the user to complete the payment.
 # - Raises:
@@ -47,23 +51,36 @@ PAYLOAD = '{"event": "charge.success", "data": {"reference": "test_reference", "
     "/initialize-payment/",
     dependencies=[Depends(has_role(["admin", "user", "vendor"]))],
 )
-async def initialize_payment_endpoint(order_reference: str, db: db_dependency):
-    # Retrieve the order using the order reference
-    order = db.query(Order).filter(Order.reference == order_reference).first()
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-
-    if not order.total_price or order.total_price <= 0:
-        raise HTTPException(status_code=400, detail="Invalid order total price")
-
-    try:
-        # Initialize payment and save to the database
-        payment_url = initialize_payment(order, db)
-        return {"status": "success", "payment_url": payment_url}
-    except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"Payment initialization failed: {str(e)}"
-        )
+async def initialize_payment_endpoint(
+    order_reference: str,
+    db: db_dependency,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    def work():
+        # Retrieve the order using the order reference
+        order = get_order_by_reference(db, order_reference, include_archive=False)
+        if not order:
+            raise HTTPException(status_code=404, detail="Order not found")
+
+        if not order.total_price or order.total_price <= 0:
+            raise HTTPException(status_code=400, detail="Invalid order total price")
+
+        try:
+            # Initialize payment and save to the database
+            payment_url = initialize_payment(order, db)
+            return {"status": "success", "payment_url": payment_url}
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Payment initialization failed: {str(e)}"
+            )
+
+    return await run_idempotent(
+        db,
+        idempotency_key,
+        scope=f"payment:initialize:{order_reference}",
+        request_hash=hash_request(order_reference),
+        work=work,
+    )
 
 
 # VERIFY PAYMENT ENDPOINT
@@ -0,0 +1,19 @@
+from pydantic import BaseModel, Field
+from typing import Literal, Optional
+
+
+# Schema for creating an email campaign
+# `subject` and `body` are `string.Template` texts, e.g. "Hi $first_name";
+# the placeholders available depend on the segment (see crud.campaign.SEGMENTS).
+class CampaignCreate(BaseModel):
+    name: str = Field(..., max_length=200)
+    segment: Literal["all_active", "abandoned_cart"]
+    subject: str = Field(..., max_length=200)
+    body: str
+    subtype: Literal["plain", "html"] = "plain"
+    rate_per_second: Optional[float] = Field(None, gt=0, le=1000)
+
+
+# Schema for starting or resuming a campaign
+class CampaignStart(BaseModel):
+    rate_per_second: Optional[float] = Field(None, gt=0, le=1000)
@@ -1,7 +1,8 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import datetime
 from schema.product import ProductResponse
+from db.models import OrderStatus
 
 
 # Shared properties for Order
@@ -31,9 +32,34 @@ class OrderResponse(BaseModel):
     products: List[ProductResponse]
 
 
+class OrderHistoryItem(OrderResponse):
+    status: OrderStatus
+
+    class Config:
+        from_attributes = True
+
+
+class OrderHistoryPage(BaseModel):
+    orders: List[OrderHistoryItem]
+    next_cursor: Optional[str] = None
+
+
+class BulkOrderStatusUpdate(BaseModel):
+    references: List[str] = Field(..., min_length=1, max_length=1000)
+    status: OrderStatus
+
+
+class BulkOrderStatusResult(BaseModel):
+    status: OrderStatus
+    updated: List[str]
+    rejected: List[str]
+
+
 class OrderTotalResponse(BaseModel):
     user_id: int
     total_price: float
+    order_count: int = 0
+    last_order_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
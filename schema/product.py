@@ -15,6 +15,12 @@ class ProductResponse(ProductCreate):
     id: int
 
 
+class RelatedProductResponse(BaseModel):
+    product_id: int
+    score: float  # Cosine similarity of the two products' order sets
+    orders_together: int
+
+
 class AddProductToOrderRequest(BaseModel):
     product_id: int
 